@@ -1,23 +1,55 @@
 # app.py - CORREÇÃO CORS
 
 import os
-import io
 import json
+import base64
+import hashlib
+import random
 import re
-import google.generativeai as genai
-import stripe
-import replicate
-from flask import Flask, request, jsonify, send_file, make_response
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, jsonify, send_file, make_response, g, has_request_context
 from flask_cors import CORS, cross_origin
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from cache import build_response_cache, make_key
+from streaming import wants_stream, sse_response
+from jobs import build_job_queue, QueueFull
+from replicate_backend import get_replicate_backend, SDXL_VERSION
+from image_store import build_image_store, prompt_key
+from credits import CreditLedger
+from ingest import ingest_document
+from docx_render import build_docx_renderer
+from spreadsheet import SpreadsheetBuilder
+from webhooks import build_webhook_processor
+from pdf_extract import PdfTooLarge, build_pdf_extractor, spool_upload
+from embedding_cache import build_embedding_cache
+from history_writer import build_history_writer
+from http_pool import pooled_supabase
+import metrics
+from metrics import track, TimedModel, TimedSupabase
+from model_limiter import BULK, INTERACTIVE, NORMAL, LimitedModel, build_limiters, request_budget
+from model_limiter import DeadlineExceeded as ModelDeadlineExceeded
+from services import registry as services
+from transcripts import build_transcript_service, extract_video_id
+from summarizer import Summarizer, estimate_tokens, merge_overlapping
+from context_builder import build_context_builder, record_prompt, strip_boilerplate
+import structured
 
-# ... resto dos imports ...
+# SDKs pesados (google.generativeai, stripe, supabase, replicate, pytube, docx, openpyxl, pypdf)
+# são importados só no primeiro uso: veja services.py e os imports dentro das rotas.
 
 load_dotenv() 
 
 app = Flask(__name__)
 
+# Atrás do proxy TLS da hospedagem: esquema/host vêm de X-Forwarded-*, senão request.host_url
+# (usado nas URLs de /images quando PUBLIC_BASE_URL não está definido) sai como http://.
+# Desligado por padrão: sem proxy na frente, o cliente forjaria esses headers. Ligar no deploy.
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES, x_host=TRUSTED_PROXIES)
+
 # --- CONFIGURAÇÃO CORS CORRETA ---
 # Isso deve vir ANTES de todas as rotas
 CORS(app, 
@@ -54,54 +86,315 @@ stripe_key = os.environ.get("STRIPE_SECRET_KEY")
 endpoint_secret = os.environ.get('STRIPE_WEBHOOK_SECRET')
 frontend_url = os.environ.get("FRONTEND_URL", "*")
 
-if stripe_key: stripe.api_key = stripe_key
+MODEL_NAME = 'gemini-2.5-flash'
+
+def make_stripe():
+    import stripe
+    if stripe_key: stripe.api_key = stripe_key
+    return stripe
 
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-if url and key:
-    supabase: Client = create_client(url, key)
-else:
-    print("ERRO: Supabase não configurado.")
-    supabase = None
+def make_supabase():
+    url: str = os.environ.get("SUPABASE_URL")
+    key: str = os.environ.get("SUPABASE_KEY")
+    if not (url and key):
+        print("ERRO: Supabase não configurado.")
+        return None
+    from supabase import create_client
+    return TimedSupabase(pooled_supabase(create_client(url, key)))
 
-try:
+def make_genai():
+    import google.generativeai as genai
     genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
-    model = genai.GenerativeModel('gemini-2.5-flash')
-except Exception as e:
-    print(f"Erro Gemini: {e}")
-    model = None
+    return genai
+
+def make_model():
+    return LimitedModel(TimedModel(genai.GenerativeModel(MODEL_NAME)), model_limiters.get(MODEL_NAME))
+
+services.register('stripe', make_stripe, imports=['stripe'])
+services.register('supabase', make_supabase, imports=['supabase'])
+services.register('genai', make_genai, imports=['google.generativeai'])
+services.register('model', make_model)
+
+stripe = services.lazy('stripe')
+supabase = services.lazy('supabase')
+genai = services.lazy('genai')
+model = services.lazy('model')
+
+# --- CACHE DE RESPOSTAS ---
+# Chave = prompt final normalizado + modelo. Créditos continuam sendo cobrados normalmente.
+response_cache = build_response_cache()
+
+def generate_text(prompt, **kwargs):
+    key = make_key(MODEL_NAME, prompt)
+    return response_cache.get_or_compute(key, lambda: model.generate_content(prompt, **kwargs).text)
+
+def stream_text(prompt, **kwargs):
+    key = make_key(MODEL_NAME, prompt)
+    cached = response_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    for chunk in model.generate_content(prompt, stream=True, **kwargs):
+        try: piece = chunk.text
+        except ValueError: continue  # chunk sem texto (ex.: bloqueio de segurança)
+        if piece:
+            parts.append(piece)
+            yield piece
+    response_cache.set(key, "".join(parts))
+
+# Resposta padrão das rotas de texto: JSON direto ou SSE (?stream=1).
+# build(text) monta o corpo; on_done(text) roda uma vez ao final (ex.: salvar histórico).
+def respond_text(prompt, build, on_done=None):
+    def finalize(text):
+        if on_done: on_done(text)
+        return build(text)
+    if wants_stream():
+        return sse_response(stream_text(prompt), finalize, on_error=lambda e: refund_credit_charges(take_credit_charges()))
+    return jsonify(finalize(generate_text(prompt)))
+
+# Mesma resposta do respond_text para um texto já pronto (ex.: vindo de cache)
+def respond_static(text, build):
+    if wants_stream(): return sse_response(iter([text]), build)
+    return jsonify(build(text))
+
+# Ferramentas JSON (structured.py): schema no prompt, campos emitidos via SSE assim que fecham
+# (eventos 'field' e 'item') e resultado parcial mantido se o JSON final vier quebrado.
+def respond_json(task, schema_name, fallback_key, on_done=None):
+    prompt = structured.build_prompt(task, schema_name)
+    config = structured.generation_config()
+    kwargs = {'generation_config': config} if config is not None else {}
+    parser = structured.JsonStream()
+
+    def finalize(text):
+        if on_done: on_done(text)
+        return structured.finalize(text, parser, fallback_key, schema_name)
+
+    if wants_stream():
+        def watch(chunk):
+            for event in parser.feed(chunk):
+                if event[0] == 'field': yield 'field', {'key': event[1], 'value': event[2]}
+                else: yield 'item', {'key': event[1], 'index': event[2], 'value': event[3]}
+        return sse_response(stream_text(prompt, **kwargs), finalize, watch=watch,
+                            on_error=lambda e: refund_credit_charges(take_credit_charges()))
+    text = generate_text(prompt, **kwargs)
+    parser.feed(text)
+    return jsonify(finalize(text))
+
+# --- HISTÓRICO EM SEGUNDO PLANO ---
+# Inserts do user_history vão para uma fila e são gravados em lote (history_writer.py)
+history_writer = build_history_writer(lambda: supabase)
+
+# --- RESUMO MAP-REDUCE PARA TEXTOS LONGOS (summarizer.py) ---
+summarizer = Summarizer(
+    generate_text,
+    chunk_tokens=int(os.environ.get('SUMMARY_CHUNK_TOKENS', 8000)),
+    fan_out=int(os.environ.get('SUMMARY_FAN_OUT', 4)),
+    fan_in=int(os.environ.get('SUMMARY_FAN_IN', 6)),
+    max_input_tokens=int(os.environ.get('SUMMARY_MAX_INPUT_TOKENS', 400000)),
+)
+
+# --- ORÇAMENTO DE PROMPT (context_builder.py) ---
+# Teto de tokens do prompt final por rota: o contexto é escolhido (ou resumido) para caber nele.
+# Tamanho e orçamento de cada prompt vão para o log e para o histograma prompt_tokens.
+context_builder = build_context_builder()
+ASK_CONTEXT_CANDIDATES = int(os.environ.get('ASK_CONTEXT_CANDIDATES', 12))
+PROMPT_BUDGETS = {
+    '/ask-document': int(os.environ.get('PROMPT_BUDGET_ASK', 3000)),
+    '/ask-document:full': int(os.environ.get('PROMPT_BUDGET_ASK_FULL', 8000)),
+    '/summarize-text': int(os.environ.get('PROMPT_BUDGET_SUMMARY', 8000)),
+    '/summarize-video': int(os.environ.get('PROMPT_BUDGET_VIDEO', 8000)),
+}
+
+def prompt_budget(variant=None):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    if route == '/chat-pdf': route = '/ask-document'
+    key = f"{route}:{variant}" if variant else route
+    return key, PROMPT_BUDGETS.get(key, summarizer.chunk_tokens)
+
+# --- TRANSCRIÇÕES DO YOUTUBE (cache por video_id) ---
+transcripts = build_transcript_service()
+
+# --- EXTRAÇÃO DE PDF (pdf_extract.py: upload em disco, páginas sob demanda) ---
+pdf_extractor = build_pdf_extractor()
+
+# --- DOCX (docx_render.py: template carregado uma vez por processo) ---
+docx_renderer = build_docx_renderer()
+
+# --- PLANILHAS (spreadsheet.py: linhas em streaming, páginas de SPREADSHEET_ROWS_PER_CALL) ---
+spreadsheet_builder = SpreadsheetBuilder(
+    stream_text,
+    max_rows=int(os.environ.get('SPREADSHEET_MAX_ROWS', 5000)),
+    rows_per_call=int(os.environ.get('SPREADSHEET_ROWS_PER_CALL', 200)),
+    max_sheets=int(os.environ.get('SPREADSHEET_MAX_SHEETS', 5)),
+)
+
+# --- JOBS DE IMAGEM ---
+job_queue = build_job_queue()
+replicate_backend = get_replicate_backend()
+
+# --- IMAGENS GERADAS (image_store.py: arquivo por sha256, miniatura, índice de prompts) ---
+image_store = build_image_store()
+IMAGE_CACHE_MAX_AGE = int(os.environ.get('IMAGE_CACHE_MAX_AGE', 365 * 86400))
+
+def image_result(blob, base_url, prompt, cached=False):
+    return {'success': True, 'image_url': f"{base_url}/images/{blob['digest']}",
+            'thumbnail_url': f"{base_url}/images/{blob['thumb']}" if blob.get('thumb') else None,
+            'prompt': prompt, 'cached': cached}
 
 # --- FUNÇÃO DE CRÉDITOS ---
-def check_and_deduct_credit(user_id):
-    try:
-        if not supabase: return False, "Erro de banco de dados."
-        response = supabase.table('profiles').select('credits, is_pro').eq('id', user_id).execute()
-        
-        if not response.data: return False, "Usuário não encontrado."
-        
-        user_data = response.data[0]
-        credits = user_data.get('credits', 0)
-        is_pro = user_data.get('is_pro', False) 
-        
-        if is_pro: return True, "Sucesso (VIP)"
-        if credits <= 0: return False, "Sem créditos."
-            
-        new_credits = credits - 1
-        supabase.table('profiles').update({'credits': new_credits}).eq('id', user_id).execute()
-        return True, "Sucesso"
-    except Exception as e: return False, str(e)
+# Débito atômico via RPC (sql/credits.sql). VIPs ficam em cache por CREDITS_PRO_TTL segundos.
+credit_ledger = CreditLedger(lambda: supabase, pro_ttl=int(os.environ.get('CREDITS_PRO_TTL', 60)))
+
+def check_and_deduct_credit(user_id, amount=1):
+    # Itens do /batch já foram cobrados de uma vez só
+    if has_request_context() and g.get('credit_prepaid'): return True, "Sucesso (lote)"
+    if not supabase: return False, "Erro de banco de dados."
+    ok, message, charged = credit_ledger.charge(user_id, amount)
+    if charged and has_request_context():
+        g.credit_charges = getattr(g, 'credit_charges', []) + [(user_id, charged)]
+    return ok, message
+
+# Retira as cobranças da requisição atual (para estornar fora dela, ex.: jobs)
+def take_credit_charges():
+    charges = getattr(g, 'credit_charges', [])
+    g.credit_charges = []
+    return charges
+
+def refund_credit_charges(charges):
+    for user_id, amount in charges:
+        credit_ledger.refund(user_id, amount)
+
+@app.after_request
+def refund_failed_request(response):
+    # Se o modelo falhou (5xx) depois da cobrança, devolve o crédito
+    if response.status_code >= 500: refund_credit_charges(take_credit_charges())
+    return response
 
 # --- EMBEDDINGS ---
+EMBEDDING_MODEL = "models/text-embedding-004"
+embedding_cache = build_embedding_cache(EMBEDDING_MODEL)
+
+def embed_uncached(texts):
+    texts = list(texts)
+    def call():
+        with track('gemini', 'embed_content', sum(len(t.encode('utf-8')) for t in texts)):
+            return genai.embed_content(model=EMBEDDING_MODEL, content=texts)
+    return model_limiters.get(EMBEDDING_MODEL).run(call, *request_budget())['embedding']
+
 def get_embedding(text):
+    try: return embedding_cache.embed(text, embed_uncached)
+    except Exception as e:
+        # Falha já contabilizada em embedding_cache.failures
+        print(f"Erro ao gerar embedding: {e}")
+        return None
+
+# --- ÍNDICE VETORIAL LOCAL (opcional: VECTOR_INDEX=local) ---
+# Sem ele, ou se falhar, a busca continua pela RPC match_documents.
+vector_index = None
+if os.environ.get('VECTOR_INDEX', '').lower() == 'local':
     try:
-        result = genai.embed_content(model="models/text-embedding-004", content=text)
-        return result['embedding']
-    except: return None
+        from vector_index import VectorIndex, supabase_chunk_loader, supabase_chunk_version
+        vector_index = VectorIndex(
+            supabase_chunk_loader(lambda: supabase),
+            version=supabase_chunk_version(lambda: supabase),
+            max_users=int(os.environ.get('VECTOR_INDEX_MAX_USERS', 64)),
+            max_bytes=int(os.environ.get('VECTOR_INDEX_MAX_BYTES', 512 * 1024 * 1024)),
+            ttl=int(os.environ.get('VECTOR_INDEX_TTL', 600)),
+        )
+    except ImportError as e: print(f"Índice vetorial local indisponível: {e}")
+
+def match_chunks(user_id, q_emb, threshold=0.5, count=3):
+    if vector_index is not None:
+        try: return vector_index.search(user_id, q_emb, k=count, threshold=threshold)
+        except Exception as e: print(f"Erro no índice local, usando RPC: {e}")
+    params = {'query_embedding': q_emb, 'match_threshold': threshold, 'match_count': count, 'user_id_filter': user_id}
+    return supabase.rpc('match_documents', params).execute().data
+
+# Lote de textos: só os ausentes do cache vão para a API (erros sobem para o retry da ingestão)
+def get_embeddings(texts):
+    return embedding_cache.embed_many(texts, embed_uncached)
+
+# --- MÉTRICAS (metrics.py) ---
+SERVER_TIMING_SAMPLE_RATE = float(os.environ.get('SERVER_TIMING_SAMPLE_RATE', 0))
+
+in_flight = metrics.InFlight()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    in_flight.enter()
+    g.in_flight = True
+
+@app.teardown_request
+def leave_in_flight(error=None):
+    if g.pop('in_flight', False): in_flight.leave()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None: return response
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    if route != '/metrics':
+        # Em respostas SSE isso mede o tempo até o primeiro byte, não a geração inteira
+        metrics.record_route(route, request.method, response.status_code, elapsed,
+                             request.content_length, response.content_length)
+    if SERVER_TIMING_SAMPLE_RATE and random.random() < SERVER_TIMING_SAMPLE_RATE:
+        response.headers['Server-Timing'] = metrics.server_timing_header(elapsed)
+        response.headers['Timing-Allow-Origin'] = 'https://gerador-prompt-frontend-rc35.vercel.app'
+    return response
+
+# --- LIMITADOR DO GEMINI (model_limiter.py) ---
+# Ferramentas em que o usuário está esperando na tela passam na frente das em lote.
+model_limiters = build_limiters()
+MODEL_REQUEST_DEADLINE = float(os.environ.get('MODEL_REQUEST_DEADLINE', 90))
+ROUTE_PRIORITY = {
+    '/generate-prompt': INTERACTIVE, '/generate-veo3-prompt': INTERACTIVE, '/ask-document': INTERACTIVE,
+    '/chat-pdf': INTERACTIVE, '/corporate-translator': INTERACTIVE, '/mock-interview': INTERACTIVE,
+    '/summarize-video': BULK, '/summarize-text': BULK, '/generate-spreadsheet': BULK,
+    '/upload-document': BULK, '/batch': BULK,
+}
+
+@app.before_request
+def set_model_budget():
+    route = request.url_rule.rule if request.url_rule else None
+    g.model_priority = ROUTE_PRIORITY.get(route, NORMAL)
+    # O cliente pode pedir um prazo menor (ex.: o front desiste em 20 s)
+    budget = MODEL_REQUEST_DEADLINE
+    try: budget = min(budget, float(request.headers.get('X-Request-Deadline-Ms', 0)) / 1000 or budget)
+    except ValueError: pass
+    g.model_deadline = time.monotonic() + budget
+
+@app.after_request
+def model_unavailable_status(response):
+    error = g.get('model_unavailable')
+    if error is None or response.status_code != 500: return response
+    response.status_code = 504 if isinstance(error, ModelDeadlineExceeded) else 503
+    response.headers['Retry-After'] = str(max(1, int(round(getattr(error, 'retry_after', None) or 1))))
+    return response
+
+metrics.registry.gauge('http_in_flight', in_flight.stats, 'Requisições simultâneas neste worker (atual e pico)')
+metrics.registry.gauge('model_limiter', lambda: model_limiters.stats(), 'Limitador do Gemini por modelo')
+metrics.registry.gauge('response_cache', response_cache.stats, 'Contadores do cache de respostas')
+metrics.registry.gauge('embedding_cache', embedding_cache.stats, 'Contadores do cache de embeddings')
+metrics.registry.gauge('history_writer', history_writer.stats, 'Fila de gravação do histórico')
+metrics.registry.gauge('transcript_cache', transcripts.stats, 'Cache de transcrições do YouTube')
+metrics.registry.gauge('image_jobs', job_queue.stats, 'Jobs de imagem pendentes')
+metrics.registry.gauge('image_store', lambda: image_store.stats() if image_store else {}, 'Imagens guardadas e reaproveitadas pelo índice de prompts')
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return app.response_class(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def health_check():
     return jsonify({'status': 'ok', 'service': 'Adapta IA Backend'})
 
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({'responses': response_cache.stats(), 'embeddings': embedding_cache.stats()})
+
 # ==============================================================================
 #  ROTAS (Sem 'OPTIONS' no methods, pois o before_request cuida disso)
 # ==============================================================================
@@ -121,8 +414,10 @@ def generate_prompt():
         idea = data.get('idea') or data.get('prompt') or data.get('text')
         if not idea: return jsonify({'error': 'Ideia vazia'}), 400
 
-        response = model.generate_content(f"Crie prompt imagem (SDXL/Midjourney) em Inglês: {idea}")
-        return jsonify({'advanced_prompt': response.text, 'prompt': response.text})
+        return respond_text(
+            f"Crie prompt imagem (SDXL/Midjourney) em Inglês: {idea}",
+            lambda text: {'advanced_prompt': text, 'prompt': text}
+        )
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 # 2. VEO 3 & SORA 2 (Foco do erro)
@@ -163,12 +458,10 @@ def generate_video_prompt():
         Output: APENAS o prompt em Inglês.
         """
         
-        response = model.generate_content(prompt)
-        
-        # Salvar no histórico
-        if user_id and supabase:
-            try:
-                supabase.table('user_history').insert({
+        # Salvar no histórico (no modo streaming, só depois do último chunk)
+        def save_history(response_text):
+            if user_id and supabase:
+                history_writer.enqueue({
                     'user_id': user_id,
                     'tool_type': 'video_prompt',
                     'tool_name': f'Gerador Prompt {target_model}',
@@ -179,16 +472,14 @@ def generate_video_prompt():
                         'lighting': lighting,
                         'audio': audio
                     })[:500],
-                    'output_data': str(response.text)[:2000]
-                }).execute()
-            except Exception as e:
-                print(f"Erro ao salvar histórico: {e}")
-                
-        return jsonify({
-            'advanced_prompt': response.text, 
-            'prompt': response.text,
+                    'output_data': str(response_text)[:2000]
+                })
+
+        return respond_text(prompt, lambda text: {
+            'advanced_prompt': text, 
+            'prompt': text,
             'status': 'success'
-        })
+        }, on_done=save_history)
         
     except Exception as e: 
         print(f"Erro na rota /generate-veo3-prompt: {e}")
@@ -206,21 +497,23 @@ def summarize_video():
             if not s: return jsonify({'error': m}), 402
 
         video_url = data.get('url') or data.get('video_url')
-        try:
-            yt = YouTube(video_url)
-            caption = yt.captions.get_by_language_code('pt')
-            if not caption: caption = yt.captions.get_by_language_code('en')
-            if not caption: caption = yt.captions.get_by_language_code('a.pt') 
-            
-            if not caption: text = f"Título: {yt.title}. Desc: {yt.description}"
-            else:
-                xml = caption.xml_captions
-                root = ET.fromstring(xml)
-                text = " ".join([elem.text for elem in root.iter('text') if elem.text])
+        video_id = extract_video_id(video_url)
+        if not video_id: return jsonify({'error': 'Erro vídeo: URL do YouTube inválida'}), 400
+        language = data.get('language') or 'pt'
+        build = lambda summary: {'summary': summary, 'video_id': video_id}
+
+        # Resumo já gerado para este vídeo/idioma: responde na hora
+        cached = transcripts.get_summary(video_id, language)
+        if cached: return respond_static(cached, build)
+
+        try: text = transcripts.get_transcript(video_id)['text']
         except Exception as e: return jsonify({'error': f"Erro vídeo: {str(e)}"}), 400
-        
-        response = model.generate_content(f"Resuma: {text[:30000]}")
-        return jsonify({'summary': response.text})
+
+        route, budget = prompt_budget()
+        prompt = summarizer.build_prompt(strip_boilerplate(text), "Resuma" if language == 'pt' else f"Resuma em {language}",
+                                         budget=budget)
+        record_prompt(route, prompt, budget, input_tokens=estimate_tokens(text))
+        return respond_text(prompt, build, on_done=lambda summary: transcripts.save_summary(video_id, language, summary))
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 # 4. ABNT
@@ -234,8 +527,7 @@ def format_abnt():
             if not s: return jsonify({'error': m}), 402
         
         text = data.get('text') or data.get('reference')
-        response = model.generate_content(f"Formate ABNT: {text}")
-        return jsonify({'formatted_text': response.text})
+        return respond_text(f"Formate ABNT: {text}", lambda out: {'formatted_text': out})
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 # 5. RESUMIDOR DE TEXTO
@@ -251,8 +543,10 @@ def summarize_text():
         text = data.get('text') or data.get('content', '')
         if len(text) < 10: return jsonify({'error': 'Texto curto'}), 400
         
-        response = model.generate_content(f"Resuma ({data.get('format','bulletpoints')}): {text[:15000]}")
-        return jsonify({'summary': response.text})
+        route, budget = prompt_budget()
+        prompt = summarizer.build_prompt(strip_boilerplate(text), f"Resuma ({data.get('format','bulletpoints')})", budget=budget)
+        record_prompt(route, prompt, budget, input_tokens=estimate_tokens(text))
+        return respond_text(prompt, lambda summary: {'summary': summary})
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 # 6. DOWNLOAD DOCX
@@ -261,11 +555,8 @@ def download_docx():
     try:
         data = request.get_json(force=True) or {}
         if isinstance(data, str): data = json.loads(data)
-        doc = Document()
-        doc.add_paragraph(data.get('markdown_text') or data.get('text', ''))
-        f = io.BytesIO()
-        doc.save(f)
-        f.seek(0)
+        # Markdown -> títulos, listas, tabelas (docx_render.py); o arquivo sai em blocos
+        f = docx_renderer.render_to_file(data.get('markdown_text') or data.get('text', ''))
         return send_file(f, as_attachment=True, download_name='doc.docx', mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
     except Exception as e: return jsonify({'error': str(e)}), 500
 
@@ -275,29 +566,21 @@ def generate_spreadsheet():
     try:
         data = request.get_json(force=True) or {}
         if isinstance(data, str): data = json.loads(data)
+        try: rows, sheets = int(data.get('rows') or 20), int(data.get('sheets') or 1)
+        except (TypeError, ValueError): return jsonify({'error': 'rows/sheets inválidos'}), 400
         if data.get('user_id'):
             s, m = check_and_deduct_credit(data.get('user_id'))
             if not s: return jsonify({'error': m}), 402
 
-        prompt = f"""
-        Crie planilha Excel para: "{data.get('description') or data.get('text')}"
-        Formato: Célula|Valor
-        Ex: A1|Título
-        Gere 5 linhas.
-        """
-        response = model.generate_content(prompt)
-        wb = Workbook()
-        ws = wb.active
-        for line in response.text.split('\n'):
-            if '|' in line:
-                parts = line.split('|')
-                if len(parts) >= 2:
-                    try: ws[parts[0].strip()] = parts[1].strip()
-                    except: pass
-        f = io.BytesIO()
-        wb.save(f)
-        f.seek(0)
-        return send_file(f, as_attachment=True, download_name='planilha.xlsx', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        # Linhas estruturadas (CSV por aba) lidas conforme o modelo gera -> xlsx write-only ou CSV
+        fmt = 'csv' if data.get('format') == 'csv' else 'xlsx'
+        f, sink, counts = spreadsheet_builder.build(
+            data.get('description') or data.get('text'),
+            rows=rows, sheets=sheets, fmt=fmt,
+        )
+        response = send_file(f, as_attachment=True, download_name=f'planilha.{sink.extension}', mimetype=sink.mimetype)
+        response.headers['X-Spreadsheet-Rows'] = json.dumps(counts, ensure_ascii=True)
+        return response
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 # 8. UPLOAD PDF
@@ -307,21 +590,39 @@ def upload_document():
         user_id = request.form.get('user_id')
         file = request.files.get('file')
         if not user_id or not file: return jsonify({'error': 'Dados faltando'}), 400
-        s, m = check_and_deduct_credit(user_id)
-        if not s: return jsonify({'error': m}), 402
 
-        reader = PdfReader(file)
-        text = "".join([page.extract_text() + "\n" for page in reader.pages])
-        doc = supabase.table('documents').insert({'user_id': user_id, 'filename': file.filename}).execute()
-        
-        # Embeddings simplificados
-        if len(text) > 0:
-            emb = get_embedding(text[:1000]) # Pega só o começo pra não estourar cota no teste
-            if emb: supabase.table('document_chunks').insert({'document_id': doc.data[0]['id'], 'content': text[:1000], 'embedding': emb}).execute()
-            
-        return jsonify({'message': 'OK', 'document_id': doc.data[0]['id']})
+        # Upload vai para disco em blocos; as páginas são extraídas sob demanda durante a ingestão.
+        # O tamanho é validado antes da cobrança: um 413 não consome crédito.
+        try: path = spool_upload(file, pdf_extractor.max_bytes)
+        except PdfTooLarge as e: return jsonify({'error': str(e)}), 413
+        try:
+            s, m = check_and_deduct_credit(user_id)
+            if not s: return jsonify({'error': m}), 402
+            total_pages = pdf_extractor.page_count(path)
+            doc = supabase.table('documents').insert({'user_id': user_id, 'filename': file.filename}).execute()
+            document_id = doc.data[0]['id']
+
+            # Páginas -> chunks sobrepostos -> embeddings em lote -> insert em massa, por janelas
+            stats = ingest_document(
+                supabase, document_id, pdf_extractor.iter_pages(path, total_pages), get_embeddings,
+                chunk_size=int(os.environ.get('INGEST_CHUNK_SIZE', 1000)),
+                overlap=int(os.environ.get('INGEST_CHUNK_OVERLAP', 200)),
+                batch_size=int(os.environ.get('INGEST_EMBED_BATCH', 32)),
+                max_concurrency=int(os.environ.get('INGEST_EMBED_CONCURRENCY', 4)),
+                on_rows=(lambda rows: vector_index.add(user_id, rows)) if vector_index is not None else None,
+            )
+        finally: pdf_extractor.cleanup(path)
+        stats['truncated'] = total_pages > pdf_extractor.max_pages
+        return jsonify(dict(stats, message='OK', document_id=document_id))
     except Exception as e: return jsonify({'error': str(e)}), 500
 
+def load_document_text(document_id, user_id):
+    doc = supabase.table('documents').select('id').eq('id', document_id).eq('user_id', user_id).execute()
+    if not doc.data: return None
+    rows = supabase.table('document_chunks').select('content, chunk_index') \
+        .eq('document_id', document_id).order('chunk_index').execute().data or []
+    return merge_overlapping([r['content'] for r in rows])
+
 # 9. CHAT PDF
 @app.route('/ask-document', methods=['POST'])
 @app.route('/chat-pdf', methods=['POST'])
@@ -332,20 +633,38 @@ def ask_document():
         
         question = data.get('question') or data.get('query') or data.get('text')
         user_id = data.get('user_id')
-        
-        context = ""
+
+        # mode=full: responde sobre o documento inteiro (map-reduce) em vez dos trechos mais parecidos
+        if data.get('mode') == 'full' and data.get('document_id') and user_id and supabase:
+            text = load_document_text(data['document_id'], user_id)
+            if text is None: return jsonify({'error': 'Documento não encontrado'}), 404
+            # Map-reduce sobre o documento inteiro (várias chamadas ao modelo): cobra como as outras ferramentas
+            s, m = check_and_deduct_credit(user_id)
+            if not s: return jsonify({'error': m}), 402
+            route, budget = prompt_budget('full')
+            prompt = summarizer.build_prompt(
+                strip_boilerplate(text), f"Responda à pergunta usando o documento. Pergunta: {question}. Documento",
+                map_instruction=f"Extraia deste trecho tudo que ajuda a responder: {question}",
+                reduce_instruction=f"Combine estas anotações (em ordem) relevantes para: {question}",
+                budget=budget,
+            )
+            record_prompt(route, prompt, budget, input_tokens=estimate_tokens(text))
+            return respond_text(prompt, lambda answer: {'answer': answer})
+
+        # Mais candidatos do que cabem; o context_builder limpa, tira repetidos e enche o orçamento por MMR
+        context, report = "", {}
+        route, budget = prompt_budget()
         if user_id:
             q_emb = get_embedding(question)
             if q_emb:
                 try:
-                    params = {'query_embedding': q_emb, 'match_threshold': 0.5, 'match_count': 3, 'user_id_filter': user_id}
-                    matches = supabase.rpc('match_documents', params).execute().data
-                    context = "\n".join([m['content'] for m in matches])
-                except: pass
+                    matches = match_chunks(user_id, q_emb, count=ASK_CONTEXT_CANDIDATES)
+                    context, report = context_builder.build(matches, budget - estimate_tokens(f"Contexto: \nPergunta: {question}"))
+                except Exception as e: print(f"Erro ao montar contexto: {e}")
 
         prompt = f"Contexto: {context}\nPergunta: {question}" if context else f"Pergunta: {question}"
-        resp = model.generate_content(prompt)
-        return jsonify({'answer': resp.text})
+        record_prompt(route, prompt, budget, **report)
+        return respond_text(prompt, lambda answer: {'answer': answer})
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 # 10. TRADUTOR
@@ -360,8 +679,10 @@ def corporate_translator():
         
         text = data.get('text') or data.get('content')
         lang = data.get('target_lang') or 'português'
-        resp = model.generate_content(f"Traduza corporativamente para {lang}: {text}")
-        return jsonify({'translated_text': resp.text, 'translation': resp.text})
+        return respond_text(
+            f"Traduza corporativamente para {lang}: {text}",
+            lambda out: {'translated_text': out, 'translation': out}
+        )
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 # 11. SOCIAL MEDIA
@@ -375,13 +696,7 @@ def generate_social_media():
             if not s: return jsonify({'error': m}), 402
 
         text = data.get('text') or data.get('topic')
-        resp = model.generate_content(f"Crie 3 posts (Insta, Linkedin, Twitter) JSON sobre: {text}")
-        
-        try: # Tenta extrair JSON
-            txt = resp.text.replace("```json", "").replace("```", "").strip()
-            if "{" in txt: txt = txt[txt.find("{"):txt.rfind("}")+1]
-            return jsonify(json.loads(txt))
-        except: return jsonify({'content': resp.text})
+        return respond_json(f"Crie 3 posts (Instagram, LinkedIn, Twitter) sobre: {text}", 'social-media', 'content')
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 # 12. REDAÇÃO
@@ -395,12 +710,7 @@ def correct_essay():
             if not s: return jsonify({'error': m}), 402
 
         essay = data.get('essay') or data.get('text')
-        resp = model.generate_content(f"Corrija redação JSON (nota, erros): {essay}")
-        try:
-            txt = resp.text.replace("```json", "").replace("```", "").strip()
-            if "{" in txt: txt = txt[txt.find("{"):txt.rfind("}")+1]
-            return jsonify(json.loads(txt))
-        except: return jsonify({'correction': resp.text})
+        return respond_json(f"Corrija a redação (nota, erros e comentário geral): {essay}", 'essay', 'correction')
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 # 13. ENTREVISTA
@@ -416,12 +726,8 @@ def mock_interview():
         role = data.get('role')
         desc = data.get('description') or data.get('company')
 
-        resp = model.generate_content(f"Simule entrevista JSON para {role}")
-        try:
-            txt = resp.text.replace("```json", "").replace("```", "").strip()
-            if "{" in txt: txt = txt[txt.find("{"):txt.rfind("}")+1]
-            return jsonify(json.loads(txt))
-        except: return jsonify({'message': resp.text})
+        task = f"Simule uma entrevista de emprego para {role}" + (f" ({desc})" if desc else "")
+        return respond_json(task, 'interview', 'message')
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 # 14. ESTUDO
@@ -435,12 +741,7 @@ def generate_study_material():
             if not s: return jsonify({'error': m}), 402
 
         text = data.get('text') or data.get('topic')
-        resp = model.generate_content(f"Crie material estudo sobre: {text}")
-        try:
-            txt = resp.text.replace("```json", "").replace("```", "").strip()
-            if "{" in txt: txt = txt[txt.find("{"):txt.rfind("}")+1]
-            return jsonify(json.loads(txt))
-        except: return jsonify({'material': resp.text})
+        return respond_json(f"Crie material de estudo sobre: {text}", 'study-material', 'material')
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 # 15. CARTA
@@ -454,11 +755,10 @@ def generate_cover_letter():
             if not s: return jsonify({'error': m}), 402
         
         job = data.get('job_desc') or 'Vaga'
-        resp = model.generate_content(f"Crie Cover Letter para {job}")
-        return jsonify({'cover_letter': resp.text})
+        return respond_text(f"Crie Cover Letter para {job}", lambda out: {'cover_letter': out})
     except Exception as e: return jsonify({'error': str(e)}), 500
 
-# 16. IMAGEM (Replicate)
+# 16. IMAGEM (Replicate) - assíncrono: devolve job_id e o cliente consulta /jobs/<id>
 @app.route('/generate-image', methods=['POST'])
 def generate_image():
     try:
@@ -470,18 +770,181 @@ def generate_image():
 
         prompt = data.get('prompt') or data.get('text') or data.get('idea')
         if not prompt or len(prompt) < 5: return jsonify({'error': 'Prompt curto'}), 400
+        user_id = data.get('user_id')
+        width, height = 1024, 1024
+        key = prompt_key(prompt, SDXL_VERSION, width, height)
+        # A resposta do job roda fora da requisição: a URL pública é fixada agora
+        base_url = (os.environ.get('PUBLIC_BASE_URL') or request.host_url).rstrip('/')
 
-        output = replicate.run(
-            "stability-ai/sdxl:39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b",
-            input={"prompt": prompt, "width": 1024, "height": 1024}
-        )
-        url = output[0] if isinstance(output, list) else output
-        if supabase and data.get('user_id'):
-            supabase.table('image_history').insert({'user_id': data['user_id'], 'prompt': prompt[:500], 'image_url': url}).execute()
-        return jsonify({'success': True, 'image_url': url, 'prompt': prompt})
+        def save_history(url):
+            if supabase and user_id:
+                supabase.table('image_history').insert({'user_id': user_id, 'prompt': prompt[:500], 'image_url': url}).execute()
+
+        # Mesmo prompt/modelo/tamanho gerado há pouco: devolve a imagem guardada, sem outra predição
+        try: existing = image_store.lookup(key) if image_store else None
+        except Exception as e:
+            print(f"Erro ao consultar índice de imagens: {e}")
+            existing = None
+        if existing:
+            result = image_result(existing, base_url, prompt, cached=True)
+            save_history(result['image_url'])
+            job = job_queue.completed('image', result, meta={'user_id': user_id})
+            return jsonify(dict(result, job_id=job['id'], status=job['status'], status_url=f"/jobs/{job['id']}"))
+
+        charges = take_credit_charges()
+
+        def run_prediction(job_id):
+            try:
+                with track('replicate', 'prediction'):
+                    output = replicate_backend.run(
+                        SDXL_VERSION,
+                        {"prompt": prompt, "width": width, "height": height},
+                        on_update=lambda pred_id, status: job_queue.store.update(job_id, prediction_id=pred_id, prediction_status=status)
+                    )
+            except Exception:
+                refund_credit_charges(charges)
+                raise
+            url = output[0] if isinstance(output, list) else output
+            # Baixa uma vez para o store (a URL do Replicate expira); se falhar, fica a URL original
+            if image_store is None:
+                result = {'success': True, 'image_url': url, 'prompt': prompt}
+                save_history(url)
+                return result
+            try:
+                with track('image_store', 'ingest'):
+                    blob = image_store.ingest_url(url)
+                image_store.remember(key, blob['digest'], prompt, SDXL_VERSION, width, height)
+                result = image_result(blob, base_url, prompt)
+            except Exception as e:
+                print(f"Erro ao guardar imagem {url}: {e}")
+                result = {'success': True, 'image_url': url, 'prompt': prompt}
+            save_history(result['image_url'])
+            return result
+
+        try: job = job_queue.submit('image', run_prediction, meta={'user_id': user_id})
+        except QueueFull as e:
+            refund_credit_charges(charges)
+            return jsonify({'error': str(e)}), 503
+        return jsonify({'success': True, 'job_id': job['id'], 'status': job['status'], 'status_url': f"/jobs/{job['id']}"}), 202
     except Exception as e: 
         return jsonify({'success': True, 'image_url': 'https://placehold.co/1024x1024/png?text=Erro+Replicate', 'error_detail': str(e)})
 
+# Imagens guardadas: o nome é o sha256 do conteúdo, então nunca mudam (ETag = hash, Range, cache de 1 ano)
+@app.route('/images/<digest>', methods=['GET'])
+def get_image(digest):
+    blob = image_store.blob(digest) if image_store else None
+    if blob is None: return jsonify({'error': 'Imagem não encontrada'}), 404
+    response = send_file(blob['path'], mimetype=blob['content_type'], conditional=True, etag=digest,
+                         max_age=IMAGE_CACHE_MAX_AGE)
+    response.headers['Cache-Control'] = f"public, max-age={IMAGE_CACHE_MAX_AGE}, immutable"
+    return response
+
+# --- JOBS ---
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    # ?wait=N faz long-poll de até N segundos esperando o job terminar. Máx. 20: bem abaixo dos 30 s
+    # de timeout do worker sync do gunicorn (padrão quando o gunicorn_conf.py não é usado)
+    try: wait = min(max(float(request.args.get('wait', 0)), 0), 20)
+    except ValueError: wait = 0
+    job = job_queue.get(job_id, wait=wait)
+    if not job: return jsonify({'error': 'Job não encontrado'}), 404
+    body = {'job_id': job['id'], 'status': job['status'], 'created_at': job['created_at'], 'updated_at': job['updated_at']}
+    if job.get('prediction_status'): body['prediction_status'] = job['prediction_status']
+    if job['status'] == 'succeeded': body.update(job['result'] or {})
+    if job['status'] == 'failed':
+        body.update({'image_url': 'https://placehold.co/1024x1024/png?text=Erro+Replicate', 'error_detail': job['error']})
+    return jsonify(body)
+
+# --- LOTE: várias ferramentas numa requisição ---
+BATCH_TOOLS = {
+    'generate-prompt', 'generate-veo3-prompt', 'summarize-video', 'format-abnt', 'summarize-text',
+    'ask-document', 'corporate-translator', 'generate-social-media', 'correct-essay',
+    'mock-interview', 'generate-study-material', 'generate-cover-letter', 'generate-image',
+}
+# Ferramentas cuja rota não cobra crédito: no lote também não contam (ask-document só no modo full cobra)
+BATCH_FREE_TOOLS = {'ask-document'}
+
+def batch_item_billable(item):
+    if item['tool'] == 'ask-document': return (item.get('payload') or {}).get('mode') == 'full'
+    return item['tool'] not in BATCH_FREE_TOOLS
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 10))
+batch_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('BATCH_WORKERS', 4)), thread_name_prefix='batch')
+
+# host_url da requisição /batch: o contexto de teste seria http://localhost/ (URLs de /images erradas)
+# charges: a parte da cobrança do lote que é deste item. Fica em g.credit_charges como numa requisição
+# avulsa, então rotas assíncronas (generate-image) levam a cobrança para o job e estornam se ele falhar.
+# Devolve (item, créditos estornados aqui por falha 5xx).
+def run_batch_item(tool, payload, host_url, charges):
+    started = time.perf_counter()
+    leftover = []
+    try:
+        with app.test_request_context(f'/{tool}', base_url=host_url, method='POST', json=payload):
+            g.credit_prepaid = True
+            g.credit_charges = list(charges)
+            g.model_priority = BULK
+            g.model_deadline = time.monotonic() + MODEL_REQUEST_DEADLINE
+            view = app.view_functions[request.url_rule.endpoint]
+            try: resp = app.make_response(view())
+            finally: leftover = take_credit_charges()
+        body = resp.get_json(silent=True)
+        item = {'tool': tool, 'status': resp.status_code}
+        if resp.status_code < 400: item['result'] = body
+        else: item['error'] = (body or {}).get('error', resp.status)
+    except Exception as e:
+        item = {'tool': tool, 'status': 500, 'error': str(e)}
+    item['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    refunded = 0
+    if item['status'] >= 500 and leftover:
+        refund_credit_charges(leftover)
+        refunded = sum(amount for _, amount in leftover)
+    return item, refunded
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    try:
+        data = request.get_json(force=True) or {}
+        if isinstance(data, str): data = json.loads(data)
+        items = data.get('items') or []
+        user_id = data.get('user_id')
+        if not isinstance(items, list) or not items: return jsonify({'error': 'Lote vazio'}), 400
+        if len(items) > BATCH_MAX_ITEMS: return jsonify({'error': f'Máximo de {BATCH_MAX_ITEMS} itens por lote'}), 400
+        for item in items:
+            if not isinstance(item, dict) or item.get('tool') not in BATCH_TOOLS:
+                return jsonify({'error': f"Ferramenta inválida: {item.get('tool') if isinstance(item, dict) else item}"}), 400
+            # Os itens rodam como pré-pagos: um user_id só no payload nunca seria cobrado
+            item_user = (item.get('payload') or {}).get('user_id') if isinstance(item.get('payload'), dict) else None
+            if item_user and item_user != user_id:
+                return jsonify({'error': 'user_id do item diferente do user_id do lote'}), 400
+
+        # Uma única operação no ledger para o lote inteiro (só os itens cobrados pela rota avulsa)
+        charged = 0
+        billable = sum(1 for item in items if batch_item_billable(item))
+        if user_id and billable:
+            if not supabase: return jsonify({'error': 'Erro de banco de dados.'}), 402
+            ok, message, charged = credit_ledger.charge(user_id, billable)
+            if not ok: return jsonify({'error': message}), 402
+
+        # Cada item cobrado carrega seu crédito (VIP: charged = 0, nada a estornar)
+        item_charges, remaining = [], charged
+        for item in items:
+            share = 1 if remaining and batch_item_billable(item) else 0
+            remaining -= share
+            item_charges.append([(user_id, share)] if share else [])
+
+        payloads = [dict(item.get('payload') or {}, user_id=user_id) if user_id else (item.get('payload') or {}) for item in items]
+        started = time.perf_counter()
+        outcomes = list(batch_executor.map(run_batch_item, [i['tool'] for i in items], payloads,
+                                           [request.host_url] * len(items), item_charges))
+        results = [item for item, _ in outcomes]
+        refunded = sum(r for _, r in outcomes)  # itens assíncronos (imagem) estornam no próprio job
+
+        return jsonify({
+            'results': results,
+            'charged': charged - refunded,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        })
+    except Exception as e: return jsonify({'error': str(e)}), 500
+
 # --- HISTÓRICO ---
 @app.route('/save-history', methods=['POST'])
 def save_history():
@@ -497,28 +960,87 @@ def save_history():
                 'output_data': str(data.get('output_data') or data.get('outputData') or '')[:2000],
                 'metadata': data.get('metadata', {})
             }
+            # Gravação em segundo plano; com a fila cheia grava na hora, como antes
+            if history_writer.enqueue(db_data): return jsonify({'status': 'success', 'data': [db_data], 'queued': True})
             res = supabase.table('user_history').insert(db_data).execute()
-            return jsonify({'status': 'success', 'data': res.data})
+            return jsonify({'status': 'success', 'data': res.data, 'queued': False})
         return jsonify({'status': 'skipped'})
     except Exception as e: return jsonify({'error': str(e)}), 500
 
+# Paginação por cursor em (created_at, id). Índice recomendado em sql/user_history.sql.
+HISTORY_LIST_FIELDS = 'id, tool_type, tool_name, created_at, preview'
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 100
+
+def encode_history_cursor(row):
+    raw = json.dumps([row['created_at'], row['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_history_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    created_at, item_id = json.loads(raw)
+    return created_at, item_id
+
+def history_keyset(query, cursor):
+    # postgrest-py 0.10 não tem or_() nem ordenação por várias colunas: monta os parâmetros direto
+    query.params = query.params.add('order', 'created_at.desc,id.desc')
+    if cursor:
+        created_at, item_id = cursor
+        query.params = query.params.add(
+            'or', f'(created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{item_id}"))'
+        )
+    return query
+
 @app.route('/get-history', methods=['POST', 'GET'])
 def get_history():
     try:
-        user_id = request.args.get('user_id')
-        tool_type = request.args.get('tool_type')
+        params = request.args
         if request.method == 'POST':
             data = request.get_json(force=True) or {}
             if isinstance(data, str): data = json.loads(data)
-            user_id = data.get('user_id')
-            tool_type = data.get('tool_type')
-
-        if supabase and user_id:
-            query = supabase.table('user_history').select('*').eq('user_id', user_id).order('created_at', desc=True)
-            if tool_type: query = query.eq('tool_type', tool_type)
-            res = query.execute()
-            return jsonify({'history': res.data})
-        return jsonify({'history': []})
+            params = data
+        user_id = params.get('user_id')
+        tool_type = params.get('tool_type')
+        mode = params.get('mode', 'full')  # 'list' = só id/ferramenta/nome/data/preview
+
+        try: limit = min(max(int(params.get('limit') or HISTORY_DEFAULT_LIMIT), 1), HISTORY_MAX_LIMIT)
+        except ValueError: return jsonify({'error': 'limit inválido'}), 400
+        try: cursor = decode_history_cursor(params['cursor']) if params.get('cursor') else None
+        except Exception: return jsonify({'error': 'cursor inválido'}), 400
+
+        if not (supabase and user_id): return jsonify({'history': [], 'next_cursor': None})
+
+        fields = HISTORY_LIST_FIELDS if mode == 'list' else '*'
+        query = supabase.table('user_history').select(fields).eq('user_id', user_id)
+        if tool_type: query = query.eq('tool_type', tool_type)
+        rows = history_keyset(query, cursor).limit(limit + 1).execute().data or []
+
+        next_cursor = encode_history_cursor(rows[limit - 1]) if len(rows) > limit else None
+        body = {'history': rows[:limit], 'next_cursor': next_cursor}
+
+        # ETag: se nada mudou desde a última carga, responde 304 sem corpo
+        etag = hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32]
+        if request.if_none_match.contains(etag):
+            resp = make_response('', 304)
+        else:
+            resp = jsonify(body)
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'private, no-cache'
+        return resp
+    except Exception as e: return jsonify({'error': str(e)}), 500
+
+@app.route('/history-writer-stats', methods=['GET'])
+def history_writer_stats():
+    return jsonify(history_writer.stats())
+
+@app.route('/history-item/<item_id>', methods=['GET'])
+def get_history_item(item_id):
+    try:
+        user_id = request.args.get('user_id')
+        if not (supabase and user_id): return jsonify({'error': 'Dados faltando'}), 400
+        res = supabase.table('user_history').select('*').eq('id', item_id).eq('user_id', user_id).execute()
+        if not res.data: return jsonify({'error': 'Item não encontrado'}), 404
+        return jsonify({'item': res.data[0]})
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 @app.route('/delete-history-item', methods=['POST'])
@@ -537,15 +1059,16 @@ def create_checkout_session():
     try:
         data = request.get_json(force=True) or {}
         if isinstance(data, str): data = json.loads(data)
-        session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{'price': os.environ.get('STRIPE_PRICE_ID'), 'quantity': 1}],
-            mode='subscription', 
-            success_url=f'{frontend_url}/?success=true',
-            cancel_url=f'{frontend_url}/?canceled=true',
-            metadata={'user_id': data.get('user_id')},
-            customer_email=data.get('email')
-        )
+        with track('stripe', 'checkout_session'):
+            session = stripe.checkout.Session.create(
+                payment_method_types=['card'],
+                line_items=[{'price': os.environ.get('STRIPE_PRICE_ID'), 'quantity': 1}],
+                mode='subscription', 
+                success_url=f'{frontend_url}/?success=true',
+                cancel_url=f'{frontend_url}/?canceled=true',
+                metadata={'user_id': data.get('user_id')},
+                customer_email=data.get('email')
+            )
         return jsonify({'url': session.url})
     except Exception as e: return jsonify({'error': str(e)}), 500
 
@@ -555,29 +1078,57 @@ def create_portal_session():
         user_id = request.json.get('user_id')
         resp = supabase.table('profiles').select('stripe_customer_id').eq('id', user_id).execute()
         if not resp.data or not resp.data[0]['stripe_customer_id']: return jsonify({'error': 'Sem assinatura.'}), 400
-        session = stripe.billing_portal.Session.create(
-            customer=resp.data[0]['stripe_customer_id'],
-            return_url=f'{frontend_url}/',
-        )
+        with track('stripe', 'portal_session'):
+            session = stripe.billing_portal.Session.create(
+                customer=resp.data[0]['stripe_customer_id'],
+                return_url=f'{frontend_url}/',
+            )
         return jsonify({'url': session.url})
     except Exception as e: return jsonify({'error': str(e)}), 500
 
+# --- WEBHOOK DO STRIPE (webhooks.py) ---
+# A requisição verifica a assinatura, registra o evento e o aplica antes de responder; se a aplicação
+# falhar a resposta é 500 e o Stripe reenvia. WEBHOOK_ASYNC=1 aplica em segundo plano (ver webhooks.py).
+def on_checkout_completed(event):
+    session = event['data']['object']
+    uid = (session.get('metadata') or {}).get('user_id')
+    if not uid: return
+    if not supabase: raise RuntimeError("Supabase indisponível")
+    supabase.table('profiles').update({'is_pro': True, 'stripe_customer_id': session.get('customer')}).eq('id', uid).execute()
+    credit_ledger.invalidate(uid)
+
+def on_subscription_deleted(event):
+    if not supabase: raise RuntimeError("Supabase indisponível")
+    # Uma ida ao banco: o update devolve as linhas alteradas
+    resp = supabase.table('profiles').update({'is_pro': False}).eq('stripe_customer_id', event['data']['object'].get('customer')).execute()
+    for row in resp.data or []: credit_ledger.invalidate(row['id'])
+
+webhook_processor = build_webhook_processor({
+    'checkout.session.completed': on_checkout_completed,
+    'customer.subscription.deleted': on_subscription_deleted,
+})
+metrics.registry.gauge('stripe_webhooks', webhook_processor.stats, 'Eventos do Stripe recebidos e aplicados')
+# Com preload as threads sobem no post_worker_init (gunicorn_conf.py), não no master
+if os.environ.get('PRELOAD_SERVICES') != '1': webhook_processor.start()
+
 @app.route('/webhook', methods=['POST'])
 def stripe_webhook():
     payload = request.get_data(as_text=True)
     sig_header = request.headers.get('Stripe-Signature')
-    try: event = stripe.Webhook.construct_event(payload, sig_header, endpoint_secret)
+    try:
+        with track('stripe', 'construct_event'): stripe.Webhook.construct_event(payload, sig_header, endpoint_secret)
     except: return 'Error', 400
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        uid = session.get('metadata', {}).get('user_id')
-        if uid: supabase.table('profiles').update({'is_pro': True, 'stripe_customer_id': session.get('customer')}).eq('id', uid).execute()
-    elif event['type'] == 'customer.subscription.deleted':
-        sub = event['data']['object']
-        cus_id = sub.get('customer')
-        resp = supabase.table('profiles').select('id').eq('stripe_customer_id', cus_id).execute()
-        if resp.data: supabase.table('profiles').update({'is_pro': False}).eq('id', resp.data[0]['id']).execute()
-    return 'Success', 200
+    try: status = webhook_processor.submit(json.loads(payload), payload)
+    except Exception as e:
+        # Sem registro de idempotência não dá para garantir o processamento: o Stripe reenvia
+        print(f"Erro ao registrar webhook: {e}")
+        return 'Error', 500
+    if status == 'failed': return jsonify({'received': True, 'status': status}), 500
+    return jsonify({'received': True, 'status': status}), 200
+
+# WARMUP_SERVICES=1 constrói os clients já na subida do worker (primeira requisição sem espera).
+# Fica no fim do módulo: as factories usam globais definidas acima (ex.: model_limiters).
+if os.environ.get('WARMUP_SERVICES') == '1': services.warm_up()
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,100 @@
+# bench_docx.py - Tempo e pico de memória do /download-docx para documentos grandes
+#
+# Uso:
+#   python bench/bench_docx.py                        # 10k parágrafos, renderer novo
+#   python bench/bench_docx.py --baseline             # também mede o python-docx chamada a chamada
+#   python bench/bench_docx.py --paragraphs 50000 --max-seconds 10 --max-mb 800
+#
+# Sai com código 1 se o renderer passar das metas (--max-seconds / --max-mb, sobre o RSS máximo).
+# Rode o --baseline separado se quiser o RSS dele: o RSS máximo é do processo inteiro.
+
+import argparse
+import io
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from docx_render import DocxRenderer, parse_markdown  # noqa: E402
+
+
+# Mistura realista: títulos, parágrafos com ênfase, listas e uma tabela a cada 500 blocos
+def sample_markdown(paragraphs):
+    lines = []
+    for i in range(paragraphs):
+        if i % 500 == 0:
+            lines += [f"## Seção {i // 500 + 1}", "", "| Item | Valor | Obs |", "|---|---:|---|"]
+            lines += [f"| item {j} | {j * 10} | `ok` |" for j in range(10)]
+            lines.append("")
+        elif i % 50 == 0:
+            lines += [f"### Tópico {i}", ""]
+        elif i % 7 == 0:
+            lines.append(f"- ponto **{i}** da lista com *ênfase*")
+        elif i % 11 == 0:
+            lines.append(f"1. passo {i}")
+        else:
+            lines += [f"Parágrafo {i} com **negrito**, *itálico* e `código` no meio de um texto comum.", ""]
+    return "\n".join(lines)
+
+
+# Tempo sem tracemalloc (ele deixa o Python bem mais lento); o pico de memória vem de uma
+# segunda execução com tracemalloc (heap do Python) + o pico de RSS do processo (inclui o lxml)
+def measure(fn):
+    t = time.perf_counter()
+    size = fn()
+    seconds = time.perf_counter() - t
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': round(seconds, 3), 'peak_mb': round(peak / 1e6, 1),
+            'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'docx_kb': round(size / 1024, 1)}
+
+
+def render_new(renderer, text):
+    f = renderer.render_to_file(text)
+    f.seek(0, io.SEEK_END)
+    return f.tell()
+
+
+# Abordagem antiga com estilos: uma chamada do python-docx por bloco
+def render_baseline(text):
+    from docx import Document
+    doc = Document()
+    for kind, level, content in parse_markdown(text):
+        if kind == 'heading': doc.add_heading(content, level)
+        elif kind == 'bullet': doc.add_paragraph(content, style='List Bullet')
+        elif kind == 'number': doc.add_paragraph(content, style='List Number')
+        elif kind == 'table':
+            table = doc.add_table(rows=len(content), cols=max(len(r) for r in content))
+            for r, row in enumerate(content):
+                for c, cell in enumerate(row): table.cell(r, c).text = cell
+        else: doc.add_paragraph(content)
+    f = io.BytesIO()
+    doc.save(f)
+    return f.tell()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--paragraphs', type=int, default=10000)
+    parser.add_argument('--baseline', action='store_true')
+    parser.add_argument('--max-seconds', type=float, default=2.0)
+    parser.add_argument('--max-mb', type=float, default=150.0)
+    args = parser.parse_args()
+
+    text = sample_markdown(args.paragraphs)
+    renderer = DocxRenderer()
+    renderer.template  # template fica em cache entre requisições; não entra na medição
+    print(f"markdown: {len(text) / 1e6:.1f} MB, {len(parse_markdown(text))} blocos")
+
+    result = measure(lambda: render_new(renderer, text))
+    print(f"renderer : {result}")
+    if args.baseline: print(f"baseline : {measure(lambda: render_baseline(text))}")
+
+    ok = result['seconds'] <= args.max_seconds and result['max_rss_mb'] <= args.max_mb
+    print(f"metas (<= {args.max_seconds}s, <= {args.max_mb} MB): {'OK' if ok else 'FALHOU'}")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,75 @@
+# bench_vector_index.py - Compara a busca local (NumPy) com a RPC match_documents
+#
+# Uso:
+#   python bench/bench_vector_index.py                      # só o índice local, 1k e 100k chunks
+#   python bench/bench_vector_index.py --rpc-user <uuid>    # também mede a RPC (precisa SUPABASE_URL/KEY)
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vector_index import VectorIndex  # noqa: E402
+
+DIM = 768  # text-embedding-004
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summarize(samples):
+    ms = [s * 1000 for s in samples]
+    return {'p50_ms': round(percentile(ms, 50), 3), 'p95_ms': round(percentile(ms, 95), 3),
+            'mean_ms': round(statistics.mean(ms), 3)}
+
+
+def bench_local(n_chunks, queries):
+    rng = np.random.default_rng(42)
+    embeddings = rng.standard_normal((n_chunks, DIM), dtype=np.float32)
+    rows = [{'content': f"chunk {i}", 'embedding': embeddings[i]} for i in range(n_chunks)]
+    index = VectorIndex(lambda user_id: rows)
+
+    t = time.perf_counter()
+    index.search('bench', rng.standard_normal(DIM), k=3, threshold=-1)
+    load_s = time.perf_counter() - t
+
+    samples = []
+    for _ in range(queries):
+        q = rng.standard_normal(DIM)
+        t = time.perf_counter()
+        index.search('bench', q, k=3, threshold=-1)
+        samples.append(time.perf_counter() - t)
+    return dict(summarize(samples), load_ms=round(load_s * 1000, 1), index_mb=round(index.stats()['bytes'] / 1e6, 1))
+
+
+def bench_rpc(user_id, queries):
+    from supabase import create_client
+    client = create_client(os.environ['SUPABASE_URL'], os.environ['SUPABASE_KEY'])
+    rng = np.random.default_rng(7)
+    samples = []
+    for _ in range(queries):
+        params = {'query_embedding': rng.standard_normal(DIM).tolist(), 'match_threshold': 0.5,
+                  'match_count': 3, 'user_id_filter': user_id}
+        t = time.perf_counter()
+        client.rpc('match_documents', params).execute()
+        samples.append(time.perf_counter() - t)
+    return summarize(samples)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,100000')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--rpc-user', help='user_id com chunks reais para medir a RPC')
+    args = parser.parse_args()
+
+    for size in [int(s) for s in args.sizes.split(',')]:
+        print(f"local  {size:>7} chunks: {bench_local(size, args.queries)}")
+    if args.rpc_user:
+        print(f"rpc    (user {args.rpc_user}): {bench_rpc(args.rpc_user, min(args.queries, 50))}")
@@ -0,0 +1,14 @@
+# fake_app.py - App Flask com todos os serviços externos substituídos pelos fakes locais
+# Alvo do gunicorn no load test: gunicorn --pythonpath .,bench fake_app:app
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakes  # noqa: E402
+
+fakes.install()
+
+from app import app  # noqa: E402,F401
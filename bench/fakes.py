@@ -0,0 +1,289 @@
+# fakes.py - Substitutos locais de genai, supabase, replicate e stripe para benchmarks offline
+#
+# install() registra os módulos falsos em sys.modules ANTES de importar o app.
+# Latência e taxa de erro de cada serviço vêm de variáveis de ambiente:
+#   FAKE_GEMINI_LATENCY=0.8  FAKE_GEMINI_ERROR_RATE=0.01
+#   FAKE_EMBED_LATENCY=0.1   FAKE_SUPABASE_LATENCY=0.02  FAKE_SUPABASE_ERROR_RATE=0
+#   FAKE_REPLICATE_LATENCY=5 FAKE_STRIPE_LATENCY=0.3  FAKE_TRANSCRIPT_LATENCY=0.5
+#   FAKE_GEMINI_QUOTA_RPS=20 (acima disso o Gemini falso responde 429 com "Please retry in Ns")
+
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+import types
+import uuid
+
+
+def _env(name, default):
+    return float(os.environ.get(name, default))
+
+
+def _io(service, default_latency):
+    latency = _env(f"FAKE_{service}_LATENCY", default_latency)
+    if latency: time.sleep(latency * random.uniform(0.8, 1.2))
+    if random.random() < _env(f"FAKE_{service}_ERROR_RATE", 0):
+        raise RuntimeError(f"Falha simulada ({service.lower()})")
+
+
+# --- GEMINI (google.generativeai) ---
+class ResourceExhausted(Exception):
+    code = 429
+
+
+_quota_lock = threading.Lock()
+_quota_calls = []
+
+
+def _check_quota():
+    quota = _env('FAKE_GEMINI_QUOTA_RPS', 0)
+    if not quota: return
+    with _quota_lock:
+        now = time.monotonic()
+        while _quota_calls and _quota_calls[0] < now - 1: _quota_calls.pop(0)
+        if len(_quota_calls) >= quota:
+            retry = max(0.05, _quota_calls[0] + 1 - now)
+            raise ResourceExhausted(f"429 Quota exceeded (simulado). Please retry in {retry:.2f}s.")
+        _quota_calls.append(now)
+
+
+class _Part:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeGenerativeModel:
+    def __init__(self, model_name, **kwargs):
+        self.model_name = model_name
+
+    def _answer(self, prompt):
+        seed = hashlib.sha256(str(prompt).encode('utf-8')).hexdigest()[:8]
+        if 'JSON' in str(prompt):
+            return json.dumps({'resultado': f"resposta simulada {seed}", 'itens': ['um', 'dois', 'três']})
+        return f"Resposta simulada {seed}. " + "Lorem ipsum dolor sit amet. " * 40
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        _check_quota()
+        _io('GEMINI', 0.8)
+        text = self._answer(prompt)
+        if not stream: return _Part(text)
+        pieces = [text[i:i + 80] for i in range(0, len(text), 80)]
+        def chunks():
+            for piece in pieces:
+                time.sleep(_env('FAKE_GEMINI_CHUNK_LATENCY', 0.02))
+                yield _Part(piece)
+        return chunks()
+
+
+def _fake_embed_content(model, content, **kwargs):
+    _io('EMBED', 0.1)
+    def vector(text):
+        rng = random.Random(hashlib.sha256(str(text).encode('utf-8')).digest())
+        return [rng.uniform(-1, 1) for _ in range(768)]
+    if isinstance(content, (list, tuple)): return {'embedding': [vector(t) for t in content]}
+    return {'embedding': vector(content)}
+
+
+def _make_genai():
+    genai = types.ModuleType('google.generativeai')
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = _FakeGenerativeModel
+    genai.embed_content = _fake_embed_content
+    genai.types = types.SimpleNamespace(GenerationConfig=dict)
+    return genai
+
+
+# --- SUPABASE ---
+class _Params:
+    # Mesma interface mínima de httpx.QueryParams usada pelo app (add encadeável)
+    def __init__(self, items=()):
+        self.items = list(items)
+
+    def add(self, key, value):
+        return _Params(self.items + [(key, value)])
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _FakeStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {'profiles': [], 'user_history': [], 'documents': [], 'document_chunks': [], 'image_history': []}
+        for i in range(int(_env('FAKE_USERS', 100))):
+            self.tables['profiles'].append({'id': f"user-{i}", 'credits': 10 ** 9, 'is_pro': i % 10 == 0,
+                                            'stripe_customer_id': f"cus_{i}"})
+
+
+_store = _FakeStore()
+
+
+class _FakeQuery:
+    def __init__(self, table):
+        self.table = table
+        self.op = 'select'
+        self.payload = None
+        self.filters = []
+        self.row_limit = None
+        self.params = _Params()
+
+    def select(self, *columns, **kwargs): self.op = 'select'; return self
+    def insert(self, payload, **kwargs): self.op, self.payload = 'insert', payload; return self
+    def update(self, payload, **kwargs): self.op, self.payload = 'update', payload; return self
+    def delete(self, **kwargs): self.op = 'delete'; return self
+    def eq(self, column, value): self.filters.append(lambda r: str(r.get(column)) == str(value)); return self
+    def in_(self, column, values): self.filters.append(lambda r: r.get(column) in values); return self
+    def order(self, *args, **kwargs): return self
+    def limit(self, n, **kwargs): self.row_limit = n; return self
+    def range(self, start, end): self.row_limit = end - start + 1; return self
+
+    def execute(self):
+        _io('SUPABASE', 0.02)
+        rows = _store.tables.setdefault(self.table, [])
+        with _store.lock:
+            if self.op == 'insert':
+                new = self.payload if isinstance(self.payload, list) else [self.payload]
+                new = [dict(r, id=r.get('id') or uuid.uuid4().hex, created_at=time.strftime('%Y-%m-%dT%H:%M:%S')) for r in new]
+                rows.extend(new)
+                return _Result(new)
+            matched = [r for r in rows if all(f(r) for f in self.filters)]
+            if self.op == 'update':
+                for r in matched: r.update(self.payload)
+                return _Result(matched)
+            if self.op == 'delete':
+                _store.tables[self.table] = [r for r in rows if r not in matched]
+                return _Result(matched)
+            matched = list(reversed(matched))
+            return _Result(matched[:self.row_limit] if self.row_limit else matched)
+
+
+class _FakeRpc:
+    def __init__(self, name, params):
+        self.name = name
+        self.params = params or {}
+
+    def execute(self):
+        _io('SUPABASE', 0.02)
+        p = self.params
+        if self.name == 'consume_credits':
+            with _store.lock:
+                user = next((u for u in _store.tables['profiles'] if u['id'] == p.get('p_user_id')), None)
+                if user is None: return _Result([{'ok': False, 'charged': 0, 'credits': None, 'is_pro': None}])
+                if user['is_pro']: return _Result([{'ok': True, 'charged': 0, 'credits': user['credits'], 'is_pro': True}])
+                amount = p.get('p_amount', 1)
+                if user['credits'] < amount: return _Result([{'ok': False, 'charged': 0, 'credits': user['credits'], 'is_pro': False}])
+                user['credits'] -= amount
+                return _Result([{'ok': True, 'charged': amount, 'credits': user['credits'], 'is_pro': False}])
+        if self.name == 'refund_credits':
+            return _Result(None)
+        if self.name == 'match_documents':
+            chunks = _store.tables['document_chunks'][-p.get('match_count', 3):]
+            return _Result([{'content': c['content'], 'similarity': 0.9} for c in chunks])
+        return _Result([])
+
+
+class _FakeSupabaseClient:
+    def table(self, name): return _FakeQuery(name)
+    def rpc(self, name, params=None): return _FakeRpc(name, params)
+
+
+def _make_supabase():
+    supabase = types.ModuleType('supabase')
+    supabase.Client = _FakeSupabaseClient
+    supabase.create_client = lambda url, key, **kwargs: _FakeSupabaseClient()
+    return supabase
+
+
+# --- REPLICATE ---
+class _FakePrediction:
+    _ids = itertools.count(1)
+
+    def __init__(self, inputs):
+        self.id = f"fake-{next(self._ids)}"
+        self.status = 'starting'
+        self.error = None
+        self.output = None
+        self.inputs = inputs
+        self._done_at = time.time() + _env('FAKE_REPLICATE_LATENCY', 5)
+
+    def reload(self):
+        if time.time() >= self._done_at:
+            self.status = 'succeeded'
+            self.output = [f"https://placehold.co/1024x1024/png?text={self.id}"]
+        else: self.status = 'processing'
+
+    def cancel(self): self.status = 'canceled'
+
+
+def _make_replicate():
+    replicate = types.ModuleType('replicate')
+    replicate.predictions = types.SimpleNamespace(create=lambda version=None, input=None, **kw: _FakePrediction(input or {}))
+    def run(ref, input=None, **kwargs):
+        _io('REPLICATE', 5)
+        return [f"https://placehold.co/1024x1024/png?text={uuid.uuid4().hex[:6]}"]
+    replicate.run = run
+    return replicate
+
+
+# --- YOUTUBE (youtube_transcript_api, API 0.x) ---
+def _make_transcript_api():
+    module = types.ModuleType('youtube_transcript_api')
+
+    class YouTubeTranscriptApi:
+        @staticmethod
+        def get_transcript(video_id, languages=None):
+            _io('TRANSCRIPT', 0.5)
+            rng = random.Random(video_id)
+            return [{'text': f"Trecho {i} do vídeo {video_id}: " + "fala simulada " * rng.randint(5, 15),
+                     'start': i * 5.0, 'duration': 5.0} for i in range(200)]
+
+    module.YouTubeTranscriptApi = YouTubeTranscriptApi
+    return module
+
+
+# --- STRIPE ---
+def _make_stripe():
+    stripe = types.ModuleType('stripe')
+    stripe.api_key = None
+
+    def session_create(**kwargs):
+        _io('STRIPE', 0.3)
+        return types.SimpleNamespace(id=f"cs_{uuid.uuid4().hex[:10]}", url='https://checkout.stripe.test/session')
+
+    # Mesma verificação do SDK: HMAC-SHA256 de "t.payload" com o segredo, comparado ao v1
+    def construct_event(payload, sig_header, secret, tolerance=300):
+        _io('STRIPE', 0)
+        if secret:
+            parts = dict(item.split('=', 1) for item in (sig_header or '').split(',') if '=' in item)
+            expected = hmac.new(secret.encode(), f"{parts.get('t')}.{payload}".encode(), hashlib.sha256).hexdigest()
+            if not hmac.compare_digest(expected, parts.get('v1', '')): raise ValueError("Assinatura inválida")
+            if abs(time.time() - int(parts.get('t', 0))) > tolerance: raise ValueError("Assinatura expirada")
+        return json.loads(payload)
+
+    stripe.checkout = types.SimpleNamespace(Session=types.SimpleNamespace(create=session_create))
+    stripe.billing_portal = types.SimpleNamespace(Session=types.SimpleNamespace(create=session_create))
+    stripe.Webhook = types.SimpleNamespace(construct_event=construct_event)
+    return stripe
+
+
+def install():
+    genai = _make_genai()
+    google = sys.modules.get('google') or types.ModuleType('google')
+    google.generativeai = genai
+    sys.modules['google'] = google
+    sys.modules['google.generativeai'] = genai
+    sys.modules['supabase'] = _make_supabase()
+    sys.modules['replicate'] = _make_replicate()
+    sys.modules['stripe'] = _make_stripe()
+    sys.modules['youtube_transcript_api'] = _make_transcript_api()
+    os.environ.setdefault('SUPABASE_URL', 'http://fake-supabase.local')
+    os.environ.setdefault('SUPABASE_KEY', 'fake')
+    os.environ.setdefault('GOOGLE_API_KEY', 'fake')
+    os.environ.setdefault('REPLICATE_BACKEND', 'fake')
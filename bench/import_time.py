@@ -0,0 +1,79 @@
+# import_time.py - Mede o cold start do worker: tempo e memória de "import wsgi"
+#
+# Uso:
+#   python bench/import_time.py                 # árvore atual
+#   python bench/import_time.py --ref bb65244   # compara com outra revisão do git
+#   python bench/import_time.py --top 15        # maiores módulos (python -X importtime)
+
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = (
+    "import resource, time, json\n"
+    "t = time.perf_counter()\n"
+    "import wsgi\n"
+    "ms = (time.perf_counter() - t) * 1000\n"
+    "print(json.dumps({'ms': ms, 'maxrss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))\n"
+)
+
+
+def _env():
+    env = {k: v for k, v in os.environ.items() if k not in ('WARMUP_SERVICES', 'PRELOAD_SERVICES')}
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    return env
+
+
+def measure(tree, runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', PROBE], cwd=tree, env=_env(),
+                             capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return {
+        'import_ms_median': round(statistics.median(s['ms'] for s in samples), 1),
+        'import_ms_min': round(min(s['ms'] for s in samples), 1),
+        'maxrss_mb_median': round(statistics.median(s['maxrss_mb'] for s in samples), 1),
+    }
+
+
+def top_modules(tree, n):
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import wsgi'], cwd=tree, env=_env(),
+                         capture_output=True, text=True).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line: continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:n]
+
+
+def export_ref(ref):
+    tmp = tempfile.mkdtemp(prefix='import-time-')
+    archive = subprocess.run(['git', 'archive', ref], cwd=ROOT, capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar: tar.extractall(tmp)
+    return tmp
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ref', help='revisão do git para comparar (ex.: a versão com imports no topo)')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=0)
+    args = parser.parse_args()
+
+    trees = [('atual', ROOT)]
+    if args.ref: trees.insert(0, (args.ref, export_ref(args.ref)))
+    for label, tree in trees:
+        print(f"{label:>10}: {measure(tree, args.runs)}")
+        if args.top:
+            for cumulative_us, name in top_modules(tree, args.top):
+                print(f"{'':>12}{cumulative_us / 1000:8.1f} ms  {name}")
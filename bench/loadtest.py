@@ -0,0 +1,336 @@
+# loadtest.py - Load test offline do app sob gunicorn (serviços externos simulados por bench/fakes.py)
+#
+# Exemplos:
+#   python bench/loadtest.py                                   # sync x 1,2,4 workers, 20s cada
+#   python bench/loadtest.py --worker-class sync,gthread --workers 2,4 --threads 8 --concurrency 32
+#   FAKE_GEMINI_LATENCY=2 FAKE_GEMINI_ERROR_RATE=0.02 python bench/loadtest.py --duration 60
+#   python bench/loadtest.py --compare bench/results/antes.json bench/results/depois.json
+#   python bench/loadtest.py --config gunicorn_conf.py --worker-class sync,gthread --workers 2   # config do deploy
+#
+# Resultado: req/s, p50/p95/p99 por rota e no total, e RSS de cada worker, salvo em JSON.
+
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.dirname(os.path.abspath(__file__))
+
+
+def _sample_pdf():
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        return None
+    writer = PdfWriter()
+    for _ in range(3): writer.add_blank_page(612, 792)
+    buf = io.BytesIO()
+    writer.write(buf)
+    return buf.getvalue()
+
+
+SAMPLE_PDF = _sample_pdf()
+
+
+def _multipart(fields, filename, content):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                 f'Content-Type: application/pdf\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+# Cada rota: (nome, método, caminho, função que gera o corpo a partir de um nonce)
+# job_id / image_digest vêm de _seed(): /jobs/<id> e /images/<hash> precisam de algo que já exista
+def build_routes(unique, job_id=None, image_digest=None):
+    n = (lambda: uuid.uuid4().hex[:8]) if unique else (lambda: 'fixo')
+    user = lambda: f"user-{random.randint(1, 99)}"
+    routes = [
+        ('generate-prompt', 'POST', '/generate-prompt', lambda: {'user_id': user(), 'idea': f"gato astronauta {n()}"}),
+        ('generate-veo3-prompt', 'POST', '/generate-veo3-prompt', lambda: {'user_id': user(), 'idea': f"praia {n()}"}),
+        ('format-abnt', 'POST', '/format-abnt', lambda: {'user_id': user(), 'text': f"Silva, J. Livro {n()}. 2020"}),
+        ('summarize-text', 'POST', '/summarize-text', lambda: {'user_id': user(), 'text': f"Texto longo {n()} " * 200}),
+        ('corporate-translator', 'POST', '/corporate-translator', lambda: {'user_id': user(), 'text': f"hello {n()}"}),
+        ('generate-social-media', 'POST', '/generate-social-media', lambda: {'user_id': user(), 'text': f"café {n()}"}),
+        ('correct-essay', 'POST', '/correct-essay', lambda: {'user_id': user(), 'essay': f"Redação {n()} " * 50}),
+        ('mock-interview', 'POST', '/mock-interview', lambda: {'user_id': user(), 'role': f"dev {n()}"}),
+        ('generate-study-material', 'POST', '/generate-study-material', lambda: {'user_id': user(), 'text': f"física {n()}"}),
+        ('generate-cover-letter', 'POST', '/generate-cover-letter', lambda: {'user_id': user(), 'job_desc': f"vaga {n()}"}),
+        ('ask-document', 'POST', '/ask-document', lambda: {'user_id': user(), 'question': f"qual o tema {n()}?"}),
+        ('generate-spreadsheet', 'POST', '/generate-spreadsheet', lambda: {'user_id': user(), 'description': f"vendas {n()}"}),
+        ('download-docx', 'POST', '/download-docx', lambda: {'markdown_text': f"# Título {n()}\n\n- item\n- item"}),
+        ('generate-image', 'POST', '/generate-image', lambda: {'user_id': user(), 'prompt': f"paisagem {n()}"}),
+        ('summarize-video', 'POST', '/summarize-video',
+         lambda: {'user_id': user(), 'url': f"https://youtu.be/{(n() + 'abcdefghijk')[:11]}"}),
+        ('batch', 'POST', '/batch', lambda: {'user_id': user(), 'items': [
+            {'tool': 'generate-prompt', 'payload': {'idea': f"lote {n()}"}},
+            {'tool': 'format-abnt', 'payload': {'text': f"Souza, M. Artigo {n()}. 2021"}},
+        ]}),
+        ('save-history', 'POST', '/save-history', lambda: {'user_id': user(), 'tool_type': 'x', 'output_data': n()}),
+        ('get-history', 'GET', '/get-history', lambda: {'user_id': user(), 'limit': 20}),
+        ('delete-history-item', 'POST', '/delete-history-item', lambda: {'item_id': uuid.uuid4().hex}),
+        ('create-checkout-session', 'POST', '/create-checkout-session', lambda: {'user_id': user(), 'email': 'a@b.c'}),
+        ('create-portal-session', 'POST', '/create-portal-session', lambda: {'user_id': user()}),
+        ('health', 'GET', '/', lambda: None),
+    ]
+    if SAMPLE_PDF:
+        routes.append(('upload-document', 'UPLOAD', '/upload-document', lambda: {'user_id': user()}))
+    if job_id:
+        routes.append(('jobs', 'GET', f'/jobs/{job_id}', lambda: None))
+    if image_digest:
+        routes.append(('images', 'GET', f'/images/{image_digest}', lambda: None))
+    return routes
+
+
+# Uma imagem gravada direto no store compartilhado (o Replicate falso devolve URLs externas)
+def _seed_image(store_dir):
+    try:
+        from PIL import Image
+        sys.path.insert(0, ROOT)
+        from image_store import ImageStore
+    except ImportError:
+        return None
+    buf = io.BytesIO()
+    Image.new('RGB', (1024, 1024), (40, 90, 160)).save(buf, format='PNG')
+    return ImageStore(store_dir).ingest_bytes([buf.getvalue()])['digest']
+
+
+def _seed_job(base, timeout):
+    req = urllib.request.Request(base + '/generate-image', method='POST', headers={'Content-Type': 'application/json'},
+                                 data=json.dumps({'user_id': 'user-1', 'prompt': 'semente do load test'}).encode())
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp: return json.loads(resp.read()).get('job_id')
+    except Exception:
+        return None
+
+
+def _request(base, method, path, body, timeout):
+    headers = {}
+    data = None
+    if method == 'GET':
+        if body: path += '?' + '&'.join(f"{k}={v}" for k, v in body.items())
+    elif method == 'UPLOAD':
+        data, headers['Content-Type'] = _multipart(body, 'bench.pdf', SAMPLE_PDF)
+        method = 'POST'
+    else:
+        data = json.dumps(body).encode()
+        headers['Content-Type'] = 'application/json'
+    req = urllib.request.Request(base + path, data=data, method=method, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+    except Exception:
+        return 0  # timeout / conexão recusada
+
+
+def percentile(sorted_values, p):
+    if not sorted_values: return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+def summarize(samples, duration):
+    latencies = sorted(s[1] for s in samples)
+    errors = sum(1 for s in samples if s[2] == 0 or s[2] >= 500)
+    ms = lambda v: round(v * 1000, 1) if v is not None else None
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'rps': round(len(samples) / duration, 2),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+    }
+
+
+def run_load(base, routes, concurrency, duration, timeout):
+    samples = []
+    lock = threading.Lock()
+    deadline = time.time() + duration
+    cycle = itertools.cycle(routes)
+    cycle_lock = threading.Lock()
+
+    def worker():
+        local = []
+        while time.time() < deadline:
+            with cycle_lock: name, method, path, make_body = next(cycle)
+            started = time.perf_counter()
+            status = _request(base, method, path, make_body(), timeout)
+            local.append((name, time.perf_counter() - started, status))
+        with lock: samples.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.time()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return samples, time.time() - started
+
+
+# --- MEMÓRIA ---
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f: return [int(p) for p in f.read().split()]
+    except OSError: return []
+
+
+def _rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'): return round(int(line.split()[1]) / 1024, 1)
+    except OSError: return None
+
+
+# --- GUNICORN ---
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(worker_class, workers, threads, port, extra_args, config=None):
+    cmd = [sys.executable, '-m', 'gunicorn', '--pythonpath', f"{ROOT},{BENCH}", '--bind', f"127.0.0.1:{port}",
+           '--workers', str(workers), '--worker-class', worker_class, '--timeout', '120', '--log-level', 'warning']
+    if worker_class == 'gthread': cmd += ['--threads', str(threads)]
+    if worker_class in ('gevent', 'eventlet'): cmd += ['--worker-connections', str(threads * 50)]
+    # Opções da linha de comando têm prioridade sobre o arquivo; o que não é passado (keepalive, pools...) vem dele
+    if config: cmd += ['--config', config]
+    cmd += extra_args + ['fake_app:app']
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(150):
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn saiu: {proc.stderr.read().decode()[-2000:]}")
+        if _request(base, 'GET', '/', None, 1) == 200: return proc, base
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("gunicorn não respondeu a tempo")
+
+
+def stop_gunicorn(proc):
+    proc.send_signal(signal.SIGTERM)
+    try: proc.wait(timeout=30)
+    except subprocess.TimeoutExpired: proc.kill()
+
+
+def run_config(worker_class, workers, args):
+    proc, base = start_gunicorn(worker_class, workers, args.threads, _free_port(), args.gunicorn_arg or [], args.config)
+    try:
+        routes = build_routes(unique=not args.allow_cache, job_id=_seed_job(base, args.timeout),
+                              image_digest=_seed_image(os.environ['IMAGE_STORE_DIR']))
+        if args.warmup: run_load(base, routes, args.concurrency, args.warmup, args.timeout)
+        samples, elapsed = run_load(base, routes, args.concurrency, args.duration, args.timeout)
+        rss = {str(pid): _rss_mb(pid) for pid in _children(proc.pid)}
+    finally:
+        stop_gunicorn(proc)
+
+    per_route = {}
+    for name, *_ in routes:
+        per_route[name] = summarize([s for s in samples if s[0] == name], elapsed)
+    rss_values = [v for v in rss.values() if v is not None]
+    total = summarize(samples, elapsed)
+    # Lei de Little: requisições em andamento = vazão x latência média, dividido entre os workers
+    in_flight = round(total['rps'] * total['mean_ms'] / 1000 / workers, 1) if total['mean_ms'] else None
+    return {
+        'worker_class': worker_class,
+        'workers': workers,
+        'threads': args.threads if worker_class == 'gthread' else 1,
+        'concurrency': args.concurrency,
+        'duration_s': round(elapsed, 1),
+        'total': total,
+        'in_flight_per_worker': in_flight,
+        'routes': per_route,
+        'rss_mb_per_worker': rss,
+        'rss_mb_mean': round(sum(rss_values) / len(rss_values), 1) if rss_values else None,
+    }
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f: old = json.load(f)
+    with open(new_path) as f: new = json.load(f)
+    key = lambda r: (r['worker_class'], r['workers'], r['threads'])
+    old_runs = {key(r): r for r in old['runs']}
+    print(f"{'config':<22} {'rps':>16} {'p95_ms':>18} {'p99_ms':>18} {'rss_mb':>14}")
+    for run in new['runs']:
+        before = old_runs.get(key(run))
+        if not before: continue
+        def delta(a, b):
+            if a is None or b is None: return f"{b}"
+            pct = (b - a) / a * 100 if a else 0
+            return f"{b} ({pct:+.0f}%)"
+        label = f"{run['worker_class']} w={run['workers']} t={run['threads']}"
+        print(f"{label:<22} {delta(before['total']['rps'], run['total']['rps']):>16} "
+              f"{delta(before['total']['p95_ms'], run['total']['p95_ms']):>18} "
+              f"{delta(before['total']['p99_ms'], run['total']['p99_ms']):>18} "
+              f"{delta(before['rss_mb_mean'], run['rss_mb_mean']):>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--worker-class', default='sync', help='lista: sync,gthread,gevent')
+    parser.add_argument('--workers', default='1,2,4', help='lista de quantidades de workers')
+    parser.add_argument('--threads', type=int, default=8, help='threads por worker (gthread)')
+    parser.add_argument('--concurrency', type=int, default=16, help='clientes simultâneos')
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--allow-cache', action='store_true', help='repete prompts (mede o cache de respostas)')
+    parser.add_argument('--gunicorn-arg', action='append', help='argumento extra para o gunicorn')
+    parser.add_argument('--config', help='arquivo de config do gunicorn (ex.: gunicorn_conf.py)')
+    parser.add_argument('--out', default=os.path.join(BENCH, 'results'))
+    parser.add_argument('--compare', nargs=2, metavar=('ANTES', 'DEPOIS'))
+    args = parser.parse_args()
+
+    if args.compare: return compare(*args.compare)
+
+    # Jobs e imagens num diretório do próprio load test, compartilhado entre os workers do gunicorn
+    scratch = tempfile.mkdtemp(prefix='loadtest-')
+    os.environ.setdefault('IMAGE_STORE_DIR', os.path.join(scratch, 'images'))
+    os.environ.setdefault('JOBS_DB', os.path.join(scratch, 'jobs.db'))
+
+    runs = []
+    for worker_class in args.worker_class.split(','):
+        for workers in [int(w) for w in args.workers.split(',')]:
+            print(f"-> {worker_class} workers={workers} ...", flush=True)
+            try: result = run_config(worker_class, workers, args)
+            except RuntimeError as e:
+                print(f"   pulado: {e}")
+                continue
+            total = result['total']
+            print(f"   {total['rps']} req/s  p50={total['p50_ms']}ms p95={total['p95_ms']}ms p99={total['p99_ms']}ms "
+                  f"erros={total['errors']}  simultâneas/worker={result['in_flight_per_worker']}  "
+                  f"rss/worker={result['rss_mb_mean']}MB")
+            runs.append(result)
+
+    fake_env = {k: v for k, v in os.environ.items() if k.startswith('FAKE_')}
+    report = {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'fake_env': fake_env, 'runs': runs}
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"loadtest-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, 'w') as f: json.dump(report, f, indent=2)
+    print(f"Resultado salvo em {path}")
+
+
+if __name__ == '__main__':
+    main()
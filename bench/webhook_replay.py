@@ -0,0 +1,148 @@
+# webhook_replay.py - Reenvia milhares de eventos assinados do Stripe para o /webhook
+#
+# Por padrão roda o app no próprio processo, com o Supabase simulado (bench/fakes.py), e no fim
+# confere se o estado final dos profiles bate com o último evento de cada cliente.
+#
+# Uso:
+#   python bench/webhook_replay.py                                  # 5000 eventos, 200 clientes
+#   python bench/webhook_replay.py --events 20000 --supabase-latency 0.2 --duplicates 0.2
+#   python bench/webhook_replay.py --url http://localhost:5000/webhook --secret whsec_...   # servidor real
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH)
+sys.path.insert(0, os.path.dirname(BENCH))
+
+
+def sign(payload, secret, timestamp=None):
+    timestamp = int(timestamp or time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+# Cada cliente alterna assinatura/cancelamento; o estado esperado é o do último evento criado
+def make_events(count, customers, start=1_700_000_000):
+    events, expected = [], {}
+    for i in range(count):
+        c = i % customers
+        created = start + i // customers
+        if (i // customers) % 2 == 0:
+            event = {'type': 'checkout.session.completed',
+                     'data': {'object': {'customer': f"cus_{c}", 'metadata': {'user_id': f"user-{c}"}}}}
+            expected[f"user-{c}"] = True
+        else:
+            event = {'type': 'customer.subscription.deleted', 'data': {'object': {'customer': f"cus_{c}"}}}
+            expected[f"user-{c}"] = False
+        events.append(dict(event, id=f"evt_{i:08d}", created=created, object='event'))
+    return events, expected
+
+
+# Reenvios (mesmo id) e um pouco de desordem, como o Stripe faz em retentativas
+def deliveries(events, duplicates, disorder):
+    out = list(events)
+    out += random.sample(events, int(len(events) * duplicates))
+    return [e for _, e in sorted(((i + random.uniform(0, disorder * len(events)), e) for i, e in enumerate(out)),
+                                 key=lambda pair: pair[0])]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def post_local(client, secret):
+    def post(event):
+        payload = json.dumps(event)
+        started = time.perf_counter()
+        r = client.post('/webhook', data=payload, headers={'Stripe-Signature': sign(payload, secret),
+                                                           'Content-Type': 'application/json'})
+        return time.perf_counter() - started, r.status_code
+    return post
+
+
+def post_http(url, secret):
+    def post(event):
+        payload = json.dumps(event)
+        request = urllib.request.Request(url, data=payload.encode(), method='POST', headers={
+            'Stripe-Signature': sign(payload, secret), 'Content-Type': 'application/json'})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as r: status = r.status
+        except urllib.error.HTTPError as e: status = e.code
+        return time.perf_counter() - started, status
+    return post
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--duplicates', type=float, default=0.1, help='fração de eventos reenviados')
+    parser.add_argument('--disorder', type=float, default=0.01, help='janela de desordem (fração do total)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--supabase-latency', type=float, default=0.05)
+    parser.add_argument('--url', help='manda para um servidor em execução em vez do app local')
+    parser.add_argument('--secret', default=os.environ.get('STRIPE_WEBHOOK_SECRET', 'whsec_replay'))
+    parser.add_argument('--drain-timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    events, expected = make_events(args.events, args.customers)
+    plan = deliveries(events, args.duplicates, args.disorder)
+
+    app = None
+    if args.url:
+        post = post_http(args.url, args.secret)
+    else:
+        os.environ['STRIPE_WEBHOOK_SECRET'] = args.secret
+        os.environ['FAKE_SUPABASE_LATENCY'] = str(args.supabase_latency)
+        os.environ['FAKE_USERS'] = str(max(args.customers, 100))
+        os.environ['WEBHOOK_DB'] = os.path.join(tempfile.mkdtemp(prefix='webhook-replay-'), 'events.db')
+        import fakes
+        fakes.install()
+        import app
+        local = threading.local()
+        def post(event):
+            if not hasattr(local, 'client'): local.client = app.app.test_client()
+            return post_local(local.client, args.secret)(event)
+
+    print(f"{len(plan)} entregas ({len(events)} eventos, {len(plan) - len(events)} reenvios), "
+          f"{args.customers} clientes, concorrência {args.concurrency}")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(post, plan))
+    elapsed = time.perf_counter() - started
+
+    latencies = [r[0] * 1000 for r in results]
+    statuses = {}
+    for _, status in results: statuses[status] = statuses.get(status, 0) + 1
+    print(f"ack: {len(plan) / elapsed:.0f} req/s | p50 {percentile(latencies, 50):.1f} ms | "
+          f"p95 {percentile(latencies, 95):.1f} ms | p99 {percentile(latencies, 99):.1f} ms | "
+          f"média {statistics.mean(latencies):.1f} ms | status {statuses}")
+
+    if app is None: sys.exit(0)
+
+    # Espera a fila em segundo plano esvaziar e confere o estado final
+    processor = app.webhook_processor
+    drain_started = time.perf_counter()
+    while processor.store.counts().get('pending', 0) and time.perf_counter() - drain_started < args.drain_timeout:
+        time.sleep(0.1)
+    drain = time.perf_counter() - drain_started
+    profiles = {p['id']: p['is_pro'] for p in fakes._store.tables['profiles']}
+    wrong = sum(1 for uid, is_pro in expected.items() if profiles.get(uid) != is_pro)
+    print(f"processamento: +{drain:.1f}s após o último ack | {processor.stats()} | {processor.store.counts()}")
+    print(f"estado final: {len(expected) - wrong}/{len(expected)} clientes corretos")
+    sys.exit(0 if wrong == 0 and not processor.store.counts().get('pending') else 1)
@@ -0,0 +1,252 @@
+# cache.py - Cache de respostas do modelo (LRU em memória + SQLite compartilhado)
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(model_name, prompt):
+    # Normaliza espaços para que variações triviais do prompt caiam na mesma chave
+    normalized = " ".join(str(prompt).split())
+    return hashlib.sha256(f"{model_name}\x00{normalized}".encode('utf-8')).hexdigest()
+
+
+def _size_of(value):
+    if isinstance(value, bytes): return len(value)
+    return len(str(value).encode('utf-8'))
+
+
+# --- TIER 1: MEMÓRIA DO PROCESSO ---
+class MemoryCache:
+    def __init__(self, max_items=1024, max_bytes=32 * 1024 * 1024, ttl=3600, size_of=_size_of):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size_of = size_of
+        self._data = OrderedDict()  # key -> (expira_em, tamanho, valor)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None: return None
+            expires_at, size, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                self._bytes -= size
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        size = self.size_of(value)
+        if size > self.max_bytes: return
+        expires_at = time.time() + (ttl or self.ttl)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old: self._bytes -= old[1]
+            self._data[key] = (expires_at, size, value)
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_items or self._bytes > self.max_bytes):
+                _, (_, old_size, _) = self._data.popitem(last=False)
+                self._bytes -= old_size
+
+    def delete(self, key):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old: self._bytes -= old[1]
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+
+# --- TIER 2: SQLITE (compartilhado entre workers do gunicorn) ---
+class SQLiteCache:
+    def __init__(self, path, ttl=3600, max_rows=50000, table='response_cache'):
+        self.path = path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.table = table
+        self._local = threading.local()
+        self._writes = 0
+        self._conn().execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        # Conexão herdada de um fork (gunicorn --preload) não pode ser reutilizada
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if not row or row[1] < time.time(): return None
+        return row[0]
+
+    def set(self, key, value, ttl=None):
+        conn = self._conn()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + (ttl or self.ttl))
+        )
+        self._writes += 1
+        if self._writes % 500 == 0: self.prune()
+
+    def get_many(self, keys):
+        found = {}
+        now = time.time()
+        for i in range(0, len(keys), 500):  # limite de parâmetros do SQLite
+            batch = keys[i:i + 500]
+            marks = ",".join("?" * len(batch))
+            rows = self._conn().execute(
+                f"SELECT key, value, expires_at FROM {self.table} WHERE key IN ({marks})", batch
+            ).fetchall()
+            found.update({k: v for k, v, expires_at in rows if expires_at >= now})
+        return found
+
+    def set_many(self, items, ttl=None):
+        expires_at = time.time() + (ttl or self.ttl)
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                [(k, v, expires_at) for k, v in items]
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        # Mesmo limiar do set(): cruzou um múltiplo de 500 escritas neste lote -> prune
+        before = self._writes
+        self._writes += len(items)
+        if self._writes // 500 > before // 500: self.prune()
+
+    def delete(self, key):
+        self._conn().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def prune(self):
+        conn = self._conn()
+        conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (time.time(),))
+        conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} "
+            f"ORDER BY expires_at DESC LIMIT -1 OFFSET ?)", (self.max_rows,)
+        )
+
+
+# --- CACHE COM COALESCÊNCIA DE REQUISIÇÕES IGUAIS ---
+class _InFlight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    def __init__(self, memory, shared=None):
+        self.memory = memory
+        self.shared = shared
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.shared is not None:
+            try: value = self.shared.get(key)
+            except sqlite3.Error: value = None
+            if value is not None:
+                self.shared_hits += 1
+                self.memory.set(key, value)
+                return value
+        return None
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.shared is not None:
+            try: self.shared.set(key, value)
+            except sqlite3.Error as e: print(f"Erro cache compartilhado: {e}")
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is not None: return value
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _InFlight()
+                self._inflight[key] = flight
+
+        if not leader:
+            # Outra thread já está gerando a mesma resposta: espera o resultado dela
+            self.coalesced += 1
+            flight.event.wait()
+            if flight.error is not None: raise flight.error
+            return flight.value
+
+        self.misses += 1
+        try:
+            flight.value = compute()
+            if flight.value is not None: self.set(key, flight.value)
+            return flight.value
+        except Exception as e:
+            self.errors += 1
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def stats(self):
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'hit_rate': round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+            'items': len(self.memory),
+            'bytes': self.memory.bytes,
+            'shared_backend': 'sqlite' if self.shared is not None else None,
+        }
+
+
+def build_response_cache():
+    ttl = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+    memory = MemoryCache(
+        max_items=int(os.environ.get('RESPONSE_CACHE_MAX_ITEMS', 1024)),
+        max_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+        ttl=ttl,
+    )
+    shared = None
+    db_path = os.environ.get('RESPONSE_CACHE_DB')
+    if db_path:
+        try: shared = SQLiteCache(db_path, ttl=ttl)
+        except sqlite3.Error as e: print(f"Erro ao abrir cache SQLite: {e}")
+    return ResponseCache(memory, shared)
@@ -0,0 +1,122 @@
+# context_builder.py - Monta o contexto do prompt dentro de um orçamento de tokens
+# Os trechos candidatos (busca vetorial) são limpos de boilerplate (números de página, cabeçalhos
+# e rodapés repetidos, sumário com pontilhado), os quase idênticos são descartados e o resto é
+# escolhido por MMR: relevância para a pergunta menos a semelhança com o que já entrou.
+# O orçamento e o tamanho final de cada prompt vão para o log e para /metrics.
+
+import os
+import re
+from collections import Counter
+
+import metrics
+from summarizer import estimate_tokens
+
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+_PAGE_NUMBER = re.compile(r'^\s*(p[áa]gina|page|p[áa]g\.|p\.)?\s*\d{1,4}\s*((de|of|/)\s*\d{1,4})?\s*$', re.I)
+_DOT_LEADER = re.compile(r'(\.\s?){4,}\s*\d{1,4}\s*$')
+_CUES = re.compile(r'\[(m[úu]sica|music|aplausos|applause|risos|laughter|inaud[íi]vel|inaudible)\]', re.I)
+_SPACES = re.compile(r'[ \t\u00a0]{2,}')
+_BLANK_LINES = re.compile(r'\n\s*\n(\s*\n)+')
+_WORD = re.compile(r'\w{3,}', re.U)
+_SENTENCE_END = re.compile(r'[.!?](\s|$)')
+
+
+def _repeated_lines(texts, min_count=3):
+    # Linhas curtas que se repetem em vários lugares (cabeçalho/rodapé de página) não dizem nada
+    counts = Counter(line.strip() for text in texts for line in set(text.splitlines()) if 10 <= len(line.strip()) <= 120)
+    return {line for line, n in counts.items() if n >= min_count}
+
+
+def strip_boilerplate(text, repeated=None):
+    if repeated is None: repeated = _repeated_lines(re.split(r'\n\s*\n', text))
+    lines = []
+    for line in _CUES.sub('', text).splitlines():
+        stripped = line.strip()
+        if _PAGE_NUMBER.match(stripped): continue
+        if _DOT_LEADER.search(stripped) or stripped in repeated: continue
+        lines.append(_SPACES.sub(' ', line).rstrip())
+    return _BLANK_LINES.sub('\n\n', '\n'.join(lines)).strip()
+
+
+def _words(text):
+    return frozenset(w.lower() for w in _WORD.findall(text))
+
+
+def _similarity(a, b):
+    if not a or not b: return 0.0
+    return len(a & b) / len(a | b)
+
+
+# Corta no fim da última frase que cabe (ou no limite bruto, se não houver frase inteira)
+def trim_to_tokens(text, max_tokens):
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars: return text
+    cut = text[:max_chars]
+    ends = [m.end() for m in _SENTENCE_END.finditer(cut)]
+    return (cut[:ends[-1]] if ends and ends[-1] > max_chars // 2 else cut).rstrip()
+
+
+class ContextBuilder:
+    # lambda_: peso da relevância no MMR (1 = só relevância, 0 = só diversidade)
+    def __init__(self, lambda_=0.7, duplicate_threshold=0.85, min_chunk_tokens=60, separator="\n---\n"):
+        self.lambda_ = lambda_
+        self.duplicate_threshold = duplicate_threshold
+        self.min_chunk_tokens = min_chunk_tokens
+        self.separator = separator
+
+    # matches: [{'content', 'similarity'?}] em ordem de relevância. Devolve (contexto, relatório).
+    def build(self, matches, budget):
+        contents = [m.get('content') or '' for m in matches]
+        repeated = _repeated_lines(contents)
+        candidates = []
+        for rank, (match, content) in enumerate(zip(matches, contents)):
+            text = strip_boilerplate(content, repeated)
+            if not text: continue
+            relevance = match.get('similarity')
+            if relevance is None: relevance = 1.0 - rank / max(len(matches), 1)
+            candidates.append({'text': text, 'relevance': float(relevance), 'words': _words(text)})
+
+        selected, used, duplicates = [], 0, 0
+        separator_tokens = estimate_tokens(self.separator)
+        while candidates and used < budget:
+            best, best_score = None, None
+            for candidate in candidates:
+                overlap = max((_similarity(candidate['words'], s['words']) for s in selected), default=0.0)
+                candidate['overlap'] = overlap
+                score = self.lambda_ * candidate['relevance'] - (1 - self.lambda_) * overlap
+                if best_score is None or score > best_score: best, best_score = candidate, score
+            candidates.remove(best)
+            if best['overlap'] >= self.duplicate_threshold:
+                duplicates += 1
+                continue
+            room = budget - used - (separator_tokens if selected else 0)
+            tokens = estimate_tokens(best['text'])
+            if tokens > room:
+                # Só o último trecho é cortado, e só se ainda sobrar um pedaço útil
+                if room < self.min_chunk_tokens: continue
+                best['text'] = trim_to_tokens(best['text'], room)
+                tokens = estimate_tokens(best['text'])
+            selected.append(best)
+            used += tokens + (separator_tokens if len(selected) > 1 else 0)
+
+        context = self.separator.join(s['text'] for s in selected)
+        report = {'candidates': len(matches), 'selected': len(selected), 'duplicates': duplicates,
+                  'context_tokens': estimate_tokens(context), 'raw_tokens': sum(estimate_tokens(c) for c in contents)}
+        return context, report
+
+
+def record_prompt(route, prompt, budget, **details):
+    tokens = estimate_tokens(prompt)
+    metrics.registry.observe('prompt_tokens', {'route': route}, tokens, TOKEN_BUCKETS,
+                             help_text='Tamanho estimado do prompt final (tokens)')
+    extra = ' '.join(f"{k}={v}" for k, v in details.items())
+    print(f"Prompt {route}: {tokens} tokens (orçamento {budget}) {extra}".rstrip())
+    return tokens
+
+
+def build_context_builder():
+    return ContextBuilder(
+        lambda_=float(os.environ.get('CONTEXT_MMR_LAMBDA', 0.7)),
+        duplicate_threshold=float(os.environ.get('CONTEXT_DUPLICATE_THRESHOLD', 0.85)),
+    )
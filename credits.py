@@ -0,0 +1,55 @@
+# credits.py - Ledger de créditos: débito atômico via RPC + cache curto de VIP
+# Funções SQL em sql/credits.sql (consume_credits / refund_credits)
+
+import threading
+import time
+
+
+class CreditLedger:
+    def __init__(self, get_client, pro_ttl=60):
+        self.get_client = get_client  # função que devolve o client do Supabase
+        self.pro_ttl = pro_ttl
+        self._pro = {}  # user_id -> expira_em (só guardamos quem é VIP)
+        self._lock = threading.Lock()
+
+    def _is_cached_pro(self, user_id):
+        with self._lock:
+            expires_at = self._pro.get(user_id)
+            if expires_at is None: return False
+            if expires_at < time.time():
+                del self._pro[user_id]
+                return False
+            return True
+
+    def mark_pro(self, user_id):
+        with self._lock:
+            self._pro[user_id] = time.time() + self.pro_ttl
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None: self._pro.clear()
+            else: self._pro.pop(user_id, None)
+
+    # Devolve (ok, mensagem, créditos_debitados). Uma única ida ao banco (ou nenhuma, se VIP em cache).
+    def charge(self, user_id, amount=1):
+        if self._is_cached_pro(user_id): return True, "Sucesso (VIP)", 0
+        client = self.get_client()
+        if not client: return False, "Erro de banco de dados.", 0
+        try:
+            res = client.rpc('consume_credits', {'p_user_id': user_id, 'p_amount': amount}).execute()
+        except Exception as e: return False, str(e), 0
+
+        row = res.data[0] if isinstance(res.data, list) and res.data else res.data
+        if not row or row.get('is_pro') is None: return False, "Usuário não encontrado.", 0
+        if row.get('is_pro'):
+            self.mark_pro(user_id)
+            return True, "Sucesso (VIP)", 0
+        if not row.get('ok'): return False, "Sem créditos.", 0
+        return True, "Sucesso", row.get('charged', amount)
+
+    def refund(self, user_id, amount=1):
+        if amount <= 0: return
+        client = self.get_client()
+        if not client: return
+        try: client.rpc('refund_credits', {'p_user_id': user_id, 'p_amount': amount}).execute()
+        except Exception as e: print(f"Erro ao estornar crédito de {user_id}: {e}")
@@ -0,0 +1,263 @@
+# docx_render.py - Markdown -> DOCX rápido
+# O Markdown é lido uma vez e vira uma lista de blocos; o XML do corpo é gerado em texto e escrito
+# direto no zip do .docx, sobre um template carregado uma única vez por processo. Sem árvore lxml
+# por parágrafo nem milhares de chamadas add_paragraph: memória limitada ao arquivo de saída.
+
+import io
+import os
+import re
+import tempfile
+import threading
+import zipfile
+from xml.sax.saxutils import escape
+
+_W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+_HEADING = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+_BULLET = re.compile(r'^(\s*)[-*+]\s+(.*)$')
+_NUMBER = re.compile(r'^(\s*)\d+[.)]\s+(.*)$')
+_QUOTE = re.compile(r'^>\s?(.*)$')
+_RULE = re.compile(r'^\s*([-*_])(\s*\1){2,}\s*$')
+_TABLE_SEP = re.compile(r'^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$')
+_FENCE = re.compile(r'^\s*(```|~~~)')
+_INLINE = re.compile(r'\*\*(.+?)\*\*|__(.+?)__|`([^`]+)`|\*(?!\s)(.+?)\*|(?<!\w)_(?!\s)(.+?)_(?!\w)')
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+# --- PARSER ---
+# Blocos: (tipo, nível, conteúdo). Conteúdo é texto cru (inline é resolvido na renderização),
+# exceto em tabelas (lista de linhas com as células).
+def parse_markdown(text):
+    blocks = []
+    paragraph = []
+    lines = (text or "").replace('\r\n', '\n').split('\n')
+
+    def flush():
+        if paragraph:
+            blocks.append(('paragraph', 0, " ".join(paragraph)))
+            paragraph.clear()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+
+        if _FENCE.match(line):
+            flush()
+            code = []
+            i += 1
+            while i < len(lines) and not _FENCE.match(lines[i]):
+                code.append(lines[i])
+                i += 1
+            blocks.append(('code', 0, "\n".join(code)))
+        elif not stripped:
+            flush()
+        elif stripped.startswith('|'):
+            flush()
+            rows = []
+            while i < len(lines) and lines[i].strip().startswith('|'):
+                row = lines[i].strip()
+                if not _TABLE_SEP.match(row):
+                    rows.append([cell.strip() for cell in row.strip('|').split('|')])
+                i += 1
+            blocks.append(('table', 0, rows))
+            continue
+        elif _RULE.match(line):
+            flush()
+            blocks.append(('rule', 0, ''))
+        elif _HEADING.match(line):
+            flush()
+            match = _HEADING.match(line)
+            blocks.append(('heading', len(match.group(1)), match.group(2)))
+        elif _BULLET.match(line) or _NUMBER.match(line):
+            flush()
+            match = _BULLET.match(line)
+            kind = 'bullet' if match else 'number'
+            match = match or _NUMBER.match(line)
+            blocks.append((kind, min(len(match.group(1).expandtabs(4)) // 2, 2), match.group(2)))
+        elif _QUOTE.match(stripped):
+            flush()
+            blocks.append(('quote', 0, _QUOTE.match(stripped).group(1)))
+        else:
+            paragraph.append(stripped)
+        i += 1
+    flush()
+    return blocks
+
+
+# --- XML ---
+def _text(value):
+    return escape(_INVALID_XML.sub('', value))
+
+
+def _run(text, bold=False, italic=False, code=False):
+    props = ''
+    if code: props += '<w:rFonts w:ascii="Courier New" w:hAnsi="Courier New" w:cs="Courier New"/>'
+    if bold: props += '<w:b/>'
+    if italic: props += '<w:i/>'
+    if props: props = f'<w:rPr>{props}</w:rPr>'
+    return f'<w:r>{props}<w:t xml:space="preserve">{_text(text)}</w:t></w:r>'
+
+
+def _inline(text, bold=False):
+    runs, pos = [], 0
+    for match in _INLINE.finditer(text):
+        if match.start() > pos: runs.append(_run(text[pos:match.start()], bold=bold))
+        strong, strong2, code, em, em2 = match.groups()
+        if strong or strong2: runs.append(_run(strong or strong2, bold=True))
+        elif code: runs.append(_run(code, bold=bold, code=True))
+        else: runs.append(_run(em or em2, bold=bold, italic=True))
+        pos = match.end()
+    if pos < len(text): runs.append(_run(text[pos:], bold=bold))
+    return ''.join(runs)
+
+
+def _paragraph(body, style=None, num_id=None, extra_ppr=''):
+    ppr = f'<w:pStyle w:val="{style}"/>' if style else ''
+    if num_id is not None: ppr += f'<w:numPr><w:ilvl w:val="0"/><w:numId w:val="{num_id}"/></w:numPr>'
+    ppr += extra_ppr
+    return f'<w:p>{f"<w:pPr>{ppr}</w:pPr>" if ppr else ""}{body}</w:p>'
+
+
+class _Template:
+    # Template carregado uma vez: partes do zip, document.xml dividido em volta do corpo,
+    # ids de estilo, largura útil da página e a numeração usada pelo estilo "List Number"
+    def __init__(self, path=None):
+        from docx import Document
+        if path:
+            with open(path, 'rb') as f: data = f.read()
+        else:
+            buffer = io.BytesIO()
+            Document().save(buffer)
+            data = buffer.getvalue()
+
+        doc = Document(io.BytesIO(data))
+        self.styles = {style.name: style.style_id for style in doc.styles}
+        section = doc.sections[0]
+        self.text_width = int((section.page_width - section.left_margin - section.right_margin) / 635)  # EMU -> twips
+
+        self.abstract_num_id = None
+        self.next_num_id = 1
+        try: numbering = doc.part.numbering_part.element
+        except NotImplementedError: numbering = None  # template sem numbering.xml
+        if numbering is not None:
+            nums = {n.numId: n for n in numbering.num_lst}
+            self.next_num_id = max(nums, default=0) + 1
+            style = doc.styles['List Number'] if 'List Number' in self.styles else None
+            num_pr = style.element.pPr.numPr if style is not None and style.element.pPr is not None else None
+            if num_pr is not None and num_pr.numId is not None and num_pr.numId.val in nums:
+                self.abstract_num_id = nums[num_pr.numId.val].abstractNumId.val
+
+        with zipfile.ZipFile(io.BytesIO(data)) as z:
+            self.parts = [(info, z.read(info)) for info in z.infolist()]
+        xml = dict((info.filename, content) for info, content in self.parts)['word/document.xml'].decode('utf-8')
+        body_end = xml.rfind('<w:sectPr')
+        if body_end == -1 or body_end < xml.find('<w:body'): body_end = xml.rfind('</w:body>')
+        self.document_head, self.document_tail = xml[:body_end], xml[body_end:]
+
+    def style(self, name):
+        return self.styles.get(name)
+
+
+class DocxRenderer:
+    def __init__(self, template_path=None):
+        self.template_path = template_path
+        self._template = None
+        self._lock = threading.Lock()
+
+    @property
+    def template(self):
+        if self._template is None:
+            with self._lock:
+                if self._template is None: self._template = _Template(self.template_path)
+        return self._template
+
+    def _table(self, rows, template):
+        columns = max(len(row) for row in rows)
+        width = template.text_width // columns
+        style = template.style('Table Grid')
+        parts = ['<w:tbl><w:tblPr>', f'<w:tblStyle w:val="{style}"/>' if style else '',
+                 '<w:tblW w:w="0" w:type="auto"/></w:tblPr><w:tblGrid>',
+                 f'<w:gridCol w:w="{width}"/>' * columns, '</w:tblGrid>']
+        for r, row in enumerate(rows):
+            parts.append('<w:tr>')
+            for cell in row + [''] * (columns - len(row)):
+                parts.append(f'<w:tc><w:tcPr><w:tcW w:w="{width}" w:type="dxa"/></w:tcPr>'
+                             f'{_paragraph(_inline(cell, bold=r == 0))}</w:tc>')
+            parts.append('</w:tr>')
+        parts.append('</w:tbl>')
+        return ''.join(parts)
+
+    # Gera o XML bloco a bloco. list_nums recebe os w:num novos: cada lista numerada recomeça do 1.
+    def _body_xml(self, blocks, template, list_nums):
+        previous = None
+        num_id = None
+        for kind, level, content in blocks:
+            if kind == 'heading':
+                yield _paragraph(_inline(content), template.style(f'Heading {level}'))
+            elif kind == 'paragraph':
+                yield _paragraph(_inline(content))
+            elif kind == 'bullet':
+                yield _paragraph(_inline(content), template.style('List Bullet' + (f' {level + 1}' if level else '')))
+            elif kind == 'number':
+                if level == 0:
+                    if previous != 'number' and template.abstract_num_id is not None:
+                        num_id = template.next_num_id + len(list_nums)
+                        list_nums.append(num_id)
+                    yield _paragraph(_inline(content), template.style('List Number'), num_id)
+                else:
+                    yield _paragraph(_inline(content), template.style(f'List Number {level + 1}'))
+            elif kind == 'quote':
+                yield _paragraph(_inline(content), template.style('Quote'))
+            elif kind == 'code':
+                yield _paragraph('<w:r><w:br/></w:r>'.join(_run(line, code=True) for line in content.split('\n')),
+                                 template.style('No Spacing'))
+            elif kind == 'rule':
+                yield _paragraph('', extra_ppr='<w:pBdr><w:bottom w:val="single" w:sz="6" w:space="1" w:color="auto"/></w:pBdr>')
+            elif kind == 'table' and content:
+                yield self._table(content, template)
+                yield _paragraph('')
+            previous = kind
+
+    def _numbering_xml(self, xml, template, list_nums):
+        if not list_nums: return xml
+        nums = ''.join(f'<w:num w:numId="{num_id}"><w:abstractNumId w:val="{template.abstract_num_id}"/>'
+                       f'<w:lvlOverride w:ilvl="0"><w:startOverride w:val="1"/></w:lvlOverride></w:num>'
+                       for num_id in list_nums)
+        # w:num vem depois dos abstractNum e antes de numIdMacAtCleanup (se existir)
+        anchor = xml.find('<w:numIdMacAtCleanup')
+        if anchor == -1: anchor = xml.rfind('</w:numbering>')
+        return xml[:anchor] + nums + xml[anchor:]
+
+    # Escreve o .docx num arquivo temporário (em memória até spool_bytes, depois em disco),
+    # já posicionado no início para o send_file mandar em blocos
+    def render_to_file(self, markdown_text, spool_bytes=8 * 1024 * 1024, flush_bytes=256 * 1024):
+        template = self.template
+        blocks = parse_markdown(markdown_text)
+        list_nums = []
+        f = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+        with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as out:
+            for info, content in template.parts:
+                if info.filename == 'word/document.xml':
+                    with out.open(info.filename, 'w') as document:
+                        pending, size = [template.document_head], 0
+                        for xml in self._body_xml(blocks, template, list_nums):
+                            pending.append(xml)
+                            size += len(xml)
+                            if size >= flush_bytes:
+                                document.write(''.join(pending).encode('utf-8'))
+                                pending, size = [], 0
+                        pending.append(template.document_tail)
+                        document.write(''.join(pending).encode('utf-8'))
+                elif info.filename != 'word/numbering.xml':
+                    out.writestr(info, content, zipfile.ZIP_DEFLATED)
+            # numbering.xml por último: só agora se sabe quantas listas numeradas o documento tem
+            numbering = next((c for i, c in template.parts if i.filename == 'word/numbering.xml'), None)
+            if numbering is not None:
+                out.writestr('word/numbering.xml', self._numbering_xml(numbering.decode('utf-8'), template, list_nums))
+        f.seek(0)
+        return f
+
+
+def build_docx_renderer():
+    return DocxRenderer(os.environ.get('DOCX_TEMPLATE') or None)
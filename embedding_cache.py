@@ -0,0 +1,118 @@
+# embedding_cache.py - Cache de embeddings endereçado por conteúdo (hash de modelo + texto)
+# Tier em memória + tier persistente SQLite (compartilhado entre workers do gunicorn).
+
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+
+from cache import MemoryCache, SQLiteCache
+
+
+def embedding_key(model_name, text):
+    return hashlib.sha256(f"{model_name}\x00{text}".encode('utf-8')).hexdigest()
+
+
+# Vetores guardados como float32 compactado (4 bytes por dimensão)
+def pack(vector):
+    return array('f', vector).tobytes()
+
+
+def unpack(blob):
+    vector = array('f')
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class EmbeddingCache:
+    def __init__(self, model_name, memory, persistent=None):
+        self.model_name = model_name
+        self.memory = memory
+        self.persistent = persistent
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def lookup_many(self, texts):
+        keys = [embedding_key(self.model_name, t) for t in texts]
+        found = {}
+        missing = []
+        for key in keys:
+            blob = self.memory.get(key)
+            if blob is not None: found[key] = blob
+            else: missing.append(key)
+        memory_hits = len(found)
+
+        if missing and self.persistent is not None:
+            try: stored = self.persistent.get_many(missing)
+            except sqlite3.Error as e:
+                print(f"Erro cache de embeddings: {e}")
+                stored = {}
+            for key, blob in stored.items():
+                self.memory.set(key, blob)
+            found.update(stored)
+
+        self._count(hits=memory_hits, persistent_hits=len(found) - memory_hits)
+        return keys, {key: unpack(blob) for key, blob in found.items()}
+
+    def store_many(self, keys, vectors):
+        blobs = [(k, pack(v)) for k, v in zip(keys, vectors)]
+        for key, blob in blobs:
+            self.memory.set(key, blob)
+        if self.persistent is not None:
+            try: self.persistent.set_many(blobs)
+            except sqlite3.Error as e: print(f"Erro cache de embeddings: {e}")
+
+    # Devolve os vetores na ordem de texts, chamando embed_batch só para os textos ausentes
+    def embed_many(self, texts, embed_batch):
+        texts = list(texts)
+        keys, found = self.lookup_many(texts)
+        todo = {}  # key -> texto (textos repetidos no lote viram uma chamada só)
+        for key, text in zip(keys, texts):
+            if key not in found: todo.setdefault(key, text)
+        if todo:
+            self._count(misses=len(todo))
+            try: vectors = embed_batch(list(todo.values()))
+            except Exception:
+                self._count(failures=1)
+                raise
+            self.store_many(list(todo.keys()), vectors)
+            found.update(zip(todo.keys(), vectors))
+        return [found[key] for key in keys]
+
+    def embed(self, text, embed_batch):
+        return self.embed_many([text], embed_batch)[0]
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'persistent_hits': self.persistent_hits,
+            'misses': self.misses,
+            'failures': self.failures,
+            'items': len(self.memory),
+            'bytes': self.memory.bytes,
+            'persistent_backend': 'sqlite' if self.persistent is not None else None,
+        }
+
+
+def build_embedding_cache(model_name):
+    ttl = int(os.environ.get('EMBEDDING_CACHE_TTL', 30 * 24 * 3600))
+    memory = MemoryCache(
+        max_items=int(os.environ.get('EMBEDDING_CACHE_MAX_ITEMS', 20000)),
+        max_bytes=int(os.environ.get('EMBEDDING_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+        ttl=ttl,
+    )
+    persistent = None
+    db_path = os.environ.get('EMBEDDING_CACHE_DB')
+    if db_path:
+        try: persistent = SQLiteCache(db_path, ttl=ttl, max_rows=500000, table='embedding_cache')
+        except sqlite3.Error as e: print(f"Erro ao abrir cache de embeddings: {e}")
+    return EmbeddingCache(model_name, memory, persistent)
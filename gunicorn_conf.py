@@ -0,0 +1,55 @@
+# gunicorn_conf.py - Modo de alta concorrência: gunicorn -c gunicorn_conf.py wsgi:app
+# As rotas passam quase todo o tempo esperando Gemini/Supabase/Replicate/Stripe, então cada worker
+# atende várias requisições em threads (gthread) em vez de uma por processo (sync). Menos processos
+# para a mesma concorrência = menos memória. Medições em bench/loadtest.py (--worker-class gthread).
+#
+#   WEB_CONCURRENCY=2        processos
+#   GUNICORN_THREADS=16      requisições simultâneas por processo
+#   GUNICORN_WORKER_CLASS    gthread (padrão) | gevent (exige "pip install gevent") | sync
+#   HTTP_POOL_SIZE           conexões por client HTTP (padrão: uma por thread)
+#
+# Variáveis do app que só fazem sentido no deploy:
+#   TRUSTED_PROXIES=1        quantos proxies na frente repassam X-Forwarded-* (0 = não confia; padrão)
+#   IMAGE_STORE_DIR          volume persistente das imagens geradas (sem ele as imagens não são guardadas)
+
+import os
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Com threads > 1 o gunicorn troca sync por gthread sozinho; sync aqui quer dizer o modo antigo mesmo
+threads = int(os.environ.get('GUNICORN_THREADS', 16)) if worker_class != 'sync' else 1
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))  # gevent
+
+# Geração longa e SSE seguram a requisição; o timeout do gthread é o heartbeat do worker, não da requisição
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Reciclar workers limita crescimento de memória; desligado por padrão (filas em memória morrem junto)
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+# Mesmo comportamento do wsgi.py: com preload os SDKs são importados uma vez no master
+preload_app = os.environ.get('PRELOAD_SERVICES') == '1'
+
+# Uma conexão HTTP por thread (ou por greenlet, limitado) para Supabase e Replicate
+os.environ.setdefault('HTTP_POOL_SIZE', str(threads if worker_class != 'gevent' else min(worker_connections, 64)))
+# Limite de chamadas simultâneas ao Gemini por worker acompanha a concorrência do worker
+os.environ.setdefault('GEMINI_INITIAL_CONCURRENCY', str(min(threads, 32)))
+
+
+def post_worker_init(worker):
+    # O Gemini fala gRPC: sem isso, sob gevent, cada chamada bloquearia o worker inteiro.
+    # Roda depois do monkey patch do gevent e antes do primeiro canal gRPC (criado no primeiro uso)
+    if worker_class == 'gevent':
+        try:
+            from grpc.experimental import gevent as grpc_gevent
+            grpc_gevent.init_gevent()
+        except ImportError:
+            pass
+
+    # Filas/timer dos webhooks (WEBHOOK_ASYNC=1) são threads: sobem em cada worker, depois do fork
+    app_module = sys.modules.get('app')
+    if app_module is not None: app_module.webhook_processor.start()
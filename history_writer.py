@@ -0,0 +1,218 @@
+# history_writer.py - Gravação assíncrona (write-behind) do user_history
+# Registros entram numa fila em memória e são gravados em lote por uma thread de fundo.
+# Se o Supabase estiver fora, o lote vai para um arquivo local e é reenviado depois (até max_replays
+# vezes). Linhas que o banco recusa (uuid inválido, coluna inexistente...) não são reenviadas: o lote
+# é dividido ao meio até isolar a linha ruim, que é descartada sem travar as outras.
+
+import atexit
+import glob
+import json
+import os
+import queue
+import threading
+import time
+
+# SQLSTATE de dados/esquema (22 = valor inválido, 23 = constraint, 42 = coluna/tabela) e erros de
+# requisição do PostgREST (PGRST1xx/2xx): tentar de novo a mesma linha nunca vai funcionar
+_DATA_ERROR_PREFIXES = ('22', '23', '42', 'PGRST1', 'PGRST2')
+
+
+def is_data_error(error):
+    # APIError do postgrest traz o código do banco; erros de rede/timeout não têm 'code'
+    code = str(getattr(error, 'code', None) or '')
+    return type(error).__name__ == 'APIError' and code.startswith(_DATA_ERROR_PREFIXES)
+
+
+class HistoryWriter:
+    def __init__(self, get_client, table='user_history', batch_size=50, flush_interval=2.0,
+                 max_queue=10000, spill_dir=None, max_replays=100):
+        self.get_client = get_client
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_dir = spill_dir
+        self.max_replays = max_replays
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._replay_after = 0.0
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.last_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    # A thread nasce no primeiro enqueue de cada processo (threads não sobrevivem ao fork do gunicorn)
+    def start(self):
+        if self._pid == os.getpid(): return self
+        with self._start_lock:
+            # Vários primeiros enqueues simultâneos (gthread): só um sobe a thread
+            if self._pid != os.getpid():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._loop, name='history-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+                self._pid = os.getpid()
+        return self
+
+    def enqueue(self, record):
+        self.start()
+        try: self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        if self._queue.qsize() >= self.batch_size: self._wakeup.set()
+        return True
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            # Um erro inesperado não pode matar a thread: o enqueue não a recria no mesmo processo
+            try: self.flush()
+            except Exception as e: print(f"Erro no gravador de histórico: {e}")
+
+    def _drain(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            try: batch.append(self._queue.get_nowait())
+            except queue.Empty: break
+        return batch
+
+    def flush(self):
+        with self._flush_lock:
+            while True:
+                batch = self._drain()
+                if not batch: break
+                failed = self._insert(batch)
+                if failed:
+                    self._spill([{'row': row, 'attempts': 0} for row in failed])
+                    return
+            if time.time() >= self._replay_after: self._replay_spill()
+
+    # Devolve as linhas que não foram gravadas ([] = sucesso)
+    def _insert(self, rows):
+        client = self.get_client()
+        if not client: return rows
+        # Insert multi-linha exige as mesmas colunas em todas as linhas: agrupa por conjunto de chaves
+        groups = {}
+        for row in rows: groups.setdefault(tuple(sorted(row)), []).append(row)
+        failed = []
+        for group in groups.values(): failed.extend(self._insert_group(client, group))
+        return failed
+
+    def _insert_group(self, client, group):
+        started = time.perf_counter()
+        try: client.table(self.table).insert(group).execute()
+        except Exception as e:
+            self.failures += 1
+            if not is_data_error(e):
+                self._replay_after = time.time() + 30  # Supabase fora: não fica relendo o spill a cada ciclo
+                print(f"Erro ao salvar histórico em lote: {e}")
+                return group
+            if len(group) == 1:
+                self.rejected += 1
+                print(f"Histórico recusado pelo banco e descartado: {e} {json.dumps(group[0], ensure_ascii=False)[:200]}")
+                return []
+            # Lote com linha ruim: divide ao meio até isolar a(s) recusada(s)
+            half = len(group) // 2
+            return self._insert_group(client, group[:half]) + self._insert_group(client, group[half:])
+        self.last_flush_ms = round((time.perf_counter() - started) * 1000, 1)
+        self.total_flush_ms += self.last_flush_ms
+        self.batches += 1
+        self.flushed += len(group)
+        return []
+
+    def _spill_path(self):
+        return os.path.join(self.spill_dir, f"history-spill-{os.getpid()}.jsonl")
+
+    # entries: [{'row', 'attempts'}] (attempts = reenvios do spill que já falharam)
+    def _spill(self, entries):
+        if not self.spill_dir:
+            self.dropped += len(entries)
+            return
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(self._spill_path(), 'a', encoding='utf-8') as f:
+                for entry in entries: f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.spilled += len(entries)
+        except OSError as e:
+            print(f"Erro ao gravar spill do histórico: {e}")
+            self.dropped += len(entries)
+
+    def _replay_spill(self):
+        if not self.spill_dir: return
+        for path in glob.glob(os.path.join(self.spill_dir, 'history-spill-*.jsonl')):
+            # Renomear "reserva" o arquivo para este processo (outros workers podem tentar o mesmo)
+            claimed = f"{path}.replay-{os.getpid()}"
+            try: os.rename(path, claimed)
+            except OSError: continue
+            entries = []
+            with open(claimed, encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip(): continue
+                    # Linha cortada (worker morto no meio do _spill): descarta só ela
+                    try: entry = json.loads(line)
+                    except ValueError:
+                        self.dropped += 1
+                        print(f"Linha inválida no spill do histórico ignorada: {line[:80]!r}")
+                        continue
+                    if 'row' not in entry: entry = {'row': entry, 'attempts': 0}  # formato antigo: só a linha
+                    entries.append(entry)
+            for i in range(0, len(entries), self.batch_size):
+                batch = entries[i:i + self.batch_size]
+                failed = {id(row) for row in self._insert([e['row'] for e in batch])}
+                if not failed:
+                    self.replayed += len(batch)
+                    continue
+                retry = []
+                for entry in batch:
+                    if id(entry['row']) not in failed: continue
+                    attempts = entry['attempts'] + 1
+                    if attempts >= self.max_replays: self.dropped += 1
+                    else: retry.append({'row': entry['row'], 'attempts': attempts})
+                if len(retry) < len(failed): print(f"Histórico descartado após {self.max_replays} reenvios: {len(failed) - len(retry)} linha(s)")
+                self.replayed += len(batch) - len(failed)
+                self._spill(retry + entries[i + self.batch_size:])
+                os.remove(claimed)
+                return
+            os.remove(claimed)
+
+    def close(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None: self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'flushed': self.flushed,
+            'batches': self.batches,
+            'failures': self.failures,
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+            'spilled': self.spilled,
+            'replayed': self.replayed,
+            'last_flush_ms': self.last_flush_ms,
+            'avg_flush_ms': round(self.total_flush_ms / self.batches, 1) if self.batches else 0.0,
+        }
+
+
+def build_history_writer(get_client):
+    return HistoryWriter(
+        get_client,
+        batch_size=int(os.environ.get('HISTORY_BATCH_SIZE', 50)),
+        flush_interval=float(os.environ.get('HISTORY_FLUSH_INTERVAL', 2.0)),
+        max_queue=int(os.environ.get('HISTORY_MAX_QUEUE', 10000)),
+        spill_dir=os.environ.get('HISTORY_SPILL_DIR', '/tmp/adapta-history-spill'),
+        max_replays=int(os.environ.get('HISTORY_MAX_REPLAYS', 100)),
+    )
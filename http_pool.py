@@ -0,0 +1,69 @@
+# http_pool.py - Pool de conexões HTTP compartilhado entre as threads do worker
+# Supabase (postgrest) e Replicate usam httpx por baixo; um httpx.Client é thread-safe e reaproveita
+# conexões keep-alive, então cada worker mantém UM client por serviço, com limites explícitos
+# (o padrão do httpx é 100 conexões / 20 keep-alive, independente de quantas threads existem).
+
+import os
+import threading
+
+_lock = threading.Lock()
+_clients = {}  # nome -> (pid, client)
+
+
+def pool_limits():
+    import httpx
+    max_connections = int(os.environ.get('HTTP_POOL_SIZE', 32))
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=int(os.environ.get('HTTP_POOL_KEEPALIVE', max_connections)),
+        keepalive_expiry=float(os.environ.get('HTTP_KEEPALIVE_EXPIRY', 30)),
+    )
+
+
+def pool_timeout(default_read=30.0):
+    import httpx
+    # pool = quanto uma thread espera por uma conexão livre quando todas estão em uso
+    return httpx.Timeout(float(os.environ.get('HTTP_TIMEOUT', default_read)), connect=5.0,
+                         pool=float(os.environ.get('HTTP_POOL_TIMEOUT', 10)))
+
+
+def pooled_supabase(client):
+    # Troca a sessão do postgrest por uma com o pool configurado (mesma URL, headers e autenticação)
+    old = getattr(getattr(client, 'postgrest', None), 'session', None)
+    if old is None: return client  # outra versão do SDK (ou o fake dos benchmarks): mantém como está
+    from postgrest.utils import SyncClient
+    client.postgrest.session = SyncClient(base_url=old.base_url, headers=old.headers, auth=old.auth,
+                                          timeout=pool_timeout(), limits=pool_limits())
+    old.close()
+    return client
+
+
+def _per_worker(name, factory):
+    pid = os.getpid()
+    entry = _clients.get(name)
+    if entry and entry[0] == pid: return entry[1]
+    with _lock:
+        entry = _clients.get(name)
+        if not entry or entry[0] != pid:
+            entry = _clients[name] = (pid, factory())
+        return entry[1]
+
+
+def replicate_client():
+    # Um client por worker (criado depois do fork); o replicate.Client padrão cria o seu sem trava
+    def factory():
+        import httpx
+        import replicate
+        client = replicate.Client(api_token=os.environ.get('REPLICATE_API_TOKEN'),
+                                  transport=httpx.HTTPTransport(limits=pool_limits(), retries=1))
+        client._client  # o httpx.Client interno também é preguiçoso: cria aqui, sob a trava
+        return client
+    return _per_worker('replicate', factory)
+
+
+def download_client():
+    # Downloads de arquivos gerados (ex.: imagens do Replicate): segue redirects, timeout de leitura maior
+    def factory():
+        import httpx
+        return httpx.Client(limits=pool_limits(), timeout=pool_timeout(default_read=60.0), follow_redirects=True)
+    return _per_worker('download', factory)
@@ -0,0 +1,198 @@
+# image_store.py - Imagens geradas guardadas pelo conteúdo (sha256) + índice de prompts
+# A URL devolvida pelo Replicate expira: a imagem é baixada uma vez, gravada em <raiz>/<ab>/<sha256>
+# e servida por /images/<sha256> (o hash é o ETag, então o cache pode ser eterno). A miniatura é
+# gerada na ingestão e também fica endereçada pelo conteúdo. O índice (prompt, modelo, tamanho)
+# devolve na hora uma imagem já gerada para o mesmo prompt recente, sem outra execução do SDXL.
+# O diretório precisa ser persistente (o image_history aponta para /images/<sha256>): sem
+# IMAGE_STORE_DIR o store fica desligado. max_total_bytes limita o disco apagando as mais antigas.
+
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+from cache import make_key
+
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+def prompt_key(prompt, model, width, height):
+    return make_key(f"{model}:{width}x{height}", prompt)
+
+
+class ImageStore:
+    def __init__(self, root, db_path=None, max_bytes=20 * 1024 * 1024, thumb_size=256, ttl=7 * 86400,
+                 max_total_bytes=0, prune_every=50):
+        self.root = root
+        self.db_path = db_path or os.path.join(root, 'index.db')
+        self.max_bytes = max_bytes
+        self.max_total_bytes = max_total_bytes
+        self.prune_every = prune_every
+        self.thumb_size = thumb_size
+        self.ttl = ttl
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.ingested = 0
+        self.pruned = 0
+        os.makedirs(root, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS image_blobs (digest TEXT PRIMARY KEY, content_type TEXT, size INTEGER, "
+            "width INTEGER, height INTEGER, thumb TEXT, created_at REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS image_prompts (key TEXT PRIMARY KEY, digest TEXT, prompt TEXT, model TEXT, "
+            "width INTEGER, height INTEGER, created_at REAL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        # Conexão herdada de um fork (gunicorn --preload) não pode ser reutilizada
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    # --- GRAVAÇÃO ---
+    # Grava os blocos num temporário calculando o hash e move para o nome definitivo (atômico).
+    # Conteúdo repetido cai no mesmo arquivo.
+    def _write(self, blocks):
+        digest, size = hashlib.sha256(), 0
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.ingest-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for block in blocks:
+                    size += len(block)
+                    if size > self.max_bytes: raise ImageTooLarge(f"Imagem maior que {self.max_bytes} bytes")
+                    digest.update(block)
+                    out.write(block)
+            digest = digest.hexdigest()
+            os.makedirs(os.path.dirname(self.path(digest)), exist_ok=True)
+            os.replace(tmp, self.path(digest))
+            return digest, size
+        except BaseException:
+            try: os.unlink(tmp)
+            except OSError: pass
+            raise
+
+    def _save_blob(self, digest, size, content_type, width, height, thumb=None):
+        self._conn().execute(
+            "INSERT OR IGNORE INTO image_blobs (digest, content_type, size, width, height, thumb, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", (digest, content_type, size, width, height, thumb, time.time())
+        )
+
+    def ingest_bytes(self, blocks):
+        from PIL import Image
+        digest, size = self._write(blocks)
+        existing = self.blob(digest)
+        if existing: return existing
+        try:
+            with Image.open(self.path(digest)) as image:
+                content_type = Image.MIME.get(image.format, 'application/octet-stream')
+                width, height = image.size
+                thumb = image.copy()
+        except Exception:
+            os.unlink(self.path(digest))  # não é imagem (ex.: página de erro): não fica no store
+            raise
+        thumb.thumbnail((self.thumb_size, self.thumb_size))
+        if thumb.mode not in ('RGB', 'RGBA'): thumb = thumb.convert('RGBA' if 'A' in thumb.getbands() else 'RGB')
+        buf = io.BytesIO()
+        thumb.save(buf, format='WEBP', quality=80)
+        thumb_digest, thumb_size = self._write([buf.getvalue()])
+        self._save_blob(thumb_digest, thumb_size, 'image/webp', thumb.width, thumb.height)
+        self._save_blob(digest, size, content_type, width, height, thumb_digest)
+        self.ingested += 1
+        if self.max_total_bytes and self.ingested % self.prune_every == 0:
+            try: self.prune(keep=digest)
+            except (OSError, sqlite3.Error) as e: print(f"Erro ao limpar o store de imagens: {e}")
+        return self.blob(digest)
+
+    def ingest_url(self, url):
+        from http_pool import download_client
+        with download_client().stream('GET', url) as response:
+            response.raise_for_status()
+            return self.ingest_bytes(response.iter_bytes(64 * 1024))
+
+    # --- LEITURA ---
+    def blob(self, digest):
+        if not _DIGEST.match(digest or ''): return None
+        row = self._conn().execute(
+            "SELECT content_type, size, width, height, thumb FROM image_blobs WHERE digest = ?", (digest,)
+        ).fetchone()
+        if row is None or not os.path.exists(self.path(digest)): return None
+        return {'digest': digest, 'path': self.path(digest), 'content_type': row[0], 'size': row[1],
+                'width': row[2], 'height': row[3], 'thumb': row[4]}
+
+    # --- ÍNDICE DE PROMPTS ---
+    def lookup(self, key):
+        if self.ttl <= 0: return None
+        row = self._conn().execute(
+            "SELECT digest FROM image_prompts WHERE key = ? AND created_at > ?", (key, time.time() - self.ttl)
+        ).fetchone()
+        blob = self.blob(row[0]) if row else None
+        if blob is None: self.misses += 1
+        else: self.hits += 1
+        return blob
+
+    def remember(self, key, digest, prompt, model, width, height):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO image_prompts (key, digest, prompt, model, width, height, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", (key, digest, prompt[:500], model, width, height, time.time())
+        )
+
+    # --- LIMPEZA ---
+    # Acima de max_total_bytes apaga as imagens mais antigas (com a miniatura e as entradas do índice)
+    def prune(self, keep=None):
+        conn = self._conn()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM image_blobs").fetchone()[0]
+        if total <= self.max_total_bytes: return 0
+        removed = 0
+        rows = conn.execute("SELECT digest, size, thumb FROM image_blobs WHERE thumb IS NOT NULL ORDER BY created_at").fetchall()
+        for digest, size, thumb in rows:
+            if total <= self.max_total_bytes: break
+            if digest == keep: continue  # a que acabou de entrar
+            shared = conn.execute("SELECT COUNT(*) FROM image_blobs WHERE thumb = ?", (thumb,)).fetchone()[0] > 1
+            for victim in ([digest] if shared else [digest, thumb]):
+                victim_size = conn.execute("SELECT size FROM image_blobs WHERE digest = ?", (victim,)).fetchone()
+                conn.execute("DELETE FROM image_blobs WHERE digest = ?", (victim,))
+                try: os.unlink(self.path(victim))
+                except FileNotFoundError: pass
+                total -= victim_size[0] if victim_size else 0
+            conn.execute("DELETE FROM image_prompts WHERE digest = ?", (digest,))
+            removed += 1
+        self.pruned += removed
+        return removed
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'ingested': self.ingested, 'pruned': self.pruned}
+
+
+def build_image_store():
+    # Sem default em /tmp: some no redeploy enquanto o image_history ainda aponta para as imagens
+    root = os.environ.get('IMAGE_STORE_DIR')
+    if not root:
+        print("AVISO: IMAGE_STORE_DIR não definido (precisa ser um volume persistente). "
+              "Imagens não serão guardadas; as URLs do Replicate expiram.")
+        return None
+    return ImageStore(
+        root,
+        db_path=os.environ.get('IMAGE_STORE_DB'),
+        max_bytes=int(os.environ.get('IMAGE_MAX_BYTES', 20 * 1024 * 1024)),
+        thumb_size=int(os.environ.get('IMAGE_THUMB_SIZE', 256)),
+        ttl=int(os.environ.get('IMAGE_DEDUPE_TTL', 7 * 86400)),
+        max_total_bytes=int(os.environ.get('IMAGE_STORE_MAX_MB', 5120)) * 1024 * 1024,
+    )
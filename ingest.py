@@ -0,0 +1,128 @@
+# ingest.py - Pipeline de ingestão de documentos: chunking -> embeddings em lote -> insert em massa
+
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Divide o texto em chunks sobrepostos, guardando de qual página cada um veio.
+# pages: iterável de strings (texto de cada página, na ordem)
+def chunk_pages(pages, chunk_size=1000, overlap=200):
+    step = max(chunk_size - overlap, 1)
+    buffer = ""
+    buffer_start = 0  # offset global (em caracteres) do início do buffer
+    page_bounds = []  # (offset_inicial, número_da_página)
+    offset = 0
+    index = 0
+
+    def page_at(pos):
+        page = page_bounds[0][1]
+        for start, number in page_bounds:
+            if start > pos: break
+            page = number
+        return page
+
+    def emit(text, start):
+        nonlocal index
+        chunk = {
+            'chunk_index': index,
+            'content': text,
+            'page_start': page_at(start),
+            'page_end': page_at(start + len(text) - 1),
+        }
+        index += 1
+        return chunk
+
+    for number, page_text in enumerate(pages, start=1):
+        page_bounds.append((offset, number))
+        page_text = (page_text or "") + "\n"
+        buffer += page_text
+        offset += len(page_text)
+        while len(buffer) >= chunk_size:
+            text = buffer[:chunk_size]
+            if text.strip(): yield emit(text, buffer_start)
+            buffer = buffer[step:]
+            buffer_start += step
+        # Páginas já totalmente consumidas não são mais necessárias para o mapeamento
+        while len(page_bounds) > 1 and page_bounds[1][0] <= buffer_start:
+            page_bounds.pop(0)
+
+    if buffer.strip() and (index == 0 or len(buffer) > overlap):
+        yield emit(buffer, buffer_start)
+
+
+def _with_retry(fn, retries=3, backoff=0.5):
+    for attempt in range(retries + 1):
+        try: return fn()
+        except Exception:
+            if attempt == retries: raise
+            time.sleep(backoff * (2 ** attempt))
+
+
+# Gera embeddings em lotes, com no máximo max_concurrency lotes em paralelo.
+# embed_batch(lista_de_textos) -> lista_de_vetores
+def embed_in_batches(texts, embed_batch, batch_size=32, max_concurrency=4, retries=3):
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    if not batches: return []
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as pool:
+        results = pool.map(lambda batch: _with_retry(lambda: embed_batch(batch), retries), batches)
+        return [vector for batch in results for vector in batch]
+
+
+# Insert multi-linha: uma requisição por lote em vez de uma por linha
+def bulk_insert(client, table, rows, batch_size=200):
+    requests = 0
+    for i in range(0, len(rows), batch_size):
+        client.table(table).insert(rows[i:i + batch_size]).execute()
+        requests += 1
+    return requests
+
+
+# Processa o documento em janelas de chunks: as páginas são consumidas sob demanda
+# (o extrator pode ser um gerador) e só uma janela de chunks/embeddings fica em memória.
+# on_rows(rows) é chamado com cada janela inserida (ex.: atualizar o índice vetorial local).
+def ingest_document(client, document_id, pages, embed_batch, chunk_size=1000, overlap=200,
+                    batch_size=32, max_concurrency=4, insert_batch_size=200, window=None, on_rows=None):
+    window = window or batch_size * max_concurrency
+    timings = {'extract_ms': 0.0, 'chunk_ms': 0.0, 'embed_ms': 0.0, 'insert_ms': 0.0}
+
+    page_count = 0
+    def timed_pages(pages):
+        nonlocal page_count
+        iterator = iter(pages)
+        while True:
+            t = time.perf_counter()
+            try: page = next(iterator)
+            except StopIteration: return
+            finally: timings['extract_ms'] += (time.perf_counter() - t) * 1000
+            page_count += 1
+            yield page
+
+    chunks_iter = chunk_pages(timed_pages(pages), chunk_size, overlap)
+    total_chunks = embed_batches = insert_requests = 0
+    while True:
+        t = time.perf_counter()
+        extract_before = timings['extract_ms']
+        chunks = list(itertools.islice(chunks_iter, window))
+        timings['chunk_ms'] += (time.perf_counter() - t) * 1000 - (timings['extract_ms'] - extract_before)
+        if not chunks: break
+
+        t = time.perf_counter()
+        embeddings = embed_in_batches([c['content'] for c in chunks], embed_batch, batch_size, max_concurrency)
+        timings['embed_ms'] += (time.perf_counter() - t) * 1000
+        embed_batches += -(-len(chunks) // batch_size)
+
+        t = time.perf_counter()
+        rows = [dict(chunk, document_id=document_id, embedding=emb) for chunk, emb in zip(chunks, embeddings)]
+        insert_requests += bulk_insert(client, 'document_chunks', rows, insert_batch_size)
+        timings['insert_ms'] += (time.perf_counter() - t) * 1000
+        total_chunks += len(rows)
+        if on_rows is not None: on_rows(rows)
+
+    return {
+        'chunks': total_chunks,
+        'pages': page_count,
+        'embed_batches': embed_batches,
+        'insert_requests': insert_requests,
+        'timings_ms': {k: round(v, 1) for k, v in timings.items()},
+    }
@@ -0,0 +1,212 @@
+# jobs.py - Fila de jobs em background (usada pela geração de imagens)
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+TERMINAL = ('succeeded', 'failed')
+
+
+class QueueFull(Exception):
+    pass
+
+
+# --- ARMAZENAMENTO DO ESTADO DOS JOBS ---
+class MemoryJobStore:
+    def __init__(self, max_jobs=5000):
+        self.max_jobs = max_jobs
+        self._jobs = {}
+        self._cond = threading.Condition()
+
+    def create(self, job):
+        with self._cond:
+            self._jobs[job['id']] = dict(job)
+            if len(self._jobs) > self.max_jobs:
+                # Descarta os jobs finalizados mais antigos
+                done = sorted((j for j in self._jobs.values() if j['status'] in TERMINAL), key=lambda j: j['updated_at'])
+                for old in done[:len(self._jobs) - self.max_jobs]:
+                    del self._jobs[old['id']]
+
+    def update(self, job_id, **fields):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None: return
+            job.update(fields, updated_at=time.time())
+            self._cond.notify_all()
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id, timeout):
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                job = self._jobs.get(job_id)
+                remaining = deadline - time.time()
+                if job is None or job['status'] in TERMINAL or remaining <= 0:
+                    return dict(job) if job else None
+                self._cond.wait(remaining)
+
+
+def _pid_alive(pid):
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except PermissionError: return True
+    return True
+
+
+class SQLiteJobStore:
+    # Compartilhado entre workers do gunicorn: qualquer worker responde GET /jobs/<id>
+    # Jobs finalizados saem depois de max_age segundos ou além dos max_jobs mais recentes.
+    def __init__(self, path, poll_interval=0.25, max_jobs=5000, max_age=86400, prune_every=100):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.max_jobs = max_jobs
+        self.max_age = max_age
+        self.prune_every = prune_every
+        self._local = threading.local()
+        self._creates = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, data TEXT, status TEXT, updated_at REAL, owner INTEGER)"
+        )
+        try: conn.execute("ALTER TABLE jobs ADD COLUMN owner INTEGER")  # banco criado antes da coluna
+        except sqlite3.OperationalError: pass
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, updated_at)")
+        self.fail_orphans()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        # Conexão herdada de um fork (gunicorn --preload) não pode ser reutilizada
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, job):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO jobs (id, data, status, updated_at, owner) VALUES (?, ?, ?, ?, ?)",
+            (job['id'], json.dumps(job), job['status'], job['updated_at'], os.getpid())
+        )
+        self._creates += 1
+        if self._creates % self.prune_every == 0:
+            try: self.prune()
+            except sqlite3.Error as e: print(f"Erro ao limpar jobs: {e}")
+
+    def prune(self):
+        conn = self._conn()
+        marks = ",".join("?" * len(TERMINAL))
+        conn.execute(f"DELETE FROM jobs WHERE status IN ({marks}) AND updated_at < ?", (*TERMINAL, time.time() - self.max_age))
+        conn.execute(
+            f"DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status IN ({marks}) "
+            f"ORDER BY updated_at DESC LIMIT -1 OFFSET ?)", (*TERMINAL, self.max_jobs)
+        )
+
+    # Jobs na fila/rodando de um processo que já morreu (restart do worker) nunca vão terminar
+    def fail_orphans(self):
+        rows = self._conn().execute(
+            "SELECT id, owner FROM jobs WHERE status NOT IN (?, ?)", TERMINAL
+        ).fetchall()
+        orphans = [job_id for job_id, owner in rows if owner != os.getpid() and not (owner and _pid_alive(owner))]
+        for job_id in orphans:
+            self.update(job_id, status='failed', error='Servidor reiniciado antes de o job terminar', finished_at=time.time())
+        if orphans: print(f"{len(orphans)} job(s) órfão(s) marcados como falhos")
+        return len(orphans)
+
+    def update(self, job_id, **fields):
+        job = self.get(job_id)
+        if job is None: return
+        job.update(fields, updated_at=time.time())
+        self._conn().execute(
+            "UPDATE jobs SET data = ?, status = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(job), job['status'], job['updated_at'], job_id)
+        )
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def wait(self, job_id, timeout):
+        deadline = time.time() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] in TERMINAL or time.time() >= deadline:
+                return job
+            time.sleep(self.poll_interval)
+
+
+# --- POOL DE EXECUÇÃO ---
+class JobQueue:
+    def __init__(self, store, max_workers=4, max_pending=50):
+        self.store = store
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    # fn(job_id) roda numa thread do pool e devolve o resultado (dict)
+    def submit(self, kind, fn, meta=None):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull("Fila de jobs cheia, tente novamente em instantes.")
+            self._pending += 1
+        job = self._new_job(kind, meta)
+        self.store.create(job)
+        self._executor.submit(self._run, job['id'], fn)
+        return job
+
+    # Job que já nasce pronto (ex.: resultado reaproveitado): quem consulta /jobs/<id> vê o mesmo formato
+    def completed(self, kind, result, meta=None):
+        job = self._new_job(kind, meta, status='succeeded', result=result)
+        job['finished_at'] = job['created_at']
+        self.store.create(job)
+        return job
+
+    def _new_job(self, kind, meta, status='queued', result=None):
+        now = time.time()
+        return {'id': uuid.uuid4().hex, 'kind': kind, 'status': status, 'result': result,
+                'error': None, 'meta': meta or {}, 'created_at': now, 'updated_at': now}
+
+    def _run(self, job_id, fn):
+        try:
+            self.store.update(job_id, status='running', started_at=time.time())
+            result = fn(job_id)
+            self.store.update(job_id, status='succeeded', result=result, finished_at=time.time())
+        except Exception as e:
+            print(f"Erro no job {job_id}: {e}")
+            self.store.update(job_id, status='failed', error=str(e), finished_at=time.time())
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def get(self, job_id, wait=0):
+        if wait > 0: return self.store.wait(job_id, wait)
+        return self.store.get(job_id)
+
+    def stats(self):
+        return {'pending': self._pending, 'max_pending': self.max_pending}
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def build_job_queue():
+    # SQLite por padrão: com vários workers, GET /jobs/<id> pode cair num worker diferente do que criou o job.
+    # JOBS_DB=memory só serve para um processo único (dev).
+    db_path = os.environ.get('JOBS_DB', '/tmp/adapta-jobs.db')
+    max_jobs = int(os.environ.get('JOBS_MAX', 5000))
+    store = MemoryJobStore(max_jobs) if db_path == 'memory' else SQLiteJobStore(
+        db_path, max_jobs=max_jobs, max_age=int(os.environ.get('JOBS_MAX_AGE', 86400)))
+    return JobQueue(
+        store,
+        max_workers=int(os.environ.get('JOB_WORKERS', 4)),
+        max_pending=int(os.environ.get('JOB_MAX_PENDING', 50)),
+    )
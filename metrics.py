@@ -0,0 +1,250 @@
+# metrics.py - Instrumentação: latência por rota e por dependência (Gemini, Supabase, Replicate, Stripe)
+# Exposto em /metrics no formato texto do Prometheus. Cada worker do gunicorn tem seu próprio registro.
+
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (nome, labels) -> Histogram
+        self._counters = {}    # (nome, labels) -> valor
+        self._gauges = {}      # nome -> (ajuda, função que devolve {labels: valor})
+        self._help = {}
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS, help_text=''):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram(buckets)
+                self._help.setdefault(name, (help_text, 'histogram'))
+            hist.observe(value)
+
+    def inc(self, name, labels, amount=1, help_text=''):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._help.setdefault(name, (help_text, 'counter'))
+
+    # fn() -> número ou dict {rótulo: número} (rótulo vira label "key")
+    def gauge(self, name, fn, help_text=''):
+        self._gauges[name] = (help_text, fn)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            help_items = dict(self._help)
+
+        seen = set()
+        def header(name, help_text, kind):
+            if name in seen: return
+            seen.add(name)
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), hist in histograms:
+            header(name, *help_items[name])
+            cumulative = 0
+            for bound, count in zip(hist.buckets, hist.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', _num(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {hist.count}")
+            lines.append(f"{name}_sum{_labels(labels)} {hist.sum:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+
+        for (name, labels), value in counters:
+            header(name, *help_items[name])
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+        for name, (help_text, fn) in sorted(self._gauges.items()):
+            try: value = fn()
+            except Exception: continue
+            header(name, help_text, 'gauge')
+            if isinstance(value, dict):
+                for key, v in sorted(value.items()):
+                    if isinstance(v, (int, float)): lines.append(f"{name}{_labels((('key', key),))} {v}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _num(value):
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+def _labels(items):
+    if not items: return ""
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in items)
+    return "{" + ",".join(escaped) + "}"
+
+
+registry = Registry()
+
+
+# --- DEPENDÊNCIAS ---
+def record_dependency(dependency, operation, seconds, error=False, payload_bytes=None):
+    labels = {'dependency': dependency, 'operation': operation}
+    registry.observe('upstream_request_duration_seconds', labels, seconds,
+                     help_text='Latência das chamadas a serviços externos')
+    if error: registry.inc('upstream_errors_total', labels, help_text='Erros das chamadas a serviços externos')
+    if payload_bytes is not None:
+        registry.observe('upstream_payload_bytes', labels, payload_bytes, SIZE_BUCKETS,
+                         help_text='Tamanho do payload enviado aos serviços externos')
+    # Acumula por requisição para o cabeçalho Server-Timing
+    if has_request_context():
+        timings = g.setdefault('dependency_timings', {})
+        timings[dependency] = timings.get(dependency, 0.0) + seconds
+
+
+@contextmanager
+def track(dependency, operation, payload_bytes=None):
+    started = time.perf_counter()
+    error = False
+    try: yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        record_dependency(dependency, operation, time.perf_counter() - started, error, payload_bytes)
+
+
+def timed(dependency, operation, fn):
+    def wrapper(*args, **kwargs):
+        with track(dependency, operation): return fn(*args, **kwargs)
+    return wrapper
+
+
+# --- SUPABASE ---
+# Proxy do client: table()/rpc() devolvem builders encadeáveis; só o execute() é cronometrado.
+class _TimedQuery:
+    def __init__(self, builder, operation):
+        self._builder = builder
+        self._operation = operation
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if not callable(attr): return attr
+        def call(*args, **kwargs):
+            if name == 'execute':
+                with track('supabase', self._operation): return attr(*args, **kwargs)
+            result = attr(*args, **kwargs)
+            return _TimedQuery(result, self._operation) if result is not None else result
+        return call
+
+    # Alguns helpers (ex.: paginação do histórico) mexem em .params diretamente
+    @property
+    def params(self):
+        return self._builder.params
+
+    @params.setter
+    def params(self, value):
+        self._builder.params = value
+
+
+class TimedSupabase:
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name):
+        return _TimedQuery(self._client.table(name), f"table:{name}")
+
+    def rpc(self, name, params=None):
+        return _TimedQuery(self._client.rpc(name, params or {}), f"rpc:{name}")
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+# --- GEMINI ---
+class TimedModel:
+    def __init__(self, model):
+        self._model = model
+
+    def generate_content(self, prompt, *args, stream=False, **kwargs):
+        size = len(str(prompt).encode('utf-8'))
+        if not stream:
+            with track('gemini', 'generate_content', size):
+                return self._model.generate_content(prompt, *args, **kwargs)
+        started = time.perf_counter()
+        try: chunks = self._model.generate_content(prompt, *args, stream=True, **kwargs)
+        except Exception:
+            record_dependency('gemini', 'generate_content_stream', time.perf_counter() - started, True, size)
+            raise
+        return self._timed_stream(chunks, started, size)
+
+    def _timed_stream(self, chunks, started, size):
+        error = False
+        try:
+            for chunk in chunks: yield chunk
+        except Exception:
+            error = True
+            raise
+        finally:
+            record_dependency('gemini', 'generate_content_stream', time.perf_counter() - started, error, size)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+# --- CONCORRÊNCIA ---
+class InFlight:
+    # Requisições em andamento neste worker e o pico desde a subida (sync: sempre 1; gthread/gevent: até threads)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+
+    def enter(self):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def leave(self):
+        with self._lock: self.current -= 1
+
+    def stats(self):
+        return {'current': self.current, 'peak': self.peak}
+
+
+# --- ROTAS ---
+def record_route(route, method, status, seconds, request_bytes, response_bytes):
+    labels = {'route': route, 'method': method}
+    registry.observe('http_request_duration_seconds', labels, seconds, help_text='Latência por rota')
+    registry.inc('http_requests_total', dict(labels, status=str(status)), help_text='Requisições por rota e status')
+    if status >= 500: registry.inc('http_errors_total', labels, help_text='Respostas 5xx por rota')
+    if request_bytes: registry.observe('http_request_bytes', labels, request_bytes, SIZE_BUCKETS,
+                                       help_text='Tamanho do corpo da requisição')
+    if response_bytes: registry.observe('http_response_bytes', labels, response_bytes, SIZE_BUCKETS,
+                                        help_text='Tamanho do corpo da resposta')
+
+
+def server_timing_header(total_seconds):
+    parts = [f"{dep};dur={seconds * 1000:.1f}" for dep, seconds in sorted(g.get('dependency_timings', {}).items())]
+    parts.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(parts)
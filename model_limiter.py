@@ -0,0 +1,277 @@
+# model_limiter.py - Controle de vazão das chamadas ao Gemini (por modelo)
+# Token bucket (requisições/segundo) + limite de concorrência adaptativo (AIMD: sobe devagar a cada
+# sucesso, cai pela metade a cada 429/503), fila por prioridade (ferramentas interativas passam na
+# frente das em lote), prazo por requisição e novas tentativas com backoff exponencial + jitter
+# respeitando o tempo sugerido pela API. O tempo de fila é medido separado do tempo de geração.
+
+import heapq
+import itertools
+import os
+import random
+import re
+import threading
+import time
+
+from flask import g, has_request_context
+
+import metrics
+
+INTERACTIVE, NORMAL, BULK = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', NORMAL: 'normal', BULK: 'bulk'}
+
+_RETRY_IN = re.compile(r'retry in ([\d.]+)\s*s', re.I)
+_RETRY_DELAY = re.compile(r'retry_delay\s*\{\s*seconds:\s*(\d+)', re.I)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class ModelOverloaded(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# As rotas transformam qualquer exceção em 500; a marca em g deixa o app responder 503/504 + Retry-After
+def _unavailable(error):
+    if has_request_context(): g.model_unavailable = error
+    return error
+
+
+def _status(error):
+    code = getattr(error, 'code', None)
+    if callable(code): code = None  # grpc: code() é um método
+    if isinstance(code, int): return code
+    name = type(error).__name__
+    return {'ResourceExhausted': 429, 'TooManyRequests': 429, 'ServiceUnavailable': 503,
+            'InternalServerError': 500, 'DeadlineExceeded': 504, 'GatewayTimeout': 504}.get(name)
+
+
+# Tempo sugerido pela API (Retry-After / "Please retry in 12.3s" / retry_delay { seconds: N })
+def retry_hint(error):
+    hint = getattr(error, 'retry_after', None)
+    if isinstance(hint, (int, float)): return float(hint)
+    text = str(error)
+    match = _RETRY_IN.search(text) or _RETRY_DELAY.search(text)
+    return float(match.group(1)) if match else None
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Reserva um token e devolve quanto esperar por ele (o saldo pode ficar negativo: fila no tempo)
+    def reserve(self):
+        if self.rate <= 0: return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    # Devolve um token reservado e não usado (ex.: prazo estourou antes da vez chegar)
+    def refund(self):
+        with self._lock: self.tokens = min(self.burst, self.tokens + 1)
+
+
+class AIMDLimit:
+    def __init__(self, initial, minimum, maximum, backoff=0.5, cooldown=1.0):
+        self.value = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self._last_decrease = 0.0
+
+    def on_success(self):
+        self.value = min(self.maximum, self.value + 1.0 / self.value)  # ~ +1 por "janela" cheia
+
+    def on_overload(self):
+        now = time.monotonic()
+        # Várias falhas da mesma rajada contam como uma só redução
+        if now - self._last_decrease < self.cooldown: return
+        self._last_decrease = now
+        self.value = max(self.minimum, self.value * self.backoff)
+
+    @property
+    def limit(self):
+        return max(self.minimum, int(self.value))
+
+
+class ModelLimiter:
+    def __init__(self, name, rate=10.0, burst=20, initial=8, min_concurrency=1, max_concurrency=32,
+                 max_queue=500, max_retries=4, backoff_base=0.5, backoff_cap=20.0):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AIMDLimit(initial, min_concurrency, max_concurrency)
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._cond = threading.Condition()
+        self._waiting = []  # heap de (prioridade, ordem de chegada)
+        self._seq = itertools.count()
+        self._inflight = 0
+        self.retries = 0
+        self.overloads = 0
+        self.rejected = 0
+
+    # --- ADMISSÃO ---
+    def _acquire(self, priority, deadline):
+        started = time.monotonic()
+        entry = (priority, next(self._seq))
+        if deadline is not None and started >= deadline:
+            raise _unavailable(DeadlineExceeded(f"Prazo esgotado antes da chamada ao modelo {self.name}"))
+        with self._cond:
+            if len(self._waiting) >= self.max_queue:
+                self.rejected += 1
+                raise _unavailable(ModelOverloaded(f"Fila do modelo {self.name} cheia", retry_after=1))
+            heapq.heappush(self._waiting, entry)
+            try:
+                while not (self._waiting[0] == entry and self._inflight < self.concurrency.limit):
+                    timeout = 1.0 if deadline is None else min(1.0, deadline - time.monotonic())
+                    if timeout <= 0: raise _unavailable(DeadlineExceeded(f"Prazo esgotado na fila do modelo {self.name}"))
+                    self._cond.wait(timeout)
+            except BaseException:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self._inflight += 1
+            self._cond.notify_all()
+
+        delay = self.bucket.reserve()
+        if deadline is not None and time.monotonic() + delay > deadline:
+            self.bucket.refund()
+            self._release()
+            raise _unavailable(DeadlineExceeded(f"Prazo esgotado aguardando a cota do modelo {self.name}"))
+        if delay: time.sleep(delay)
+        return time.monotonic() - started
+
+    def _release(self):
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    def _backoff(self, attempt, hint):
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))  # full jitter
+        return max(delay, hint) if hint else delay
+
+    def _record_wait(self, seconds, priority):
+        metrics.registry.observe('model_queue_wait_seconds', {'model': self.name, 'priority': PRIORITY_NAMES.get(priority, str(priority))},
+                                 seconds, help_text='Espera na fila do limitador antes da chamada ao modelo')
+        if has_request_context():
+            timings = g.setdefault('dependency_timings', {})
+            timings['gemini-queue'] = timings.get('gemini-queue', 0.0) + seconds
+
+    # --- EXECUÇÃO ---
+    # fn() faz a chamada. Com stream=True, fn devolve um iterável e a vaga só é liberada no fim dele.
+    def run(self, fn, priority=NORMAL, deadline=None, stream=False):
+        attempt = 0
+        while True:
+            self._record_wait(self._acquire(priority, deadline), priority)
+            try: result = fn()
+            except Exception as e:
+                self._release()
+                status = _status(e)
+                if status not in (429, 500, 503, 504): raise
+                if status in (429, 503):
+                    self.overloads += 1
+                    with self._cond: self.concurrency.on_overload()
+                hint = retry_hint(e)
+                delay = self._backoff(attempt, hint)
+                out_of_time = deadline is not None and time.monotonic() + delay >= deadline
+                if attempt >= self.max_retries or out_of_time:
+                    if status in (429, 503):
+                        raise _unavailable(ModelOverloaded(f"Modelo {self.name} sobrecarregado: {e}", retry_after=hint or delay)) from e
+                    raise
+                attempt += 1
+                self.retries += 1
+                metrics.registry.inc('model_retries_total', {'model': self.name, 'status': str(status)},
+                                     help_text='Novas tentativas de chamadas ao modelo')
+                time.sleep(delay)
+                continue
+            if stream: return self._stream(result)
+            self._succeeded()
+            return result
+
+    def _stream(self, chunks):
+        ok = False
+        try:
+            for chunk in chunks: yield chunk
+            ok = True
+        finally:
+            if ok: self._succeeded()
+            else: self._release()
+
+    def _succeeded(self):
+        with self._cond:
+            self.concurrency.on_success()
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {'limit': self.concurrency.limit, 'inflight': self._inflight, 'queued': len(self._waiting),
+                    'retries': self.retries, 'overloads': self.overloads, 'rejected': self.rejected}
+
+
+class LimitedModel:
+    # Mesmo generate_content do modelo; prioridade e prazo vêm da requisição atual (g) quando existem
+    def __init__(self, model, limiter):
+        self._model = model
+        self._limiter = limiter
+
+    def generate_content(self, prompt, *args, stream=False, priority=None, deadline=None, **kwargs):
+        priority, deadline = request_budget(priority, deadline)
+        call = lambda: self._model.generate_content(prompt, *args, stream=stream, **kwargs)
+        return self._limiter.run(call, priority, deadline, stream=stream)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+# Sem contexto de requisição (threads do summarizer, jobs) a chamada é tratada como lote e sem prazo
+def request_budget(priority=None, deadline=None):
+    if has_request_context():
+        if priority is None: priority = g.get('model_priority', NORMAL)
+        if deadline is None: deadline = g.get('model_deadline')
+    return (BULK if priority is None else priority), deadline
+
+
+class LimiterRegistry:
+    def __init__(self, factory):
+        self._factory = factory
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get(self, model):
+        with self._lock:
+            if model not in self._limiters: self._limiters[model] = self._factory(model)
+            return self._limiters[model]
+
+    def stats(self):
+        with self._lock: limiters = dict(self._limiters)
+        return {f"{name}:{key}": value for name, limiter in limiters.items() for key, value in limiter.stats().items()}
+
+
+def build_limiters():
+    def factory(model):
+        return ModelLimiter(
+            model,
+            rate=float(os.environ.get('GEMINI_RPS', 10)),
+            burst=int(os.environ.get('GEMINI_BURST', 20)),
+            initial=int(os.environ.get('GEMINI_INITIAL_CONCURRENCY', 8)),
+            min_concurrency=int(os.environ.get('GEMINI_MIN_CONCURRENCY', 1)),
+            max_concurrency=int(os.environ.get('GEMINI_MAX_CONCURRENCY', 32)),
+            max_queue=int(os.environ.get('GEMINI_MAX_QUEUE', 500)),
+            max_retries=int(os.environ.get('GEMINI_MAX_RETRIES', 4)),
+        )
+    return LimiterRegistry(factory)
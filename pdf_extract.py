@@ -0,0 +1,105 @@
+# pdf_extract.py - Extração de texto de PDF página a página, com memória limitada
+# O upload vai para um arquivo temporário; as páginas saem de um gerador.
+# PDFs grandes são extraídos em paralelo (pool de processos) por faixas de páginas.
+
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+
+class PdfTooLarge(Exception):
+    pass
+
+
+def spool_upload(file, max_bytes, chunk_size=1024 * 1024):
+    # Copia o upload para disco em blocos, abortando se passar de max_bytes
+    fd, path = tempfile.mkstemp(suffix='.pdf', prefix='upload-')
+    written = 0
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            stream = getattr(file, 'stream', file)
+            while True:
+                block = stream.read(chunk_size)
+                if not block: break
+                written += len(block)
+                if written > max_bytes:
+                    raise PdfTooLarge(f"Arquivo maior que o limite de {max_bytes // (1024 * 1024)} MB")
+                out.write(block)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def _extract_range(path, start, end):
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    return [(reader.pages[i].extract_text() or "") for i in range(start, end)]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(processes):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: o worker do gunicorn tem threads, e fork com threads não é seguro
+            _pool = ProcessPoolExecutor(max_workers=processes, mp_context=get_context('spawn'))
+        return _pool
+
+
+class PdfExtractor:
+    def __init__(self, max_bytes=50 * 1024 * 1024, max_pages=500, parallel_threshold=40,
+                 pages_per_task=20, processes=2):
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+        self.parallel_threshold = parallel_threshold
+        self.pages_per_task = pages_per_task
+        self.processes = processes
+
+    def page_count(self, path):
+        from pypdf import PdfReader
+        return len(PdfReader(path).pages)
+
+    # Gera o texto de cada página, em ordem; nunca guarda o documento inteiro em memória
+    def iter_pages(self, path, total_pages):
+        total = min(total_pages, self.max_pages)
+        if total < self.parallel_threshold or self.processes <= 1:
+            from pypdf import PdfReader
+            reader = PdfReader(path)
+            for i in range(total):
+                yield reader.pages[i].extract_text() or ""
+            return
+
+        ranges = [(s, min(s + self.pages_per_task, total)) for s in range(0, total, self.pages_per_task)]
+        pool = _get_pool(self.processes)
+        # Mantém no máximo 2 faixas por processo em andamento (memória limitada)
+        window = self.processes * 2
+        futures = [pool.submit(_extract_range, path, s, e) for s, e in ranges[:window]]
+        next_range = window
+        while futures:
+            pages = futures.pop(0).result()
+            if next_range < len(ranges):
+                s, e = ranges[next_range]
+                futures.append(pool.submit(_extract_range, path, s, e))
+                next_range += 1
+            yield from pages
+
+    @staticmethod
+    def cleanup(path):
+        try: os.remove(path)
+        except OSError: pass
+
+
+def build_pdf_extractor():
+    return PdfExtractor(
+        max_bytes=int(os.environ.get('PDF_MAX_BYTES', 50 * 1024 * 1024)),
+        max_pages=int(os.environ.get('PDF_MAX_PAGES', 500)),
+        parallel_threshold=int(os.environ.get('PDF_PARALLEL_THRESHOLD', 40)),
+        pages_per_task=int(os.environ.get('PDF_PAGES_PER_TASK', 20)),
+        processes=int(os.environ.get('PDF_EXTRACT_PROCESSES', 2)),
+    )
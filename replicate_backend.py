@@ -0,0 +1,63 @@
+# replicate_backend.py - Execução de predições no Replicate (real ou fake local)
+
+import itertools
+import os
+import random
+import time
+
+SDXL_VERSION = "39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b"
+
+
+class ReplicateBackend:
+    # Cria a predição e acompanha por polling, sem segurar o worker HTTP
+    def __init__(self, poll_interval=1.0, timeout=300):
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def run(self, version, inputs, on_update=None):
+        from http_pool import replicate_client
+        prediction = replicate_client().predictions.create(version=version, input=inputs)
+        if on_update: on_update(prediction.id, prediction.status)
+        deadline = time.time() + self.timeout
+        while prediction.status not in ('succeeded', 'failed', 'canceled'):
+            if time.time() > deadline:
+                try: prediction.cancel()
+                except Exception: pass
+                raise TimeoutError(f"Predição {prediction.id} excedeu {self.timeout}s")
+            time.sleep(self.poll_interval)
+            prediction.reload()
+            if on_update: on_update(prediction.id, prediction.status)
+        if prediction.status != 'succeeded':
+            raise RuntimeError(prediction.error or f"Predição {prediction.status}")
+        return prediction.output
+
+
+class FakeReplicateBackend:
+    # Backend local para testes offline: latência e taxa de erro configuráveis
+    def __init__(self, latency=2.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._ids = itertools.count(1)
+
+    def run(self, version, inputs, on_update=None):
+        prediction_id = f"fake-{next(self._ids)}"
+        if on_update: on_update(prediction_id, 'starting')
+        time.sleep(self.latency / 2)
+        if on_update: on_update(prediction_id, 'processing')
+        time.sleep(self.latency / 2)
+        if random.random() < self.error_rate:
+            raise RuntimeError("Falha simulada do Replicate")
+        width, height = inputs.get('width', 1024), inputs.get('height', 1024)
+        return [f"https://placehold.co/{width}x{height}/png?text={prediction_id}"]
+
+
+def get_replicate_backend():
+    if os.environ.get('REPLICATE_BACKEND', '').lower() == 'fake':
+        return FakeReplicateBackend(
+            latency=float(os.environ.get('FAKE_REPLICATE_LATENCY', 2.0)),
+            error_rate=float(os.environ.get('FAKE_REPLICATE_ERROR_RATE', 0.0)),
+        )
+    return ReplicateBackend(
+        poll_interval=float(os.environ.get('REPLICATE_POLL_INTERVAL', 1.0)),
+        timeout=float(os.environ.get('REPLICATE_TIMEOUT', 300)),
+    )
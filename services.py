@@ -0,0 +1,95 @@
+# services.py - Registro preguiçoso de clients externos (Gemini, Supabase, Stripe...)
+# Cada serviço só é importado e construído no primeiro uso, dentro do worker que precisa dele.
+
+import importlib
+import os
+import threading
+import time
+
+_UNSET = object()
+
+
+class ServiceRegistry:
+    # retry_after: segundos até tentar de novo uma factory que levantou exceção (a falha não fica em cache)
+    def __init__(self, retry_after=30):
+        self._factories = {}  # nome -> (factory, módulos pesados)
+        self._instances = {}
+        self._pids = {}
+        self._failures = {}  # nome -> (pid, instante da falha)
+        self.retry_after = retry_after
+        self._lock = threading.RLock()
+
+    def register(self, name, factory, imports=()):
+        self._factories[name] = (factory, tuple(imports))
+
+    def get(self, name):
+        instance = self._instances.get(name, _UNSET)
+        # Clients criados antes de um fork (gunicorn --preload) não são reaproveitados no worker
+        if instance is not _UNSET and self._pids.get(name) == os.getpid(): return instance
+        with self._lock:
+            instance = self._instances.get(name, _UNSET)
+            if instance is not _UNSET and self._pids.get(name) == os.getpid(): return instance
+            failure = self._failures.get(name)
+            if failure and failure[0] == os.getpid() and time.monotonic() - failure[1] < self.retry_after: return None
+            factory, _ = self._factories[name]
+            try: instance = factory()
+            except Exception as e:
+                print(f"Erro ao iniciar serviço {name}: {e}")
+                self._failures[name] = (os.getpid(), time.monotonic())
+                return None
+            self._failures.pop(name, None)
+            self._instances[name] = instance
+            self._pids[name] = os.getpid()
+            return instance
+
+    def lazy(self, name):
+        return LazyService(self, name)
+
+    # Só importa os módulos (seguro antes do fork, com preload_app)
+    def preload_imports(self, names=None):
+        for name in names or self._factories:
+            for module in self._factories[name][1]:
+                try: importlib.import_module(module)
+                except ImportError as e: print(f"Não foi possível pré-carregar {module}: {e}")
+
+    # Importa e constrói tudo (no worker, depois do fork)
+    def warm_up(self, names=None):
+        for name in names or self._factories: self.get(name)
+
+    def reset(self, name=None):
+        with self._lock:
+            if name is None:
+                self._instances.clear()
+                self._failures.clear()
+            else:
+                self._instances.pop(name, None)
+                self._failures.pop(name, None)
+
+
+class LazyService:
+    # Proxy: qualquer acesso a atributo resolve o serviço; bool() diz se ele está configurado
+    __slots__ = ('_registry', '_name')
+
+    def __init__(self, registry, name):
+        object.__setattr__(self, '_registry', registry)
+        object.__setattr__(self, '_name', name)
+
+    def _resolve(self):
+        return self._registry.get(self._name)
+
+    def __getattr__(self, attr):
+        instance = self._resolve()
+        if instance is None: raise AttributeError(f"Serviço '{self._name}' não configurado")
+        return getattr(instance, attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._resolve(), attr, value)
+
+    def __bool__(self):
+        return self._resolve() is not None
+
+    def __repr__(self):
+        return f"<LazyService {self._name}>"
+
+
+registry = ServiceRegistry()
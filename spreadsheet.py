@@ -0,0 +1,248 @@
+# spreadsheet.py - Planilhas geradas pelo modelo, escritas em streaming
+# O modelo devolve abas em CSV ("=== Nome da aba" + cabeçalho + linhas); as linhas são lidas
+# conforme chegam e vão direto para um xlsx write-only (openpyxl) ou para CSV.
+# Tabelas grandes são pedidas em páginas; a memória não cresce com o número de linhas.
+
+import csv
+import json
+import re
+import tempfile
+import zipfile
+
+_SHEET = re.compile(r'^\s*===\s*(.+?)\s*=*\s*$')
+_INT = re.compile(r'^-?\d{1,15}$')
+_FLOAT = re.compile(r'^-?\d+\.\d+$')
+_JSON_START = re.compile(r'^\s*(```(json)?\s*)?\{')
+_BAD_TITLE = re.compile(r'[\[\]:*?/\\]')
+_FUNCTION = re.compile(r'([A-ZÁÉÍÓÚÂÊÔÃÕÇ][A-ZÁÉÍÓÚÂÊÔÃÕÇ.]*)\(')
+# O xlsx guarda fórmulas com nomes em inglês; o Excel/LibreOffice traduzem só na exibição
+_PT_FUNCTIONS = {
+    'SOMA': 'SUM', 'MÉDIA': 'AVERAGE', 'MEDIA': 'AVERAGE', 'SE': 'IF', 'SOMASE': 'SUMIF', 'CONT.SE': 'COUNTIF',
+    'CONT.VALORES': 'COUNTA', 'CONT.NÚM': 'COUNT', 'MÁXIMO': 'MAX', 'MAXIMO': 'MAX', 'MÍNIMO': 'MIN',
+    'MINIMO': 'MIN', 'PROCV': 'VLOOKUP', 'ARRED': 'ROUND', 'HOJE': 'TODAY', 'CONCATENAR': 'CONCATENATE',
+}
+
+
+def build_prompt(description, rows, sheets):
+    return f"""
+    Crie os dados de uma planilha para: "{description}"
+    Use no máximo {sheets} aba(s). Para cada aba escreva uma linha "=== Nome da aba",
+    depois o cabeçalho e {rows} linha(s) de dados, em CSV (vírgula como separador,
+    aspas duplas quando o valor tiver vírgula). Números sem separador de milhar, ponto como decimal.
+    Fórmulas são permitidas com nomes de função em inglês e vírgula entre argumentos, entre aspas
+    duplas no CSV (ex.: "=SUM(B2:B10)", "=AVERAGE(C2:C10)"). Responda só com o CSV, sem explicações.
+    """
+
+
+def continue_prompt(description, sheet, header, start, count):
+    columns = ",".join(map(str, header))
+    return f"""
+    Planilha para: "{description}". Continue a aba "{sheet}" com as colunas: {columns}
+    Gere as linhas {start} a {start + count - 1} (não repita as anteriores), em CSV,
+    sem cabeçalho e sem a linha "===". Responda só com o CSV.
+    """
+
+
+def _coerce(value):
+    value = value.strip()
+    if _INT.match(value): return int(value)
+    if _FLOAT.match(value): return float(value)
+    return value
+
+
+# Fórmula escrita em português (=SOMA(B2;B3)) -> =SUM(B2,B3); texto entre aspas fica como está
+def excel_formula(value):
+    if not isinstance(value, str) or not value.startswith('='): return value
+    parts = value.split('"')
+    for i in range(0, len(parts), 2):
+        parts[i] = _FUNCTION.sub(lambda m: _PT_FUNCTIONS.get(m.group(1), m.group(1)) + '(', parts[i].replace(';', ','))
+    return '"'.join(parts)
+
+
+# Lê o texto do modelo pedaço a pedaço e gera ('sheet', nome) / ('row', valores) por linha completa
+def iter_events(chunks):
+    buffer = ""
+
+    def parse(line):
+        if not line.strip() or line.strip().startswith('```'): return None
+        match = _SHEET.match(line)
+        if match: return ('sheet', match.group(1).strip('"* '))
+        return ('row', [_coerce(v) for v in next(csv.reader([line]))])
+
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split('\n')
+        for line in lines:
+            event = parse(line)
+            if event: yield event
+    event = parse(buffer)
+    if event: yield event
+
+
+# Resposta em JSON ({"sheets": [{"name", "columns", "rows"}]}) em vez de CSV
+def iter_json_events(text):
+    text = text.replace("```json", "").replace("```", "").strip()
+    data = json.loads(text[text.find("{"):text.rfind("}") + 1])
+    for sheet in data.get('sheets', []):
+        yield ('sheet', str(sheet.get('name') or 'Planilha'))
+        if sheet.get('columns'): yield ('row', list(sheet['columns']))
+        for row in sheet.get('rows', []): yield ('row', list(row))
+
+
+def _title(name, used):
+    title = _BAD_TITLE.sub(' ', name).strip()[:31] or 'Planilha'
+    base, n = title, 2
+    while title.lower() in used:
+        suffix = f" ({n})"
+        title = base[:31 - len(suffix)] + suffix
+        n += 1
+    used.add(title.lower())
+    return title
+
+
+class XlsxSink:
+    extension = 'xlsx'
+    mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    def __init__(self):
+        from openpyxl import Workbook
+        self.workbook = Workbook(write_only=True)
+        self.sheets = {}
+        self._used = set()
+
+    def start_sheet(self, name, header):
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
+        sheet = self.workbook.create_sheet(_title(name, self._used))
+        bold = Font(bold=True)
+        cells = []
+        for value in header:
+            cell = WriteOnlyCell(sheet, value=value)
+            cell.font = bold
+            cells.append(cell)
+        sheet.append(cells)
+        self.sheets[name] = sheet
+
+    def append(self, name, row):
+        self.sheets[name].append([excel_formula(v) for v in row])
+
+    def finish(self, spool_bytes):
+        if not self.sheets: self.workbook.create_sheet('Planilha')
+        f = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+        self.workbook.save(f)
+        f.seek(0)
+        return f
+
+
+class CsvSink:
+    # Uma aba: .csv; várias: .zip com um .csv por aba
+    mimetype = 'text/csv'
+    extension = 'csv'
+
+    def __init__(self, spool_bytes=8 * 1024 * 1024):
+        self.spool_bytes = spool_bytes
+        self.files = {}
+        self.writers = {}
+        self._used = set()
+
+    def start_sheet(self, name, header):
+        f = tempfile.SpooledTemporaryFile(max_size=self.spool_bytes, mode='w+', newline='', encoding='utf-8')
+        self.files[name] = (_title(name, self._used), f)
+        self.writers[name] = csv.writer(f)
+        self.writers[name].writerow(header)
+
+    def append(self, name, row):
+        self.writers[name].writerow(row)
+
+    def finish(self, spool_bytes):
+        out = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+        if len(self.files) <= 1:
+            self.mimetype, self.extension = 'text/csv', 'csv'
+            out.write(b'\xef\xbb\xbf')  # BOM: o Excel abre o UTF-8 corretamente
+            for _, f in self.files.values():
+                f.seek(0)
+                for block in iter(lambda: f.read(64 * 1024), ''): out.write(block.encode('utf-8'))
+        else:
+            self.mimetype, self.extension = 'application/zip', 'zip'
+            with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as z:
+                for title, f in self.files.values():
+                    f.seek(0)
+                    with z.open(f"{title}.csv", 'w') as entry:
+                        entry.write(b'\xef\xbb\xbf')
+                        for block in iter(lambda: f.read(64 * 1024), ''): entry.write(block.encode('utf-8'))
+        for _, f in self.files.values(): f.close()
+        out.seek(0)
+        return out
+
+
+class SpreadsheetBuilder:
+    # generate(prompt) -> iterável de pedaços de texto (ex.: stream_text)
+    def __init__(self, generate, max_rows=5000, rows_per_call=200, max_sheets=5, spool_bytes=8 * 1024 * 1024):
+        self.generate = generate
+        self.max_rows = max_rows
+        self.rows_per_call = rows_per_call
+        self.max_sheets = max_sheets
+        self.spool_bytes = spool_bytes
+
+    def _events(self, prompt):
+        chunks = iter(self.generate(prompt))
+        first = ""
+        for chunk in chunks:
+            first += chunk
+            if len(first.strip()) >= 16: break
+        # JSON só pode ser lido inteiro; CSV é lido conforme chega
+        if _JSON_START.match(first):
+            yield from iter_json_events(first + "".join(chunks))
+        else:
+            yield from iter_events(_chain(first, chunks))
+
+    def build(self, description, rows=20, sheets=1, fmt='xlsx'):
+        rows = max(1, min(int(rows), self.max_rows))
+        sheets = max(1, min(int(sheets), self.max_sheets))
+        sink = CsvSink(self.spool_bytes) if fmt == 'csv' else XlsxSink()
+        first_page = min(rows, self.rows_per_call)
+        counts, headers, order = {}, {}, []
+        current = None
+
+        for kind, value in self._events(build_prompt(description, first_page, sheets)):
+            if kind == 'sheet':
+                if len(order) >= sheets: break
+                current = value
+                if current in counts: continue
+                counts[current] = 0
+                order.append(current)
+            elif current is None:
+                current = 'Planilha'
+                counts[current] = 0
+                order.append(current)
+                headers[current] = value
+                sink.start_sheet(current, value)
+            elif current not in headers:
+                headers[current] = value
+                sink.start_sheet(current, value)
+            elif counts[current] < rows:
+                sink.append(current, value)
+                counts[current] += 1
+
+        # Páginas seguintes, uma aba por vez, até o total pedido (ou até o modelo parar de gerar)
+        for name in order:
+            if name not in headers: continue
+            while counts[name] < rows:
+                count = min(self.rows_per_call, rows - counts[name])
+                prompt = continue_prompt(description, name, headers[name], counts[name] + 1, count)
+                added = 0
+                for kind, value in iter_events(self.generate(prompt)):
+                    if kind != 'row' or added >= count: continue
+                    if value == headers[name]: continue
+                    sink.append(name, value)
+                    added += 1
+                counts[name] += added
+                if added == 0: break
+
+        f = sink.finish(self.spool_bytes)
+        return f, sink, {title: counts[title] for title in order if title in headers}
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
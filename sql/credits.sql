@@ -0,0 +1,76 @@
+-- credits.sql - Ledger de créditos atômico (rodar no SQL editor do Supabase)
+--
+-- consume_credits: debita p_amount créditos numa única instrução, só se houver saldo.
+-- Usuários VIP (is_pro) não são debitados. Retorna uma linha:
+--   ok       -> true se a operação foi autorizada
+--   charged  -> créditos efetivamente debitados (0 para VIP ou recusa)
+--   credits  -> saldo após a operação (null se o usuário não existe)
+--   is_pro   -> flag VIP (null se o usuário não existe)
+
+create or replace function consume_credits(p_user_id uuid, p_amount int default 1)
+returns table (ok boolean, charged int, credits int, is_pro boolean)
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+  v_credits int;
+  v_is_pro boolean;
+begin
+  -- Valor negativo viraria crédito de graça
+  if p_amount is null or p_amount <= 0 then
+    raise exception 'p_amount deve ser positivo' using errcode = '22023';
+  end if;
+
+  update profiles p
+     set credits = p.credits - p_amount
+   where p.id = p_user_id
+     and not coalesce(p.is_pro, false)
+     and p.credits >= p_amount
+  returning p.credits, coalesce(p.is_pro, false) into v_credits, v_is_pro;
+
+  if found then
+    return query select true, p_amount, v_credits, v_is_pro;
+    return;
+  end if;
+
+  select p.credits, coalesce(p.is_pro, false) into v_credits, v_is_pro
+    from profiles p where p.id = p_user_id;
+
+  if not found then
+    return query select false, 0, null::int, null::boolean;
+    return;
+  end if;
+
+  -- VIP passa sem debitar; os demais estão sem saldo
+  return query select v_is_pro, 0, v_credits, v_is_pro;
+end;
+$$;
+
+-- refund_credits: devolve créditos quando a chamada ao modelo falha depois da cobrança
+create or replace function refund_credits(p_user_id uuid, p_amount int default 1)
+returns int
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+  v_credits int;
+begin
+  if p_amount is null or p_amount <= 0 then
+    raise exception 'p_amount deve ser positivo' using errcode = '22023';
+  end if;
+
+  update profiles set credits = credits + p_amount
+   where id = p_user_id and not coalesce(is_pro, false)
+  returning credits into v_credits;
+  return v_credits;
+end;
+$$;
+
+-- As duas funções são security definer: só o backend (service_role) pode chamá-las.
+-- Sem isso o PostgREST as expõe para a chave anon do frontend (créditos de graça / débito de terceiros).
+revoke execute on function consume_credits(uuid, int) from public, anon, authenticated;
+revoke execute on function refund_credits(uuid, int) from public, anon, authenticated;
+grant execute on function consume_credits(uuid, int) to service_role;
+grant execute on function refund_credits(uuid, int) to service_role;
@@ -0,0 +1,9 @@
+-- document_chunks.sql - Colunas usadas pelo pipeline de ingestão (ingest.py)
+-- Cada chunk guarda sua posição no documento e o intervalo de páginas de onde veio.
+
+alter table document_chunks add column if not exists chunk_index int;
+alter table document_chunks add column if not exists page_start int;
+alter table document_chunks add column if not exists page_end int;
+
+create index if not exists document_chunks_document_id_idx
+  on document_chunks (document_id, chunk_index);
@@ -0,0 +1,12 @@
+-- user_history.sql - Suporte à paginação por cursor do /get-history
+
+-- Índice para "where user_id = ? [and tool_type = ?] order by created_at desc, id desc limit N"
+create index if not exists user_history_user_created_idx
+  on user_history (user_id, created_at desc, id desc);
+
+create index if not exists user_history_user_tool_created_idx
+  on user_history (user_id, tool_type, created_at desc, id desc);
+
+-- Prévia curta usada pelo modo lista (?mode=list), para não trafegar o output_data inteiro
+alter table user_history
+  add column if not exists preview text generated always as (left(output_data, 160)) stored;
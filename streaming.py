@@ -0,0 +1,37 @@
+# streaming.py - Modo streaming (Server-Sent Events) para as rotas de texto
+
+import json
+from flask import Response, request, stream_with_context
+
+
+def wants_stream():
+    # Opt-in: ?stream=1 ou Accept: text/event-stream
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'): return True
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+
+def sse_event(data, event=None):
+    payload = json.dumps(data, ensure_ascii=False)
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {payload}\n\n"
+
+
+# Repassa cada pedaço como evento 'chunk' e termina com um evento 'done'
+# contendo o mesmo JSON que a rota devolveria sem streaming.
+# watch(pedaço) -> [(evento, dados)] permite emitir eventos extras no meio (ex.: campos JSON prontos).
+def sse_response(chunks, finalize, on_error=None, watch=None):
+    def generate():
+        parts = []
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield sse_event({'text': chunk}, 'chunk')
+                if watch:
+                    for event, data in watch(chunk): yield sse_event(data, event)
+            yield sse_event(finalize("".join(parts)), 'done')
+        except Exception as e:
+            if on_error: on_error(e)
+            yield sse_event({'error': str(e)}, 'error')
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
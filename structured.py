@@ -0,0 +1,213 @@
+# structured.py - Saída JSON estruturada para as ferramentas que respondem em JSON
+# Cada ferramenta tem um schema; o prompt pede exatamente esse formato (e o modo JSON do SDK,
+# quando a versão instalada suporta). A saída em streaming é lida caractere a caractere:
+# cada campo de primeiro nível (e cada item das listas de primeiro nível) é emitido assim que fecha.
+# Se o JSON final não for válido, o que já tinha fechado é mantido.
+
+import json
+
+_INVALID = object()
+
+SCHEMAS = {
+    'social-media': {
+        'type': 'object',
+        'properties': {
+            'instagram': {'type': 'string', 'description': 'post para o Instagram, com hashtags'},
+            'linkedin': {'type': 'string', 'description': 'post para o LinkedIn'},
+            'twitter': {'type': 'string', 'description': 'tweet de até 280 caracteres'},
+        },
+        'required': ['instagram', 'linkedin', 'twitter'],
+    },
+    'essay': {
+        'type': 'object',
+        'properties': {
+            'nota': {'type': 'number', 'description': 'nota de 0 a 1000'},
+            'erros': {'type': 'array', 'items': {
+                'type': 'object',
+                'properties': {'trecho': {'type': 'string'}, 'correcao': {'type': 'string'},
+                               'explicacao': {'type': 'string'}},
+                'required': ['trecho', 'correcao', 'explicacao'],
+            }},
+            'comentario': {'type': 'string', 'description': 'comentário geral sobre a redação'},
+        },
+        'required': ['nota', 'erros', 'comentario'],
+    },
+    'interview': {
+        'type': 'object',
+        'properties': {
+            'introducao': {'type': 'string'},
+            'perguntas': {'type': 'array', 'items': {
+                'type': 'object',
+                'properties': {'pergunta': {'type': 'string'}, 'dica': {'type': 'string'}},
+                'required': ['pergunta', 'dica'],
+            }},
+        },
+        'required': ['introducao', 'perguntas'],
+    },
+    'study-material': {
+        'type': 'object',
+        'properties': {
+            'titulo': {'type': 'string'},
+            'resumo': {'type': 'string'},
+            'topicos': {'type': 'array', 'items': {
+                'type': 'object',
+                'properties': {'titulo': {'type': 'string'}, 'conteudo': {'type': 'string'}},
+                'required': ['titulo', 'conteudo'],
+            }},
+            'perguntas': {'type': 'array', 'items': {
+                'type': 'object',
+                'properties': {'pergunta': {'type': 'string'}, 'resposta': {'type': 'string'}},
+                'required': ['pergunta', 'resposta'],
+            }},
+        },
+        'required': ['titulo', 'resumo', 'topicos', 'perguntas'],
+    },
+}
+
+
+def build_prompt(task, schema_name):
+    schema = json.dumps(SCHEMAS[schema_name], ensure_ascii=False)
+    return (f"{task}\n\nResponda APENAS com um objeto JSON válido (sem markdown, sem texto fora do JSON) "
+            f"que siga este JSON Schema, na ordem dos campos: {schema}")
+
+
+# Modo JSON do SDK só se a versão instalada tiver response_mime_type (google-generativeai >= 0.5)
+def generation_config():
+    try:
+        import google.generativeai as genai
+        config = genai.types.GenerationConfig
+        fields = getattr(config, '__dataclass_fields__', None) or getattr(config, '__annotations__', {})
+    except (ImportError, AttributeError):
+        return None
+    if 'response_mime_type' not in fields: return None
+    return config(response_mime_type='application/json')
+
+
+class JsonStream:
+    # feed(pedaço) -> lista de eventos:
+    #   ('field', chave, valor)           campo de primeiro nível completo
+    #   ('item', chave, índice, valor)    item completo de uma lista de primeiro nível
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.stack = []       # quadros: {'kind': 'obj'|'arr', 'state', 'key', 'vstart', 'kstart', 'count'}
+        self.in_string = False
+        self.escape = False
+        self.string_role = None
+        self.scalar_start = None
+        self.done = False
+        self.fields = {}
+        self.items = {}       # chave -> itens já completos (para resultados parciais)
+        self._events = []
+
+    def feed(self, text):
+        self.buffer += text
+        self._events = []
+        buffer = self.buffer
+        for i in range(self.pos, len(buffer)):
+            if self.done: break
+            self._step(buffer, i, buffer[i])
+        self.pos = len(buffer)
+        return self._events
+
+    def _step(self, buffer, i, c):
+        if self.in_string:
+            if self.escape: self.escape = False
+            elif c == '\\': self.escape = True
+            elif c == '"':
+                self.in_string = False
+                self._string_end(buffer, i + 1)
+            return
+        if self.scalar_start is not None:
+            if c not in ',}] \n\r\t': return
+            start, self.scalar_start = self.scalar_start, None
+            self._value_end(buffer, start, i)
+        if not self.stack:
+            if c == '{': self._push('obj', i)  # ignora o que vier antes (ex.: ```json)
+            return
+        if c in ' \n\r\t': return
+        frame = self.stack[-1]
+        state = frame['state']
+        if state == 'key':
+            if c == '"':
+                self.in_string, self.string_role = True, 'key'
+                frame['kstart'] = i
+            elif c == '}': self._pop(buffer, i)
+        elif state == 'colon':
+            if c == ':': frame['state'] = 'value'
+        elif state == 'after':
+            if c == ',': frame['state'] = 'key' if frame['kind'] == 'obj' else 'value'
+            elif c in '}]': self._pop(buffer, i)
+        else:  # esperando um valor
+            if c == ']' and frame['kind'] == 'arr':
+                self._pop(buffer, i)
+                return
+            frame['vstart'] = i
+            if c == '"': self.in_string, self.string_role = True, 'value'
+            elif c == '{': self._push('obj', i)
+            elif c == '[': self._push('arr', i)
+            else: self.scalar_start = i
+
+    def _push(self, kind, i):
+        self.stack.append({'kind': kind, 'state': 'key' if kind == 'obj' else 'value',
+                           'key': None, 'vstart': None, 'kstart': None, 'count': 0})
+
+    def _pop(self, buffer, i):
+        self.stack.pop()
+        if not self.stack:
+            self.done = True
+            return
+        parent = self.stack[-1]
+        self._value_end(buffer, parent['vstart'], i + 1)
+
+    def _string_end(self, buffer, end):
+        frame = self.stack[-1]
+        if self.string_role == 'key':
+            frame['key'] = json.loads(buffer[frame['kstart']:end])
+            frame['state'] = 'colon'
+        else:
+            self._value_end(buffer, frame['vstart'], end)
+
+    def _value_end(self, buffer, start, end):
+        frame = self.stack[-1]
+        frame['state'] = 'after'
+        depth = len(self.stack)
+        value = _INVALID
+        if depth == 1 or (depth == 2 and frame['kind'] == 'arr'):
+            try: value = json.loads(buffer[start:end])
+            except ValueError: pass
+        if depth == 1 and value is not _INVALID:
+            self.fields[frame['key']] = value
+            self._events.append(('field', frame['key'], value))
+        elif depth == 2 and frame['kind'] == 'arr' and value is not _INVALID:
+            key = self.stack[0]['key']
+            self.items.setdefault(key, []).append(value)
+            self._events.append(('item', key, frame['count'], value))
+        if frame['kind'] == 'arr': frame['count'] += 1
+
+    # O que já foi lido: campos completos + listas com os itens que chegaram a fechar
+    def partial(self):
+        result = {key: list(items) for key, items in self.items.items()}
+        result.update(self.fields)
+        return result
+
+
+def parse_output(text, stream=None):
+    if stream is None:
+        stream = JsonStream()
+        stream.feed(text)
+    if stream.done: return dict(stream.fields), True
+    return stream.partial(), False
+
+
+# Resultado final da rota: JSON completo, ou o parcial + texto cru em fallback_key
+def finalize(text, stream, fallback_key, schema_name=None):
+    result, complete = parse_output(text, stream)
+    if complete and isinstance(result, dict):
+        missing = [k for k in SCHEMAS.get(schema_name, {}).get('required', []) if k not in result]
+        if missing: result['missing'] = missing
+        return result
+    result = dict(result)
+    result[fallback_key] = text
+    result['partial'] = True
+    return result
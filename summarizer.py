@@ -0,0 +1,86 @@
+# summarizer.py - Resumo map-reduce para textos longos
+# Divide o texto em pedaços por orçamento de tokens, resume os pedaços em paralelo (pool limitado)
+# e reduz os resumos parciais em níveis até caberem num único prompt final.
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+# Estimativa local: ~4 caracteres por token (bom o bastante para orçamento de prompt)
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+def _pieces(text, max_chars):
+    # Parágrafos -> frases -> corte bruto, até cada pedaço caber em max_chars
+    for paragraph in re.split(r'\n\s*\n', text):
+        if len(paragraph) <= max_chars:
+            yield paragraph
+            continue
+        for sentence in _SENTENCE_END.split(paragraph):
+            for i in range(0, len(sentence), max_chars):
+                yield sentence[i:i + max_chars]
+
+
+def split_by_tokens(text, max_tokens):
+    max_chars = max_tokens * 4
+    chunks, current, size = [], [], 0
+    for piece in _pieces(text, max_chars):
+        if size + len(piece) > max_chars and current:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece) + 2
+    if current: chunks.append("\n\n".join(current))
+    return [c for c in chunks if c.strip()]
+
+
+# Junta chunks consecutivos que se sobrepõem (ex.: document_chunks com overlap)
+def merge_overlapping(chunks, max_overlap=400, min_overlap=20):
+    merged = ""
+    for chunk in chunks:
+        overlap = 0
+        for size in range(min(max_overlap, len(merged), len(chunk)), min_overlap - 1, -1):
+            if merged.endswith(chunk[:size]):
+                overlap = size
+                break
+        merged += chunk[overlap:]
+    return merged
+
+
+class Summarizer:
+    # generate(prompt) -> texto (passa pelo cache de respostas, então cada pedaço é cacheado)
+    def __init__(self, generate, chunk_tokens=8000, fan_out=4, fan_in=6, max_input_tokens=400000):
+        self.generate = generate
+        self.chunk_tokens = chunk_tokens
+        self.fan_in = max(fan_in, 2)
+        self.max_input_tokens = max_input_tokens
+        self._pool = ThreadPoolExecutor(max_workers=fan_out, thread_name_prefix='summary')
+
+    def _map(self, prompts):
+        return list(self._pool.map(self.generate, prompts))
+
+    # Devolve o prompt final (instrução + texto, ou instrução + resumos parciais).
+    # A última geração fica com a rota, que pode fazer streaming dela.
+    # budget: teto de tokens do prompt final (por rota); sem ele vale chunk_tokens.
+    def build_prompt(self, text, instruction, map_instruction=None, reduce_instruction=None, budget=None):
+        budget = budget or self.chunk_tokens
+        if estimate_tokens(text) > self.max_input_tokens:
+            text = text[:self.max_input_tokens * 4]
+        if estimate_tokens(text) + estimate_tokens(instruction) <= budget:
+            return f"{instruction}: {text}"
+
+        map_instruction = map_instruction or "Resuma de forma fiel e detalhada este trecho de um texto maior"
+        reduce_instruction = reduce_instruction or "Combine estes resumos parciais (em ordem) num único resumo"
+        chunks = split_by_tokens(text, min(self.chunk_tokens, budget))
+        partials = self._map([f"{map_instruction} (parte {i + 1}/{len(chunks)}): {chunk}"
+                              for i, chunk in enumerate(chunks)])
+
+        # Redução hierárquica: agrupa fan_in resumos por vez até o conjunto caber num prompt
+        while len(partials) > 1 and estimate_tokens("\n\n".join(partials)) > budget:
+            groups = [partials[i:i + self.fan_in] for i in range(0, len(partials), self.fan_in)]
+            partials = self._map([f"{reduce_instruction}:\n\n" + "\n\n---\n\n".join(group) for group in groups])
+
+        return f"{instruction} (a partir dos resumos parciais abaixo, em ordem): " + "\n\n---\n\n".join(partials)
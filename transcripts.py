@@ -0,0 +1,135 @@
+# transcripts.py - Transcrições do YouTube com cache persistente por video_id
+# Backends: youtube_transcript_api (sem baixar a página) e pytube (legendas + título/descrição).
+# Também guarda o resumo já gerado por (video_id, idioma).
+
+import json
+import os
+import re
+import sqlite3
+import xml.etree.ElementTree as ET
+
+from cache import MemoryCache, SQLiteCache
+
+LANGUAGES = ('pt', 'pt-BR', 'en', 'a.pt', 'a.en')
+
+_VIDEO_ID = re.compile(r'(?:v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})')
+
+
+def extract_video_id(url):
+    if not url: return None
+    match = _VIDEO_ID.search(url)
+    if match: return match.group(1)
+    return url if re.fullmatch(r'[A-Za-z0-9_-]{11}', url) else None
+
+
+class TranscriptUnavailable(Exception):
+    pass
+
+
+# --- BACKENDS ---
+class TranscriptApiBackend:
+    name = 'youtube_transcript_api'
+
+    def fetch(self, video_id):
+        from youtube_transcript_api import YouTubeTranscriptApi
+        languages = [code for code in LANGUAGES if not code.startswith('a.')]
+        try:
+            if hasattr(YouTubeTranscriptApi, 'get_transcript'):  # API 0.x (métodos de classe)
+                snippets = YouTubeTranscriptApi.get_transcript(video_id, languages=languages)
+            else:  # API 1.x (instância + fetch)
+                snippets = YouTubeTranscriptApi().fetch(video_id, languages=languages)
+        except Exception as e: raise TranscriptUnavailable(str(e))
+        text = " ".join((s['text'] if isinstance(s, dict) else s.text) for s in snippets).strip()
+        if not text: raise TranscriptUnavailable("Transcrição vazia")
+        return {'text': text, 'source': self.name}
+
+
+class PytubeBackend:
+    name = 'pytube'
+
+    def fetch(self, video_id):
+        from pytube import YouTube
+        # Um único objeto YouTube por vídeo: metadados e lista de legendas vêm da mesma busca
+        yt = YouTube(f"https://www.youtube.com/watch?v={video_id}")
+        captions = {c.code: c for c in yt.captions}
+        caption = next((captions[code] for code in LANGUAGES if code in captions), None)
+        meta = {'title': yt.title, 'description': yt.description, 'source': self.name}
+        if caption is None:
+            return dict(meta, text=f"Título: {meta['title']}. Desc: {meta['description']}", language=None)
+        root = ET.fromstring(caption.xml_captions)
+        text = " ".join(elem.text for elem in root.iter() if elem.tag in ('text', 'p') and elem.text)
+        return dict(meta, text=text, language=caption.code)
+
+
+BACKENDS = {'youtube_transcript_api': TranscriptApiBackend, 'pytube': PytubeBackend}
+
+
+# --- SERVIÇO ---
+class TranscriptService:
+    def __init__(self, backends, memory, persistent=None, ttl=7 * 24 * 3600, summary_ttl=30 * 24 * 3600):
+        self.backends = backends
+        self.memory = memory
+        self.persistent = persistent
+        self.ttl = ttl
+        self.summary_ttl = summary_ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.persistent is not None:
+            try: value = self.persistent.get(key)
+            except sqlite3.Error: value = None
+            if value is not None: self.memory.set(key, value)
+        return json.loads(value) if value is not None else None
+
+    def _set(self, key, data, ttl):
+        value = json.dumps(data, ensure_ascii=False)
+        self.memory.set(key, value, ttl)
+        if self.persistent is not None:
+            try: self.persistent.set(key, value, ttl)
+            except sqlite3.Error as e: print(f"Erro cache de transcrições: {e}")
+
+    def get_transcript(self, video_id):
+        cached = self._get(f"transcript:{video_id}")
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        errors = []
+        for backend in self.backends:
+            try: data = backend.fetch(video_id)
+            except ImportError as e:
+                errors.append(f"{backend.name}: não instalado ({e})")
+                continue
+            except Exception as e:
+                errors.append(f"{backend.name}: {e}")
+                continue
+            data['video_id'] = video_id
+            self._set(f"transcript:{video_id}", data, self.ttl)
+            return data
+        raise TranscriptUnavailable("; ".join(errors) or "Nenhum backend de transcrição configurado")
+
+    def get_summary(self, video_id, language):
+        cached = self._get(f"summary:{video_id}:{language}")
+        return cached['summary'] if cached else None
+
+    def save_summary(self, video_id, language, summary):
+        if summary: self._set(f"summary:{video_id}:{language}", {'summary': summary}, self.summary_ttl)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'items': len(self.memory)}
+
+
+def build_transcript_service():
+    names = os.environ.get('TRANSCRIPT_BACKENDS', 'youtube_transcript_api,pytube').split(',')
+    backends = [BACKENDS[n.strip()]() for n in names if n.strip() in BACKENDS]
+    ttl = int(os.environ.get('TRANSCRIPT_CACHE_TTL', 7 * 24 * 3600))
+    memory = MemoryCache(max_items=2000, max_bytes=64 * 1024 * 1024, ttl=ttl)
+    persistent = None
+    db_path = os.environ.get('TRANSCRIPT_CACHE_DB')
+    if db_path:
+        try: persistent = SQLiteCache(db_path, ttl=ttl, max_rows=100000, table='transcript_cache')
+        except sqlite3.Error as e: print(f"Erro ao abrir cache de transcrições: {e}")
+    return TranscriptService(backends, memory, persistent, ttl=ttl,
+                             summary_ttl=int(os.environ.get('VIDEO_SUMMARY_TTL', 30 * 24 * 3600)))
@@ -0,0 +1,164 @@
+# vector_index.py - Índice vetorial em memória (NumPy) para o /ask-document
+# Cada usuário tem uma matriz float32 normalizada; a busca é um único produto matriz-vetor.
+# Antes de usar o índice em cache, uma consulta barata (documentos + contagem de chunks) confere se
+# outro worker recebeu um upload desde a carga; se mudou, o usuário é recarregado.
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _as_vector(embedding):
+    # pgvector chega pelo PostgREST como string "[0.1,0.2,...]"
+    if isinstance(embedding, str): embedding = json.loads(embedding)
+    return np.asarray(embedding, dtype=np.float32)
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class UserIndex:
+    def __init__(self, rows, version=None):
+        self.version = version
+        self.contents = [r['content'] for r in rows]
+        if rows: self.matrix = _normalize(np.vstack([_as_vector(r['embedding']) for r in rows]))
+        else: self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.loaded_at = time.time()
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + sum(len(c) for c in self.contents)
+
+    def add(self, rows):
+        if not rows: return
+        new = _normalize(np.vstack([_as_vector(r['embedding']) for r in rows]))
+        # contents antes da matriz: uma busca concorrente nunca vê linha sem texto
+        self.contents.extend(r['content'] for r in rows)
+        self.matrix = new if self.matrix.size == 0 else np.vstack([self.matrix, new])
+
+    def search(self, query, k=3, threshold=0.5):
+        if self.matrix.size == 0: return []
+        q = _normalize(_as_vector(query)[None, :])[0]
+        scores = self.matrix @ q
+        k = min(k, len(scores))
+        if k <= 0: return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [{'content': self.contents[i], 'similarity': float(scores[i])} for i in top if scores[i] >= threshold]
+
+
+class VectorIndex:
+    # loader(user_id) -> lista de {'content', 'embedding'} com todos os chunks do usuário
+    # version(user_id) -> valor que muda quando os documentos/chunks do usuário mudam (opcional)
+    def __init__(self, loader, max_users=64, max_bytes=512 * 1024 * 1024, ttl=600, version=None):
+        self.loader = loader
+        self.version = version
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.loads = 0
+        self.stale_loads = 0
+        self.evictions = 0
+
+    def _fresh(self, index, version):
+        if index is None or time.time() - index.loaded_at >= self.ttl: return False
+        return self.version is None or index.version == version
+
+    def _get(self, user_id):
+        # Fora do lock: é uma ida ao banco
+        version = self.version(user_id) if self.version is not None else None
+        with self._lock:
+            index = self._users.get(user_id)
+            if self._fresh(index, version):
+                self._users.move_to_end(user_id)
+                return index
+            if index is not None and time.time() - index.loaded_at < self.ttl: self.stale_loads += 1
+            load_lock = self._load_locks.setdefault(user_id, threading.Lock())
+
+        # Carrega fora do lock global; requisições simultâneas do mesmo usuário esperam uma só carga
+        with load_lock:
+            with self._lock:
+                index = self._users.get(user_id)
+                if self._fresh(index, version): return index
+            # A versão é lida antes dos chunks: um upload no meio deixa a versão velha e força nova carga
+            index = UserIndex(self.loader(user_id), version)
+            self.loads += 1
+            with self._lock:
+                self._users[user_id] = index
+                self._users.move_to_end(user_id)
+                self._load_locks.pop(user_id, None)
+                self._evict()
+            return index
+
+    def _evict(self):
+        total = sum(i.nbytes for i in self._users.values())
+        while len(self._users) > 1 and (len(self._users) > self.max_users or total > self.max_bytes):
+            _, old = self._users.popitem(last=False)
+            total -= old.nbytes
+            self.evictions += 1
+
+    def search(self, user_id, query, k=3, threshold=0.5):
+        return self._get(user_id).search(query, k, threshold)
+
+    # Atualização incremental após um upload (só se o usuário já está carregado)
+    def add(self, user_id, rows):
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None: return
+            index.add(rows)
+            self._evict()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'chunks': sum(len(i.contents) for i in self._users.values()),
+                'bytes': sum(i.nbytes for i in self._users.values()),
+                'loads': self.loads,
+                'stale_loads': self.stale_loads,
+                'evictions': self.evictions,
+            }
+
+
+def supabase_chunk_loader(get_client, page_size=1000):
+    def load(user_id):
+        client = get_client()
+        docs = client.table('documents').select('id').eq('user_id', user_id).execute().data or []
+        doc_ids = [d['id'] for d in docs]
+        rows = []
+        if not doc_ids: return rows
+        start = 0
+        while True:
+            # Paginação com range() só é estável com ORDER BY: sem ele o Postgres pode repetir/pular linhas
+            page = client.table('document_chunks').select('content, embedding') \
+                .in_('document_id', doc_ids).order('document_id').order('chunk_index') \
+                .range(start, start + page_size - 1).execute().data or []
+            rows.extend(page)
+            if len(page) < page_size: return rows
+            start += page_size
+    return load
+
+
+def supabase_chunk_version(get_client):
+    def version(user_id):
+        client = get_client()
+        docs = client.table('documents').select('id').eq('user_id', user_id).execute().data or []
+        doc_ids = sorted(d['id'] for d in docs)
+        if not doc_ids: return ()
+        resp = client.table('document_chunks').select('document_id', count='exact') \
+            .in_('document_id', doc_ids).limit(1).execute()
+        return (tuple(doc_ids), getattr(resp, 'count', None))
+    return version
@@ -0,0 +1,299 @@
+# webhooks.py - Webhooks do Stripe: idempotência, ordem por cliente e aplicação no Supabase
+# O id do evento vai para um armazenamento de idempotência (SQLite, compartilhado entre os workers
+# da máquina); reenvios de eventos já aplicados ou em andamento são ignorados, mas o reenvio de um
+# evento que falhou (ou cujo worker sumiu) é processado de novo. Eventos mais antigos que o último
+# já aplicado para o cliente são descartados.
+#
+# Padrão: o evento é aplicado ANTES da resposta ao Stripe (mesmo cliente -> mesma trava, em ordem).
+# Se falhar, a resposta é 500 e o próprio Stripe reenvia por até 3 dias: nada depende do SQLite local
+# sobreviver a um redeploy. WEBHOOK_ASYNC=1 responde na hora e aplica em filas em segundo plano; aí
+# um evento confirmado e ainda não aplicado só existe no WEBHOOK_DB, que precisa ser persistente.
+# Nesse modo quem falha nas tentativas rápidas fica pendente com o lease adiado (60 s ... até 1 h)
+# e é retomado pela recuperação, que roda num timer. Eventos finalizados saem após `retention`.
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+
+PENDING, DONE, FAILED, STALE, IGNORED = 'pending', 'done', 'failed', 'stale', 'ignored'
+
+
+def customer_key(event):
+    obj = (event.get('data') or {}).get('object') or {}
+    return obj.get('customer') or (obj.get('metadata') or {}).get('user_id') or event['id']
+
+
+class WebhookEventStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS stripe_events (id TEXT PRIMARY KEY, type TEXT, customer TEXT, "
+            "created INTEGER, payload TEXT, status TEXT, attempts INTEGER DEFAULT 0, error TEXT, "
+            "received_at REAL, updated_at REAL, lease_until REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS stripe_events_status ON stripe_events (status, lease_until)")
+        conn.execute("CREATE TABLE IF NOT EXISTS stripe_customers (customer TEXT PRIMARY KEY, last_created INTEGER, last_event TEXT)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        # Conexão herdada de um fork (gunicorn --preload) não pode ser reutilizada
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # True se o evento deve ser processado: novo, ou reenvio de um que falhou / cujo lease venceu.
+    # False para reenvios de eventos aplicados, descartados ou ainda em andamento.
+    def record(self, event, payload, status, lease):
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO stripe_events (id, type, customer, created, payload, status, received_at, updated_at, lease_until) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET payload = excluded.payload, status = excluded.status, attempts = 0, "
+            "error = NULL, updated_at = excluded.updated_at, lease_until = excluded.lease_until "
+            "WHERE stripe_events.status = ? OR (stripe_events.status = ? AND stripe_events.lease_until < ?)",
+            (event['id'], event.get('type'), customer_key(event), int(event.get('created') or 0), payload,
+             status, now, now, now + lease, FAILED, PENDING, now)
+        )
+        return cursor.rowcount == 1
+
+    def set_status(self, event_id, status, attempts=None, error=None):
+        self._conn().execute(
+            "UPDATE stripe_events SET status = ?, attempts = COALESCE(?, attempts), error = ?, updated_at = ? WHERE id = ?",
+            (status, attempts, error, time.time(), event_id)
+        )
+
+    # Renova o lease antes de processar; None se o evento já saiu de pendente (outro worker cuidou),
+    # senão o número de tentativas já feitas
+    def touch(self, event_id, lease):
+        conn = self._conn()
+        cursor = conn.execute(
+            "UPDATE stripe_events SET lease_until = ? WHERE id = ? AND status = ?", (time.time() + lease, event_id, PENDING)
+        )
+        if cursor.rowcount != 1: return None
+        return conn.execute("SELECT attempts FROM stripe_events WHERE id = ?", (event_id,)).fetchone()[0] or 0
+
+    # Continua pendente, mas só volta a ser reivindicado (claim_orphans) depois de delay segundos
+    def reschedule(self, event_id, attempts, error, delay):
+        now = time.time()
+        self._conn().execute(
+            "UPDATE stripe_events SET attempts = ?, error = ?, updated_at = ?, lease_until = ? WHERE id = ? AND status = ?",
+            (attempts, error, now, now + delay, event_id, PENDING)
+        )
+
+    def last_applied(self, customer):
+        row = self._conn().execute("SELECT last_created FROM stripe_customers WHERE customer = ?", (customer,)).fetchone()
+        return row[0] if row else None
+
+    def mark_applied(self, event, customer, attempts):
+        conn = self._conn()
+        created = int(event.get('created') or 0)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO stripe_customers (customer, last_created, last_event) VALUES (?, ?, ?) "
+                "ON CONFLICT(customer) DO UPDATE SET last_created = MAX(last_created, excluded.last_created), "
+                "last_event = CASE WHEN excluded.last_created >= last_created THEN excluded.last_event ELSE last_event END",
+                (customer, created, event['id'])
+            )
+            conn.execute("UPDATE stripe_events SET status = ?, attempts = ?, error = NULL, updated_at = ? WHERE id = ?",
+                         (DONE, attempts, time.time(), event['id']))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # Eventos pendentes cujo worker sumiu (lease vencido): assume e devolve para reprocessar
+    def claim_orphans(self, lease, limit=500):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, payload FROM stripe_events WHERE status = ? AND lease_until < ? ORDER BY created LIMIT ?",
+                (PENDING, now, limit)
+            ).fetchall()
+            conn.executemany("UPDATE stripe_events SET lease_until = ? WHERE id = ?", [(now + lease, r[0]) for r in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [json.loads(payload) for _, payload in rows]
+
+    # Precisa cobrir a janela de reenvios do Stripe (3 dias), senão um reenvio tardio vira evento novo
+    def prune(self, retention):
+        return self._conn().execute(
+            "DELETE FROM stripe_events WHERE status IN (?, ?, ?, ?) AND updated_at < ?",
+            (DONE, STALE, IGNORED, FAILED, time.time() - retention)
+        ).rowcount
+
+    def counts(self):
+        return dict(self._conn().execute("SELECT status, COUNT(*) FROM stripe_events GROUP BY status").fetchall())
+
+
+class WebhookProcessor:
+    # handlers: {tipo_do_evento: fn(evento)}; fn levanta exceção se precisar tentar de novo
+    # max_attempts/retry_base: tentativas rápidas na thread; max_retries/retry_delay/max_retry_delay:
+    # rodadas seguintes, agendadas com atraso crescente antes de o evento ser dado como falho
+    # inline=True: aplica dentro da requisição (falha -> 500 -> o Stripe reenvia); False: filas em segundo plano
+    def __init__(self, store, handlers, shards=4, max_attempts=3, retry_base=1.0, lease=120,
+                 max_retries=30, retry_delay=60.0, max_retry_delay=3600.0, inline=True,
+                 recover_interval=30.0, retention=30 * 86400, prune_every=500):
+        self.store = store
+        self.handlers = handlers
+        self.shards = shards
+        self.inline = inline
+        self.recover_interval = recover_interval
+        self.retention = retention
+        self.prune_every = prune_every
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.lease = lease
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._queues = []
+        self._shard_locks = [threading.Lock() for _ in range(shards)]
+        self._pid = None
+        self._lock = threading.Lock()
+        self.received = 0
+        self.duplicates = 0
+        self.applied = 0
+        self.stale = 0
+        self.retried = 0
+        self.failed = 0
+
+    # Chamado na requisição. Devolve 'duplicate', 'ignored', 'queued' (assíncrono) ou, aplicando na hora,
+    # 'applied', 'stale' ou 'failed' (a rota responde 500 para o Stripe reenviar)
+    def submit(self, event, payload):
+        handled = event.get('type') in self.handlers
+        if not self.store.record(event, payload, PENDING if handled else IGNORED, self.lease):
+            self.duplicates += 1
+            return 'duplicate'
+        self.received += 1
+        if self.received % self.prune_every == 0:
+            try: self.store.prune(self.retention)
+            except sqlite3.Error as e: print(f"Erro ao limpar eventos do Stripe: {e}")
+        if not handled: return 'ignored'
+        if self.inline:
+            with self._shard_locks[self._shard(event)]: return self._process(event) or 'duplicate'
+        self._enqueue(event)
+        return 'queued'
+
+    def _shard(self, event):
+        return zlib.crc32(customer_key(event).encode('utf-8')) % self.shards
+
+    def _enqueue(self, event):
+        self._ensure_started()
+        self._queues[self._shard(event)].put(event)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid(): return
+        with self._lock:
+            if self._pid == os.getpid(): return
+            # Threads não sobrevivem ao fork: cada worker sobe as suas
+            self._queues = [queue.Queue() for _ in range(self.shards)]
+            for i, q in enumerate(self._queues):
+                threading.Thread(target=self._worker, args=(q,), name=f'stripe-webhook-{i}', daemon=True).start()
+            threading.Thread(target=self._recovery_loop, name='stripe-webhook-recovery', daemon=True).start()
+            self._pid = os.getpid()
+
+    # Modo assíncrono: sobe as filas já no worker, para a recuperação não depender de um evento novo chegar
+    def start(self):
+        if not self.inline: self._ensure_started()
+        return self
+
+    def _worker(self, q):
+        while True:
+            event = q.get()
+            try: self._process(event)
+            except Exception as e: print(f"Erro no webhook {event.get('id')}: {e}")
+
+    # Timer próprio: com fila sempre ocupada a recuperação (e as rodadas adiadas) ainda rodam
+    def _recovery_loop(self):
+        while True:
+            time.sleep(self.recover_interval)
+            try: self.recover()
+            except Exception as e: print(f"Erro na recuperação de webhooks: {e}")
+
+    def _process(self, event):
+        previous = self.store.touch(event['id'], self.lease)
+        if previous is None: return None
+        customer = customer_key(event)
+        last = self.store.last_applied(customer)
+        if last is not None and int(event.get('created') or 0) < last:
+            self.stale += 1
+            self.store.set_status(event['id'], STALE)
+            return 'stale'
+        handler = self.handlers[event['type']]
+        for attempt in range(previous + 1, previous + self.max_attempts + 1):
+            try: handler(event)
+            except Exception as e:
+                if attempt < previous + self.max_attempts:
+                    time.sleep(self.retry_base * (2 ** (attempt - previous - 1)))
+                    continue
+                rounds = attempt // self.max_attempts
+                if self.inline:
+                    # O Stripe reenvia (e o reenvio de um evento falho é aceito como trabalho novo)
+                    self.failed += 1
+                    self.store.set_status(event['id'], FAILED, attempts=attempt, error=str(e))
+                    print(f"Webhook {event['id']} falhou após {attempt} tentativas, aguardando reenvio do Stripe: {e}")
+                    return 'failed'
+                if rounds <= self.max_retries:
+                    self.retried += 1
+                    delay = min(self.retry_delay * (2 ** (rounds - 1)), self.max_retry_delay)
+                    self.store.reschedule(event['id'], attempt, str(e), delay)
+                    print(f"Webhook {event['id']} falhou ({attempt} tentativas), nova rodada em {delay:.0f}s: {e}")
+                else:
+                    self.failed += 1
+                    self.store.set_status(event['id'], FAILED, attempts=attempt, error=str(e))
+                    print(f"Webhook {event['id']} falhou após {attempt} tentativas: {e}")
+                return 'failed'
+            self.store.mark_applied(event, customer, attempt)
+            self.applied += 1
+            return 'applied'
+
+    # Reprocessa pendentes de workers que morreram antes de aplicar (ex.: deploy no meio da fila)
+    def recover(self):
+        try: events = self.store.claim_orphans(self.lease)
+        except sqlite3.Error as e:
+            print(f"Erro ao recuperar webhooks pendentes: {e}")
+            return 0
+        for event in events: self._enqueue(event)
+        return len(events)
+
+    def pending(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self):
+        return {'received': self.received, 'duplicates': self.duplicates, 'applied': self.applied,
+                'stale': self.stale, 'retried': self.retried, 'failed': self.failed, 'queued': self.pending()}
+
+
+def build_webhook_processor(handlers):
+    db_path = os.environ.get('WEBHOOK_DB', '/tmp/adapta-stripe-events.db')
+    inline = os.environ.get('WEBHOOK_ASYNC') != '1'
+    if not inline and db_path.startswith('/tmp/'):
+        print(f"AVISO: WEBHOOK_ASYNC=1 com WEBHOOK_DB em {db_path}: eventos confirmados e ainda não "
+              "aplicados se perdem num redeploy. Use um volume persistente.")
+    store = WebhookEventStore(db_path)
+    return WebhookProcessor(
+        store, handlers,
+        inline=inline,
+        recover_interval=float(os.environ.get('WEBHOOK_RECOVER_INTERVAL', 30)),
+        retention=int(os.environ.get('WEBHOOK_RETENTION_DAYS', 30)) * 86400,
+        shards=int(os.environ.get('WEBHOOK_WORKERS', 4)),
+        max_attempts=int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 3)),
+        max_retries=int(os.environ.get('WEBHOOK_MAX_RETRIES', 30)),
+        retry_delay=float(os.environ.get('WEBHOOK_RETRY_DELAY', 60)),
+        max_retry_delay=float(os.environ.get('WEBHOOK_MAX_RETRY_DELAY', 3600)),
+    )
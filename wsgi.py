@@ -1,4 +1,12 @@
+import os
+
 from app import app
+from services import registry
+
+# Com "gunicorn --preload", PRELOAD_SERVICES=1 importa os SDKs pesados uma vez no master.
+# Os clients em si continuam sendo criados depois do fork, no primeiro uso de cada worker.
+if os.environ.get('PRELOAD_SERVICES') == '1':
+    registry.preload_imports()
 
 if __name__ == "__main__":
-    app.run()
\ No newline at end of file
+    app.run()